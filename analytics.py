@@ -0,0 +1,176 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE analytics.py
+
+# SYNOPSIS
+# Provides analyses of the review log (see reviews.py): retention by
+# interval, lapse rates by item, and the workload by day.
+# Typically only the function analyse() will be used.
+
+# The log is read once, block by block, and each block is folded into
+# running totals, so memory does not grow with the length of the
+# log. A review is an answer to a solution in REVIEW; it is recalled
+# unless the result is HARD, in which case it is a lapse.
+# Retention is totalled by interval bucket: bucket b holds intervals
+# of less than 2**b days (bucket 0 holds intervals of zero days).
+
+# NumPy is optional. If it is installed, each block is folded with
+# vectorised operations; otherwise record by record.
+
+import datetime
+
+import tree
+import trainer
+import reviews
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
+
+# Status and result values of reviews and lapses.
+REVIEW = tree.Status.REVIEW.value
+HARD = trainer.Result.HARD.value
+NEW = tree.Status.NEW.value
+
+# Number of interval buckets.
+BUCKETS = 17
+
+# The totals of an analysis.
+# retention[b] is a list [reviews, lapses] for interval bucket b;
+# items maps item ids to lists [reviews, lapses]; days maps date
+# ordinals to lists [new, learning, review] of answers; records is
+# the number of records read.
+class Analysis :
+    def __init__(self) :
+        self.retention = [[0, 0] for bucket in range(BUCKETS)]
+        self.items = {}
+        self.days = {}
+        self.records = 0
+
+    # retention_curve()
+    # Returns the retention by interval bucket, as tuples (upper bound
+    # of the bucket in days, reviews, proportion recalled), for the
+    # buckets holding any reviews.
+    def retention_curve(self) :
+        curve = []
+        for bucket, (count, lapses) in enumerate(self.retention) :
+            if (count != 0) :
+                curve.append((2 ** bucket, count, 1 - lapses / count))
+        return curve
+
+    # lapse_rates()
+    # Returns the lapse rates of items, as a dictionary of tuples
+    # (reviews, proportion lapsed) by item id.
+    def lapse_rates(self) :
+        return {item : (count, lapses / count)
+                for item, (count, lapses) in self.items.items()
+                if count != 0}
+
+    # workload()
+    # Returns the answers by day, as a list of tuples (date, new,
+    # learning, review), in order of date.
+    def workload(self) :
+        return [(datetime.date.fromordinal(day),) + tuple(counts)
+                for day, counts in sorted(self.days.items())]
+
+# analyse()
+# Analyses the review log at path. Returns an Analysis.
+def analyse(path) :
+    analysis = Analysis()
+    fold = fold_vectorised if numpy != None else fold_block
+    for block in reviews.read_blocks(path) :
+        fold(analysis, block)
+    return analysis
+
+# fold_block()
+# Adds the records of a block to the totals of an analysis.
+def fold_block(analysis, block) :
+    retention = analysis.retention
+    items = analysis.items
+    days = analysis.days
+    count = 0
+    for item, solution, day, result, status, interval \
+        in reviews.RECORD.iter_unpack(block) :
+        count += 1
+        totals = days.get(day)
+        if (totals == None) :
+            totals = days[day] = [0, 0, 0]
+        if (status == REVIEW) :
+            totals[2] += 1
+            lapse = (result == HARD)
+            bucket = retention[interval.bit_length()]
+            bucket[0] += 1
+            bucket[1] += lapse
+            totals = items.get(item)
+            if (totals == None) :
+                totals = items[item] = [0, 0]
+            totals[0] += 1
+            totals[1] += lapse
+        elif (status == NEW) :
+            totals[0] += 1
+        else :
+            totals[1] += 1
+    analysis.records += count
+
+# Record layout for NumPy.
+if (numpy != None) :
+    RECORD_DTYPE = numpy.dtype([("item", "<u4"), ("solution", "<u4"),
+                                ("day", "<u4"), ("result", "u1"),
+                                ("status", "u1"), ("interval", "<u2")])
+
+# fold_vectorised()
+# As fold_block(), with vectorised operations.
+def fold_vectorised(analysis, block) :
+    records = numpy.frombuffer(block, dtype = RECORD_DTYPE)
+    analysis.records += len(records)
+    status = records["status"]
+    review = (status == REVIEW)
+    lapse = review & (records["result"] == HARD)
+    intervals = records["interval"][review].astype(numpy.float64)
+    buckets = numpy.frexp(intervals)[1]
+    counts = numpy.bincount(buckets, minlength = BUCKETS)
+    lapses = numpy.bincount(buckets, weights = lapse[review],
+                            minlength = BUCKETS)
+    for bucket in range(BUCKETS) :
+        analysis.retention[bucket][0] += int(counts[bucket])
+        analysis.retention[bucket][1] += int(lapses[bucket])
+    add_grouped(analysis.items, records["item"][review],
+                [numpy.ones(int(review.sum()), dtype = numpy.int64),
+                 lapse[review]], 2)
+    kind = numpy.where(status == NEW, 0, numpy.where(review, 2, 1))
+    add_grouped(analysis.days, records["day"],
+                [kind == 0, kind == 1, kind == 2], 3)
+
+# add_grouped()
+# Adds columns, grouped and summed by key, to lists of width totals
+# in a dictionary.
+def add_grouped(totals, keys, columns, width) :
+    unique, inverse = numpy.unique(keys, return_inverse = True)
+    sums = [numpy.bincount(inverse, weights = column,
+                           minlength = len(unique))
+            for column in columns]
+    for index, key in enumerate(unique.tolist()) :
+        entry = totals.get(key)
+        if (entry == None) :
+            entry = totals[key] = [0] * width
+        for column in range(width) :
+            entry[column] += int(sums[column][index])
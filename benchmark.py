@@ -0,0 +1,1273 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# benchmark.py
+
+# SYNOPSIS
+# A script that measures the performance of Chessic's hot paths.
+# Usage:
+#
+#     python3 benchmark.py [-o <results>] [<benchmark> ...]
+#     python3 benchmark.py --compare <old-results> <new-results>
+#
+# With no benchmarks named, every benchmark is run. Each benchmark
+# returns a dictionary of measurements; the results are printed as
+# JSON, and also written to a file with `-o', together with the
+# version of python and the git commit, so that results of different
+# versions can be compared with `--compare'. Times are in seconds.
+
+import io
+import os
+import gc
+import sys
+import glob
+import time
+import json
+import pickle
+import random
+import shutil
+import asyncio
+import datetime
+import platform
+import tempfile
+import subprocess
+import zlib
+import tracemalloc
+
+import chess
+import chess.pgn
+
+import graphics
+import tree
+import paths
+import cache
+import locks
+import stats
+import trainer
+import reader
+import synthetic
+import server
+import manager
+import export
+import writer
+import store
+import compression
+import mapped
+import reviews
+import analytics
+import scheduler
+import sync
+import queues
+import snapshots
+import rollover
+
+# Sink
+# A stand-in for sys.stdout that counts, rather than displays,
+# what is written to it.
+class Sink :
+    def __init__(self) :
+        self.writes = 0
+        self.bytes = 0
+
+    def write(self, string) :
+        self.writes += 1
+        self.bytes += len(string.encode())
+
+    def flush(self) :
+        pass
+
+# timed()
+# Calls function the given number of times with stdout redirected
+# to a Sink. Returns the mean latency in microseconds, the mean
+# number of bytes written and the mean number of write calls.
+def timed(function, repeats) :
+    sink = Sink()
+    stdout = sys.stdout
+    sys.stdout = sink
+    try :
+        start = time.perf_counter()
+        for repeat in range(repeats) :
+            function(repeat)
+        elapsed = time.perf_counter() - start
+    finally :
+        sys.stdout = stdout
+    return {"latency_us" : round(elapsed / repeats * 1e6, 2),
+            "bytes" : sink.bytes // repeats,
+            "writes" : sink.writes // repeats}
+
+# sample_frame()
+# Composes a typical training screen through the graphics module.
+# Alternate repeats show positions one move apart, which is the
+# usual difference between consecutive frames.
+def sample_frame(boards, repeat) :
+    graphics.clear()
+    graphics.write("TRAINING ITEM ->".ljust(18) + "English")
+    graphics.write("CATEGORY".ljust(18) + "Sample-Category")
+    graphics.write("COLLECTION".ljust(18) + "Sample-Collection")
+    graphics.write("")
+    graphics.write("REVIEW".ljust(18) + "3 | 2 | 17\n\n\n")
+    graphics.print_board(boards[repeat % 2], True)
+    graphics.write("\n\n<Enter> show solution")
+    graphics.write("'p' pause session")
+    graphics.flush()
+
+# legacy_frame()
+# Produces the same screen as sample_frame() the way Chessic used
+# to: forty blank lines followed by one print() per line.
+def legacy_frame(boards, repeat) :
+    for line in range(40) :
+        print("")
+    board = boards[repeat % 2]
+    board_string = graphics.board_print_string(board, True)
+    print("TRAINING ITEM ->".ljust(18) + "English")
+    print("CATEGORY".ljust(18) + "Sample-Category")
+    print("COLLECTION".ljust(18) + "Sample-Collection")
+    print("")
+    print("REVIEW".ljust(18) + "3 | 2 | 17\n\n\n")
+    print(board_string)
+    print("\n\n<Enter> show solution")
+    print("'p' pause session")
+
+# bench_frames()
+# Measures frame latency and bytes written per frame for the old
+# line-by-line output, full buffered frames and diffed frames.
+def bench_frames(repeats = 2000) :
+    board = chess.Board()
+    boards = [board.copy(), board.copy()]
+    boards[1].push_san("e4")
+    legacy = timed(lambda repeat : legacy_frame(boards, repeat),
+                   repeats)
+
+    diff_frames = graphics.diff_frames
+    try :
+        graphics.diff_frames = False
+        full = timed(lambda repeat : sample_frame(boards, repeat),
+                     repeats)
+        graphics.diff_frames = True
+        diffed = timed(lambda repeat : sample_frame(boards, repeat),
+                       repeats)
+    finally :
+        graphics.diff_frames = diff_frames
+    return {"legacy" : legacy, "full" : full, "diff" : diffed}
+
+# legacy_game()
+# Returns a tree in the representation used by earlier versions of
+# Chessic: a python chess game with training data and metadata
+# attached to its nodes.
+def legacy_game(root) :
+    game = tree.to_game(root)
+    game.meta = root.meta
+    game.training = None
+    stack = [(root, game)]
+    while (len(stack) != 0) :
+        node, game_node = stack.pop()
+        for child, game_child in zip(node.variations,
+                                     game_node.variations) :
+            if (tree.is_solution(child)) :
+                game_child.training = tree.TrainingData()
+            else :
+                game_child.training = None
+            stack.append((child, game_child))
+    return game
+
+# traced()
+# Returns the result of calling function, and the number of bytes
+# it allocated that remain allocated.
+def traced(function) :
+    tracemalloc.start()
+    try :
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+    finally :
+        tracemalloc.stop()
+    return result, size
+
+# bench_memory()
+# Measures the memory per node of a large synthetic tree, in the
+# python chess representation and in Chessic's compact one.
+def bench_memory(size = 50000) :
+    root = synthetic.generate(size)
+    game, legacy = traced(lambda : legacy_game(root))
+    colour = root.meta.colour
+    del root
+    root, compact = traced(lambda : tree.from_game(game, colour))
+    return {"nodes" : size,
+            "legacy_bytes_per_node" : round(legacy / size, 1),
+            "compact_bytes_per_node" : round(compact / size, 1),
+            "ratio" : round(legacy / compact, 2)}
+
+# seconds()
+# Returns the result of calling function, and the time it took.
+def seconds(function) :
+    start = time.perf_counter()
+    result = function()
+    return result, round(time.perf_counter() - start, 4)
+
+# bench_flat()
+# Compares the recursive walks over linked nodes with linear scans
+# over flattened trees, for statistics, queue generation and
+# loading-plus-statistics, on synthetic trees of increasing size.
+def bench_flat(sizes = (10000, 100000, 1000000)) :
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, legal = False)
+        result = {}
+        recursive, result["stats_recursive"] = seconds(
+            lambda : stats.training_stats(root))
+        flat, result["flatten"] = seconds(lambda : tree.flatten(root))
+        scanned, result["stats_flat"] = seconds(
+            lambda : stats.flat_training_stats(flat))
+        queue, result["queue_recursive"] = seconds(
+            lambda : trainer.generate_queue(root))
+        flat_queue, result["queue_flat"] = seconds(
+            lambda : trainer.generate_flat_queue(flat))
+        assert recursive == scanned and queue == flat_queue
+
+        with tempfile.TemporaryDirectory() as dirpath :
+            filepath = dirpath + "/item.rpt"
+            tree.save(filepath, root)
+            del root, flat, queue, flat_queue
+            loaded, result["load_stats_recursive"] = seconds(
+                lambda : stats.training_stats(tree.load(filepath)))
+            loaded, result["load_stats_flat"] = seconds(
+                lambda : stats.flat_training_stats(
+                    tree.load_flat(filepath)))
+        results[size] = result
+    return results
+
+# bench_numpy()
+# Compares the NumPy statistics with the python scan and the
+# recursive walk, for items of increasing size and for a category
+# of many items, checking that all agree. Skipped if NumPy is not
+# installed.
+def bench_numpy(sizes = (10000, 100000, 1000000), items = 200) :
+    if (stats.numpy == None) :
+        return {"skipped" : "NumPy is not installed"}
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, legal = False)
+        flat = tree.flatten(root)
+        result = {}
+        recursive, result["recursive"] = seconds(
+            lambda : stats.training_stats(root))
+        scanned, result["flat"] = seconds(
+            lambda : stats.flat_training_stats(flat))
+        vectorised, result["numpy"] = seconds(
+            lambda : stats.item_training_stats(flat))
+        assert recursive == scanned == vectorised
+        results[size] = result
+
+    numpy = stats.numpy
+    with tempfile.TemporaryDirectory() as dirpath :
+        for item in range(items) :
+            root = synthetic.generate(2000, seed = item, legal = False)
+            tree.save(dirpath + "/" + str(item) + ".rpt", root)
+        result = {"items" : items}
+        vectorised, result["numpy"] = seconds(
+            lambda : stats.category_stats(dirpath))
+        try :
+            stats.numpy = None
+            scanned, result["flat"] = seconds(
+                lambda : stats.category_stats(dirpath))
+        finally :
+            stats.numpy = numpy
+        assert vectorised == scanned
+        results["category"] = result
+    return results
+
+# bench_convert()
+# Compares PGN conversion by python chess (read_game() followed by
+# tree.from_game()) with the streaming reader, over the PGNs of
+# Archive/Grunfeld-videos.
+def bench_convert(repeats = 20) :
+    texts = []
+    for filepath in sorted(glob.glob("Archive/Grunfeld-videos/*.pgn")) :
+        with open(filepath) as file :
+            texts.append(file.read())
+
+    def convert_python_chess() :
+        for text in texts :
+            game = chess.pgn.read_game(io.StringIO(text))
+            tree.from_game(game, False)
+
+    def convert_reader() :
+        for text in texts :
+            reader.read_tree(io.StringIO(text), False)
+
+    result = {"files" : len(texts),
+              "bytes" : sum(len(text) for text in texts)}
+    for name, function in (("read_game", convert_python_chess),
+                           ("reader", convert_reader)) :
+        elapsed = seconds(lambda : [function()
+                                    for repeat in range(repeats)])[1]
+        result[name] = round(elapsed / repeats, 4)
+    result["speedup"] = round(result["read_game"] / result["reader"], 2)
+    result["item_bytes"] = sum(
+        len(pickle.dumps(reader.read_tree(io.StringIO(text), False)))
+        for text in texts)
+    return result
+
+# bench_server()
+# A load generator for the training service: clients, each on its
+# own keep-alive connection to a server in this process, fetch the
+# queue of an item and answer its cards as fast as they can. Answers
+# per second are measured, and the saved items are checked to hold
+# every card that was scheduled.
+def bench_server(items = 4, size = 20000, clients = 16, answers = 4000) :
+    with tempfile.TemporaryDirectory() as library :
+        category = library + "/Bench/Items"
+        os.makedirs(category)
+        names = []
+        for item in range(items) :
+            root = synthetic.generate(size, seed = item)
+            tree.save(f"{category}/{item}.rpt", root)
+            names.append(f"Bench/Items/{item}.rpt")
+        tree.cache.items.clear()
+        result = asyncio.run(load_server(library, names, clients,
+                                         answers))
+        tree.cache.items.clear()
+        today = datetime.date.today().toordinal()
+        tables = {name : tree.load_raw(library + "/" + name).table
+                  for name in names}
+        lost = [(name, row) for name, row in result.pop("scheduled")
+                if (tables[name].status[row] != tree.Status.REVIEW.value
+                    or tables[name].previous_due[row] != today)]
+        result["items"] = items
+        result["item_size"] = size
+        result["lost"] = len(lost)
+        assert len(lost) == 0
+    return result
+
+# load_server()
+# Runs the server and the clients of bench_server().
+async def load_server(library, names, clients, answers) :
+    started = asyncio.get_running_loop().create_future()
+    task = asyncio.ensure_future(server.serve(library, 0,
+                                              started.set_result))
+    port = await started
+    latencies = []
+    scheduled = []
+    count = [answers]
+    start = time.perf_counter()
+    await asyncio.gather(*(load_client(port, names[index % len(names)],
+                                       count, latencies, scheduled)
+                           for index in range(clients)))
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    await asyncio.gather(task, return_exceptions = True)
+    latencies.sort()
+    return {"clients" : clients,
+            "answers" : len(latencies),
+            "answers_per_second" : round(len(latencies) / elapsed),
+            "latency_median_ms" :
+                round(1000 * latencies[len(latencies) // 2], 2),
+            "latency_p99_ms" :
+                round(1000 * latencies[len(latencies) * 99 // 100], 2),
+            "scheduled_cards" : len(set(scheduled)),
+            "scheduled" : scheduled}
+
+# load_client()
+# A client of bench_server(): answers cards of an item until count
+# answers have been given by all clients together. Cards scheduled
+# for review are recorded in scheduled, as pairs (item, card).
+async def load_client(port, name, count, latencies, scheduled) :
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    results = ["easy", "okay", "okay", "hard"]
+    cards = []
+    while (count[0] > 0) :
+        if (len(cards) == 0) :
+            queue = await request(reader, writer, "GET",
+                                  f"/queue?item={name}&limit=20")
+            cards = [card["card"] for card in queue["cards"]]
+            if (len(cards) == 0) :
+                break
+        count[0] -= 1
+        body = {"item" : name, "card" : cards.pop(0),
+                "result" : results[count[0] % len(results)]}
+        start = time.perf_counter()
+        answer = await request(reader, writer, "POST", "/answer", body)
+        latencies.append(time.perf_counter() - start)
+        if (answer.get("status") == "REVIEW" and not answer["requeued"]) :
+            scheduled.append((name, answer["card"]))
+    writer.close()
+
+# request()
+# Makes a request of the training service; returns the response.
+async def request(reader, writer, method, target, body = None) :
+    data = b"" if body == None else json.dumps(body).encode()
+    writer.write(f"{method} {target} HTTP/1.1\r\n"
+                 f"Host: localhost\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    status = await reader.readline()
+    length = 0
+    while (True) :
+        line = await reader.readline()
+        if (line == b"\r\n") :
+            break
+        name, _, value = line.decode().partition(":")
+        if (name.lower() == "content-length") :
+            length = int(value)
+    return json.loads(await reader.readexactly(length))
+
+# bench_boards()
+# Compares the time taken to show the cards of a queue (the problem
+# and solution positions of each) by reconstructing their positions
+# from the root, as the trainer once did, and through the board
+# cache; and the times taken to generate the queue and to preload the
+# cache. Checks that the cached positions are right.
+def bench_boards(sizes = (10000, 100000)) :
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, seed = size)
+        cache.boards.clear()
+        queue, generate = seconds(lambda : trainer.generate_queue(root))
+        preload = seconds(lambda : trainer.preload_queue(queue))[1]
+        limit = cache.boards.capacity // 2
+        cards = queue[:limit]
+
+        def replayed() :
+            for node in cards :
+                node.parent.board()
+                node.board()
+
+        def cached() :
+            for node in cards :
+                cache.boards.board(node.parent)
+                cache.boards.board(node)
+
+        for node in cards :
+            assert cache.boards.board(node).fen() == node.board().fen()
+        cache.boards.clear()
+        trainer.preload_queue(queue)
+        results[size] = {
+            "cards" : len(cards),
+            "generate_queue" : generate,
+            "preload" : preload,
+            "replayed_us" : round(seconds(replayed)[1] / len(cards) * 1e6, 2),
+            "cached_us" : round(seconds(cached)[1] / len(cards) * 1e6, 2)}
+    return results
+
+# bench_writer()
+# A stress test of background saving: answers cards of several items
+# as fast as possible, saving each item in the background after every
+# answer, and checks that the files finally hold the latest state of
+# every item, i.e. that no update was lost. Compares the time the
+# caller waits per answer (to modify the tree under the writer's
+# guard and save it) with that of a synchronous save.
+def bench_writer(items = 4, size = 20000, answers = 2000) :
+    roots = [synthetic.generate(size, seed = item) for item in range(items)]
+    item_queues = [trainer.generate_queue(root) for root in roots]
+    with tempfile.TemporaryDirectory() as dirpath :
+        filepaths = [f"{dirpath}/{item}.rpt" for item in range(items)]
+        sync = best(lambda : tree.save(filepaths[0], roots[0]), 5)
+        waits = []
+        for answer in range(answers) :
+            item = answer % items
+            queue = item_queues[item]
+            if (len(queue) == 0) :
+                continue
+            node = queue.pop(0)
+
+            def answer_card() :
+                with writer.background.guard :
+                    trainer.handle_result(trainer.Result.OKAY, node, queue)
+                writer.background.save(filepaths[item], roots[item])
+            waits.append(seconds(answer_card)[1])
+        flush = seconds(writer.background.flush)[1]
+        lost = 0
+        for filepath, root in zip(filepaths, roots) :
+            tree.cache.items.discard(filepath)
+            saved = tree.load_raw(filepath)
+            if (saved.table.status != root.table.status or
+                saved.table.due != root.table.due or
+                saved.table.previous_due != root.table.previous_due) :
+                lost += 1
+    waits.sort()
+    return {"answers" : len(waits),
+            "sync_save" : sync,
+            "background_mean" : round(sum(waits) / len(waits), 6),
+            "background_median" : waits[len(waits) // 2],
+            "background_max" : waits[-1],
+            "final_flush" : flush,
+            "lost" : lost}
+
+# bench_store()
+# Compares a collection of related items saved in full with the same
+# collection saved through a subtree store: disk usage, and the time
+# taken to save every item and to load every item cold. The items are
+# related in one of two ways (see extended_items() and prefix_items()),
+# and each is trained differently.
+# Checks that the items load unchanged.
+def bench_store(items = 10, base_size = 50000, extra = 1000,
+                prefix_size = 20000, own = 5000) :
+    results = {"items" : items}
+    for name, roots in (("extended",
+                         extended_items(items, base_size, extra)),
+                        ("prefix", prefix_items(items, prefix_size, own))) :
+        results[name] = store_sizes(roots)
+    results["extended"].update(base_size = base_size, extra = extra)
+    results["prefix"].update(prefix_size = prefix_size, own = own)
+    return results
+
+# extended_items()
+# Returns items sharing a base repertoire, each extending it by lines
+# of its own below a position of its own a few moves deep, as related
+# items do; chunks above the extension are the item's own, and the
+# rest are shared.
+def extended_items(items, base_size, extra) :
+    base = pickle.dumps(synthetic.generate(base_size, seed = 1))
+    roots = []
+    for item in range(items) :
+        root = pickle.loads(base)
+        rng = random.Random(item)
+        start = root
+        for ply in range(6) :
+            start = rng.choice(start.variations)
+        added = 0
+        while (added < extra) :
+            added += synthetic.grow_line(root, rng, 24, 3, extra - added,
+                                         True, start)
+        synthetic.assign_statuses(root, rng, None)
+        roots.append(root)
+    return roots
+
+# prefix_items()
+# Returns items sharing the top of a tree (a shallow repertoire), each
+# growing most of its nodes as lines of its own below a few of the
+# leaves of the shared top. Only the shared top, less the chunks
+# above those leaves, can be shared.
+def prefix_items(items, prefix_size, own, leaves = 3) :
+    base = pickle.dumps(synthetic.generate(prefix_size, depth = 12,
+                                           seed = 1))
+    roots = []
+    for item in range(items) :
+        root = pickle.loads(base)
+        rng = random.Random(item)
+        starts = rng.sample(leaf_nodes(root), leaves)
+        added = 0
+        while (added < own) :
+            added += synthetic.grow_line(root, rng, 24, 3, own - added,
+                                         True, rng.choice(starts))
+        synthetic.assign_statuses(root, rng, None)
+        roots.append(root)
+    return roots
+
+# leaf_nodes()
+# Returns the leaves of a tree.
+def leaf_nodes(root) :
+    leaves = []
+    stack = [root]
+    while (len(stack) != 0) :
+        node = stack.pop()
+        if (len(node.variations) == 0) :
+            leaves.append(node)
+        stack.extend(node.variations)
+    return leaves
+
+# store_sizes()
+# Saves items in full and through a subtree store; returns the disk
+# usage and the save and load times of each.
+def store_sizes(roots) :
+    results = {"table_bytes" : sum(9 * len(root.table) for root in roots)}
+    with tempfile.TemporaryDirectory() as dirpath :
+        for name in ("full", "shared") :
+            collection = f"{dirpath}/{name}"
+            os.makedirs(collection + "/Category")
+            if (name == "shared") :
+                os.makedirs(collection + "/" + store.STORE_DIR)
+            filepaths = [f"{collection}/Category/{item}.rpt"
+                         for item in range(len(roots))]
+
+            def save_all() :
+                for filepath, root in zip(filepaths, roots) :
+                    tree.save(filepath, root)
+
+            def load_all() :
+                tree.cache.items.clear()
+                return [tree.load_raw(filepath) for filepath in filepaths]
+
+            store.chunks.clear()
+            save = seconds(save_all)[1]
+            store.chunks.clear()
+            loaded, load = seconds(load_all)
+            for root, copy in zip(roots, loaded) :
+                assert structure(root) == structure(copy)
+            results[name] = {"bytes" : directory_bytes(collection),
+                             "save" : save,
+                             "load" : load}
+    return results
+
+# structure()
+# Returns the moves and training data of a tree, in preorder.
+def structure(root) :
+    codes, counts, rows = tree.flatten_structure(root)
+    table = root.table
+    return (codes, counts,
+            [(table.status[row], table.due[row], table.previous_due[row])
+             for row in rows if row >= 0])
+
+# directory_bytes()
+# Returns the total size of the files below a directory.
+def directory_bytes(dirpath) :
+    total = 0
+    for parent, dirnames, filenames in os.walk(dirpath) :
+        for filename in filenames :
+            total += os.path.getsize(os.path.join(parent, filename))
+    return total
+
+# bench_reviews()
+# Times the analysis of a synthetic review log of several years of
+# answers, with NumPy if it is installed and record by record, and
+# checks that both give the same totals.
+def bench_reviews(records = 2000000, items = 50, days = 1500) :
+    rng = random.Random(0)
+    start = datetime.date.today().toordinal() - days
+    with tempfile.TemporaryDirectory() as dirpath :
+        path = dirpath + "/" + reviews.REVIEW_LOG
+        with open(path, "wb") as log :
+            for block in range(0, records, reviews.BLOCK_RECORDS) :
+                data = bytearray()
+                for record in range(min(reviews.BLOCK_RECORDS,
+                                        records - block)) :
+                    status = rng.choice((1, 2, 3, 4, 4, 4, 4, 4))
+                    interval = rng.randint(1, 300) if status == 4 else 0
+                    result = 3 if rng.random() < 0.05 + interval / 2000 \
+                        else rng.choice((1, 2))
+                    data += reviews.RECORD.pack(
+                        rng.randrange(items), rng.getrandbits(32),
+                        start + (block + record) * days // records,
+                        result, status, interval)
+                log.write(data)
+        results = {"records" : records,
+                   "log_bytes" : os.path.getsize(path)}
+        vectorised = None
+        if (analytics.numpy != None) :
+            vectorised, results["numpy"] = seconds(
+                lambda : analytics.analyse(path))
+        numpy = analytics.numpy
+        analytics.numpy = None
+        try :
+            scalar, results["python"] = seconds(
+                lambda : analytics.analyse(path))
+        finally :
+            analytics.numpy = numpy
+    if (vectorised != None) :
+        assert vectorised.retention == scalar.retention
+        assert vectorised.items == scalar.items
+        assert vectorised.days == scalar.days
+    return results
+
+# bench_schedule()
+# Simulates months of training of a library, learning new solutions
+# every day (twice as many at weekends) and doing every review due,
+# with random due dates and with capacity-aware scheduling, and
+# compares the numbers of reviews per day after the first month.
+# The capacity is a little above the mean daily reviews of the
+# random schedule.
+def bench_schedule(items = 20, size = 4000, days = 240, new = 4) :
+    tables = []
+    for item in range(items) :
+        root = synthetic.generate(size, seed = item, mix = {
+            tree.Status.INACTIVE : 1.0})
+        tables.append(root.table)
+    random_days = simulate(tables, days, new, None)
+    warm = random_days[30:]
+    capacity = int(sum(warm) / len(warm) * 1.1) + 1
+    capacity_days = simulate(tables, days, new,
+                             scheduler.Scheduler(capacity,
+                                                 rng = random.Random(1)))
+    return {"days" : days,
+            "capacity" : capacity,
+            "random" : daily_summary(random_days[30:], capacity),
+            "capacity_aware" : daily_summary(capacity_days[30:], capacity)}
+
+# simulate()
+# Simulates days of training of copies of the given training tables
+# with the given scheduler (or none). Returns the numbers of reviews
+# on each day.
+def simulate(tables, days, new, schedule) :
+    rng = random.Random(0)
+    state = random.getstate()
+    random.seed(1)
+    scheduler.current = schedule
+    start = datetime.date.today()
+    tables = [pickle.loads(pickle.dumps(table)) for table in tables]
+    learned = [0] * len(tables)
+    due = {}
+    reviews_per_day = []
+    try :
+        for day in range(days) :
+            today = start + datetime.timedelta(days = day)
+            learn = new * (2 if today.weekday() >= 5 else 1)
+            for item, table in enumerate(tables) :
+                for row in range(learned[item],
+                                 min(learned[item] + learn, len(table))) :
+                    card = Card(table, row)
+                    result = rng.choice((trainer.Result.EASY,
+                                         trainer.Result.OKAY))
+                    reschedule(card, trainer.first_due_date(result, today),
+                               today, due)
+                learned[item] = min(learned[item] + learn, len(table))
+            cards = due.pop(today.toordinal(), [])
+            for card in cards :
+                if (rng.random() < 0.1) :
+                    due_date = trainer.first_due_date(trainer.Result.OKAY,
+                                                      today)
+                else :
+                    result = rng.choice((trainer.Result.EASY,
+                                         trainer.Result.OKAY,
+                                         trainer.Result.OKAY))
+                    due_date = trainer.new_due_date(card, result, today)
+                reschedule(card, due_date, today, due)
+            reviews_per_day.append(len(cards))
+    finally :
+        scheduler.current = None
+        random.setstate(state)
+    return reviews_per_day
+
+# A solution in a simulation: a view of its row.
+class Card :
+    def __init__(self, table, row) :
+        self.training = tree.TrainingRow(table, row)
+
+# reschedule()
+# Schedules a card in a simulation, as trainer.schedule() does.
+def reschedule(card, due_date, today, due) :
+    card.training.due = due_date
+    card.training.previous_due = today
+    card.training.status = tree.Status.REVIEW
+    if (scheduler.current != None) :
+        scheduler.current.add(due_date)
+    due.setdefault(due_date.toordinal(), []).append(card)
+
+# daily_summary()
+# Returns the mean, standard deviation, 95th percentile and maximum
+# of numbers of reviews per day, the mean change from one day to the
+# next, and the number of days over capacity.
+def daily_summary(counts, capacity) :
+    mean = sum(counts) / len(counts)
+    variance = sum((count - mean) ** 2 for count in counts) / len(counts)
+    change = sum(abs(today - yesterday) for yesterday, today
+                 in zip(counts, counts[1:])) / (len(counts) - 1)
+    ordered = sorted(counts)
+    return {"mean" : round(mean, 1),
+            "stdev" : round(variance ** 0.5, 1),
+            "daily_change" : round(change, 1),
+            "p95" : ordered[int(0.95 * (len(ordered) - 1))],
+            "max" : ordered[-1],
+            "over_capacity" : sum(count > capacity for count in counts)}
+
+# best()
+# Returns the shortest of repeated timings of function; setup, if
+# given, is called before each repeat, untimed.
+def best(function, repeats, setup = None) :
+    times = []
+    for repeat in range(repeats) :
+        if (setup != None) :
+            setup()
+        times.append(seconds(function)[1])
+    return min(times)
+
+# bench_rollover()
+# Times the daily rollover (see rollover.py) of a library given by an
+# absolute path, and checks that the rollover is recorded where
+# tree.load() looks for it, whether the items are named by absolute
+# or relative paths: an item loaded afterwards is not rolled over and
+# saved again. A library without a rollover recorded is checked not
+# to be taken for rolled over.
+def bench_rollover(items = 20, size = 20000) :
+    yesterday = datetime.date.today() - datetime.timedelta(days = 1)
+    with tempfile.TemporaryDirectory() as dirpath :
+        library = os.path.join(os.path.abspath(dirpath), "library")
+        filepaths = synthetic.generate_library(library, items, size)
+        other = synthetic.generate_library(
+            os.path.join(dirpath, "data", "library"), 1, size)[0]
+        for filepath in filepaths + [other] :
+            root = tree.load_raw(filepath)
+            root.meta.latest_access = yesterday
+            tree.save(filepath, root)
+        tree.rollover_dates.clear()
+        (rolled, left), took = seconds(
+            lambda : rollover.rollover_library(library))
+        assert (rolled, left) == (items, 0)
+        tree.rollover_dates.clear()
+        relative = os.path.relpath(filepaths[0])
+        assert paths.library_path(filepaths[0]) == library
+        assert paths.library_path(relative) == os.path.relpath(library)
+        assert tree.library_rolled_over(filepaths[0])
+        assert tree.library_rolled_over(relative)
+        assert not tree.library_rolled_over(other)
+        root = tree.load_raw(filepaths[0])
+        root.meta.latest_access = yesterday
+        tree.save(filepaths[0], root)
+        before = cache.stamp(filepaths[0])
+        cache.items.clear()
+        load = seconds(lambda : tree.load(relative))[1]
+        assert cache.stamp(filepaths[0]) == before
+        cache.items.clear()
+    return {"items" : items, "rollover" : took, "load_after" : load}
+
+# bench_queues()
+# Compares the time to the first card of a session from the item, as
+# trainer.train() did (loading the item, generating its queue and
+# counting the problems remaining), with that from its prepared queue
+# (see queues.py), for items of several sizes. Checks that the
+# prepared queue resolves to the generated queue, with the same
+# positions.
+def bench_queues(sizes = (1000, 10000, 100000), repeats = 5) :
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, seed = size)
+        with tempfile.TemporaryDirectory() as dirpath :
+            filepath = dirpath + "/item.rpt"
+            tree.save(filepath, root)
+
+            def from_item() :
+                loaded = tree.load(filepath)
+                queue = trainer.generate_queue(loaded)
+                trainer.preload_queue(queue)
+                trainer.remaining_string(loaded)
+                return cache.boards.board(queue[0].parent)
+
+            def from_prepared() :
+                prepared = queues.read(filepath)
+                trainer.counts_string(prepared.counts)
+                return chess.Board(prepared.cards[0].fen)
+
+            def clear() :
+                cache.items.clear()
+                cache.boards.clear()
+
+            with locks.exclusive(filepath) :
+                prepare = seconds(lambda : queues.prepare(filepath,
+                                                          root))[1]
+            prepared = queues.read(filepath, True)
+            queue = trainer.generate_queue(root)
+            resolved = queues.resolve(root, prepared)
+            assert resolved == queue
+            for node, card in zip(queue, prepared.cards) :
+                assert node.parent.board().fen() == card.fen
+            results[size] = {
+                "cards" : len(queue),
+                "prepare" : prepare,
+                "sidecar_bytes" : os.path.getsize(
+                    queues.sidecar_path(filepath)),
+                "first_card_from_item" : best(from_item, repeats, clear),
+                "first_card_prepared" : best(from_prepared, repeats,
+                                             clear)}
+    return results
+
+# bench_compression()
+# Compares item files saved uncompressed and with each codec (see
+# compression.py), for items of several sizes: file size, save time,
+# and load time, warm (from the page cache) and cold (evicted from
+# it first, where the system allows). Checks that the items load
+# unchanged. For each codec, the read throughput below which it makes
+# cold loads faster is also given: the bytes it saves over the time
+# it adds to a warm load.
+def bench_compression(sizes = (100000, 400000), repeats = 3,
+                      codecs = (None, "zlib:1", "zlib:6", "lzma:0")) :
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, seed = size)
+        result = {}
+        with tempfile.TemporaryDirectory() as dirpath :
+            filepath = dirpath + "/item.rpt"
+            for setting in codecs :
+                codec, level = compression.parse_setting(setting)
+
+                def save() :
+                    data = compression.encode(mapped.dumps(root), codec,
+                                              level)
+                    tree.write(filepath, data)
+
+                def load() :
+                    cache.items.clear()
+                    return tree.load_raw(filepath)
+
+                def evict() :
+                    with open(filepath, "rb") as file :
+                        os.fsync(file.fileno())
+                        if (hasattr(os, "posix_fadvise")) :
+                            os.posix_fadvise(file.fileno(), 0, 0,
+                                             os.POSIX_FADV_DONTNEED)
+
+                saving = best(save, repeats)
+                loaded = load()
+                assert (loaded.table.status == root.table.status and
+                        loaded.table.due == root.table.due)
+                result[setting or "none"] = {
+                    "file_bytes" : os.path.getsize(filepath),
+                    "save" : saving,
+                    "load_warm" : best(load, repeats),
+                    "load_cold" : best(load, repeats, evict)}
+        plain = result["none"]
+        for name, entry in result.items() :
+            saved = plain["file_bytes"] - entry["file_bytes"]
+            added = entry["load_warm"] - plain["load_warm"]
+            if (name != "none" and added > 0) :
+                entry["break_even_mb_s"] = round(saved / added / 1e6, 1)
+        results[size] = result
+    return results
+
+# bench_mapped()
+# Compares the statistics of a library of large items read from
+# pickled files (loaded and flattened, as before) with those read
+# from files in the fixed layout (mapped into memory; see mapped.py):
+# the time taken and the peak resident memory of a fresh process
+# computing them, with the memory of a process that only starts up.
+# Checks that both give the same statistics.
+def bench_mapped(items = 40, size = 200000) :
+    root = synthetic.generate(size, seed = size)
+    formats = {"pickled" : pickle.dumps(root), "mapped" : mapped.dumps(root)}
+    script = ("import sys, time, json, resource, paths, stats\n"
+              "start = time.perf_counter()\n"
+              "result = stats.items_stats(paths.item_paths(sys.argv[1])"
+              " if len(sys.argv) > 1 else [])\n"
+              "print(json.dumps([result, time.perf_counter() - start, "
+              "resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))\n")
+    results = {}
+    with tempfile.TemporaryDirectory() as dirpath :
+        for name, data in formats.items() :
+            library = f"{dirpath}/{name}"
+            os.makedirs(f"{library}/Synthetic/Items")
+            for item in range(items) :
+                tree.write(f"{library}/Synthetic/Items/{item}.rpt", data)
+            tree.record_rollover(library)
+        runs = {}
+        for name in ["startup"] + list(formats) :
+            arguments = [sys.executable, "-c", script]
+            if (name != "startup") :
+                arguments.append(f"{dirpath}/{name}")
+            output = subprocess.run(arguments, capture_output = True,
+                                    text = True, check = True,
+                                    cwd = os.path.dirname(
+                                        os.path.abspath(__file__))).stdout
+            runs[name] = json.loads(output)
+        assert runs["pickled"][0] == runs["mapped"][0]
+        for name in formats :
+            results[name] = {
+                "library_bytes" : directory_bytes(f"{dirpath}/{name}"),
+                "stats" : round(runs[name][1], 4),
+                "peak_rss_kb" : runs[name][2],
+                "rss_over_startup_kb" : runs[name][2] - runs["startup"][2]}
+    return results
+
+# bench_sync()
+# Measures the synchronisation of training progress (see sync.py)
+# between two copies of a library, for several numbers of answers:
+# the size of the bundle, against that of the library, and the time
+# taken to export it from one copy and import it into the other. The
+# answers are spread over a few items; a tenth of the solutions are
+# answered later in the other copy too. Checks that the other copy
+# ends with the training data of the latest answers, and that
+# malformed bundles are refused.
+def bench_sync(answers = (10, 100, 1000), items = 20, size = 20000,
+               answered = 4) :
+    results = {}
+    for count in answers :
+        with tempfile.TemporaryDirectory() as dirpath :
+            here = dirpath + "/here"
+            there = dirpath + "/there"
+            filepaths = synthetic.generate_library(here, items, size)
+            shutil.copytree(here, there)
+            cache.items.clear()
+            expected = {}
+            conflicts = []
+            for item in range(answered) :
+                filepath = filepaths[item]
+                root = tree.load(filepath)
+                queue = trainer.generate_queue(root)
+                for node in queue[:count // answered] :
+                    trainer.handle_result(trainer.Result.OKAY, node, [])
+                    sync.record(filepath, node)
+                    expected[(item, node.row)] = tuple(
+                        column[node.row] for column in
+                        (root.table.status, root.table.due,
+                         root.table.previous_due))
+                conflicts += [(item, node.row) for node in
+                              queue[:count // answered : 10]]
+                tree.save(filepath, root)
+            cache.items.clear()
+            for item, row in conflicts :
+                other = os.path.join(there, os.path.relpath(
+                    filepaths[item], here))
+                root = tree.load(other)
+                root.table.due[row] = 0
+                node = [node for node in trainer.generate_queue(root)
+                        if node.row == row][0]
+                sync.record(other, node)
+                tree.save(other, root)
+                expected[(item, row)] = (root.table.status[row], 0,
+                                         root.table.previous_due[row])
+            bundle = dirpath + "/bundle"
+            root = None
+            gc.collect()
+            exported = seconds(lambda : sync.export_bundle(here, bundle))
+            cache.items.clear()
+            gc.collect()
+            imported = seconds(lambda : sync.import_bundle(there, bundle))
+            cache.items.clear()
+            for (item, row), values in expected.items() :
+                other = os.path.join(there, os.path.relpath(
+                    filepaths[item], here))
+                table = tree.load_raw(other).table
+                assert values == (table.status[row], table.due[row],
+                                  table.previous_due[row])
+            results[count] = {
+                "solutions" : exported[0][0],
+                "items" : exported[0][1],
+                "library_bytes" : directory_bytes(here),
+                "bundle_bytes" : os.path.getsize(bundle),
+                "export" : exported[1],
+                "import" : imported[1],
+                "taken_kept_missing_left" : imported[0]}
+            check_malformed_bundles(there, bundle)
+    return results
+
+# check_malformed_bundles()
+# Checks that a truncated bundle, and one naming an item outside the
+# library, are refused by import_bundle() with ValueError.
+def check_malformed_bundles(library, bundle) :
+    with open(bundle, "rb") as file :
+        data = zlib.decompress(file.read())
+    header = json.dumps([["../outside.rpt", 0]]).encode()
+    for malformed in (data[:-1],
+                      sync.BUNDLE_HEADER.pack(len(header)) + header) :
+        with open(bundle, "wb") as file :
+            file.write(zlib.compress(malformed))
+        try :
+            sync.import_bundle(library, bundle)
+        except ValueError :
+            continue
+        raise AssertionError("malformed bundle imported")
+
+# bench_snapshots()
+# Measures snapshots of a library (see snapshots.py) of increasing
+# numbers of items: the time taken by the first snapshot and by one
+# taken after a few items are saved again, and of restoring an item.
+# Checks that the second snapshot reads only the items
+# changed, that a deleted item is restored as it was, and that the
+# retention policy keeps the expected snapshots.
+def bench_snapshots(item_counts = (20, 100, 500), size = 2000,
+                    changed = 5) :
+    results = {}
+    for items in item_counts :
+        with tempfile.TemporaryDirectory() as dirpath :
+            library = dirpath + "/library"
+            filepaths = synthetic.generate_library(library, items, size)
+            first = seconds(lambda : snapshots.create(library))
+            assert first[0] == (items, items)
+            for filepath in filepaths[:changed] :
+                root = tree.load_raw(filepath)
+                root.table.due[0] += 1
+                tree.save(filepath, root)
+            second = seconds(lambda : snapshots.create(library))
+            assert second[0] == (items, changed)
+            name = snapshots.snapshot_names(library)[-1]
+            with open(filepaths[0], "rb") as file :
+                expected = file.read()
+            os.remove(filepaths[0])
+            restored = seconds(lambda : snapshots.restore(
+                library, name, os.path.relpath(filepaths[0], library)))
+            assert restored[0] == (1, 0)
+            with open(filepaths[0], "rb") as file :
+                assert file.read() == expected
+            pruned = snapshots.prune(library)
+            results[items] = {
+                "library_bytes" : directory_bytes(library)
+                - directory_bytes(snapshots.snapshot_dir(library)),
+                "first" : first[1],
+                "second" : second[1],
+                "restore_item" : restored[1],
+                "objects_pruned" : pruned[1]}
+    days = [datetime.date(2021, 1, 1) + datetime.timedelta(day)
+            for day in range(400)]
+    kept = snapshots.retained([day.isoformat() for day in days], 7, 4, 6)
+    assert days[-1].isoformat() in kept and len(kept) <= 7 + 4 + 6
+    results["retained_of_400_days"] = len(kept)
+    return results
+
+# bench_core()
+# Times the core operations on synthetic repertoires of increasing
+# size: tree.save() and tree.load() (cold, i.e. read from disk),
+# stats.training_stats(), trainer.generate_queue(),
+# tree.update_statuses(), manager.add_move() (a tree edit, including
+# its status update and save), and conversion of the tree's PGN as
+# by convert-pgn.py.
+def bench_core(sizes = (1000, 10000, 100000), repeats = 5) :
+    results = {}
+    for size in sizes :
+        root = synthetic.generate(size, seed = size)
+        result = {"solutions" : len(root.table)}
+        with tempfile.TemporaryDirectory() as dirpath :
+            filepath = dirpath + "/item.rpt"
+            result["save"] = best(lambda : tree.save(filepath, root),
+                                  repeats)
+            result["file_bytes"] = os.path.getsize(filepath)
+            result["load"] = best(lambda : tree.load(filepath), repeats,
+                                  tree.cache.items.clear)
+            result["training_stats"] = best(
+                lambda : stats.training_stats(root), repeats)
+            result["generate_queue"] = best(
+                lambda : trainer.generate_queue(root), repeats)
+            result["update_statuses"] = best(
+                lambda : tree.update_statuses(root), repeats)
+            result["add_move"] = bench_add_move(root, filepath, repeats)
+
+            pgn = io.StringIO()
+            export.export_tree(pgn, root)
+            text = pgn.getvalue()
+
+            def convert() :
+                converted = reader.read_tree(io.StringIO(text),
+                                             root.meta.colour)
+                tree.update_statuses(converted)
+                tree.save(filepath, converted)
+            result["pgn_bytes"] = len(text)
+            result["convert"] = best(convert, repeats)
+        results[size] = result
+    return results
+
+# bench_add_move()
+# Returns the shortest time taken by manager.add_move() to extend
+# the deepest line of a tree by one move, repeatedly.
+def bench_add_move(root, filepath, repeats) :
+    node = root
+    while (len(node.variations) != 0) :
+        node = max(node.variations, key = depth)
+    board = node.board()
+    times = []
+    for repeat in range(repeats) :
+        move = next(iter(board.legal_moves)).uci()
+        node, elapsed = seconds(
+            lambda : manager.add_move(node, board, move, filepath))
+        times.append(elapsed)
+    return min(times)
+
+# depth()
+# Returns the depth of the subtree below a node.
+def depth(node) :
+    deepest = 0
+    stack = [(node, 0)]
+    while (len(stack) != 0) :
+        node, level = stack.pop()
+        deepest = max(deepest, level)
+        stack += [(child, level + 1) for child in node.variations]
+    return deepest
+
+# metadata()
+# Returns the environment of a run, recorded with its results.
+def metadata() :
+    try :
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                capture_output = True, text = True,
+                                check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError) :
+        commit = None
+    return {"commit" : commit,
+            "python" : platform.python_version(),
+            "machine" : platform.machine(),
+            "date" : datetime.datetime.now().isoformat(timespec = "seconds")}
+
+# compare()
+# Prints, for each time in both sets of results, the old and new
+# times and their ratio (new / old; less than 1 is an improvement).
+def compare(old, new, path = ()) :
+    for key, value in new.items() :
+        if (key == "meta" or key not in old) :
+            continue
+        if (isinstance(value, dict)) :
+            compare(old[key], value, path + (key,))
+        elif (isinstance(value, float) and
+              isinstance(old[key], (int, float)) and old[key] > 0) :
+            name = "/".join(path + (key,))
+            print(name.ljust(48) + f"{old[key]:10.4f}{value:10.4f}"
+                  + f"{value / old[key]:8.2f}")
+
+benchmarks = {
+    "core" : bench_core,
+    "boards" : bench_boards,
+    "queues" : bench_queues,
+    "rollover" : bench_rollover,
+    "writer" : bench_writer,
+    "store" : bench_store,
+    "compression" : bench_compression,
+    "mapped" : bench_mapped,
+    "reviews" : bench_reviews,
+    "schedule" : bench_schedule,
+    "sync" : bench_sync,
+    "snapshots" : bench_snapshots,
+    "frames" : bench_frames,
+    "convert" : bench_convert,
+    "memory" : bench_memory,
+    "flat" : bench_flat,
+    "numpy" : bench_numpy,
+    "server" : bench_server,
+}
+
+###############
+# entry point #
+###############
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    names = args[1:]
+    if (names[:1] == ["--compare"]) :
+        valid = (len(names) == 3)
+    else :
+        if (names[:1] == ["-o"]) :
+            names = names[2:]
+        valid = (len(args) != 2 or args[1] != "-o") and all(
+            name in benchmarks for name in names)
+    if (not valid) :
+        print("usage: python3 benchmark.py [-o <results>] [<benchmark> ...]")
+        print("       python3 benchmark.py --compare <old> <new>")
+        print("benchmarks: " + " ".join(benchmarks))
+        quit()
+
+check_usage(sys.argv)
+if (sys.argv[1:2] == ["--compare"]) :
+    with open(sys.argv[2]) as file :
+        old = json.load(file)
+    with open(sys.argv[3]) as file :
+        new = json.load(file)
+    print("".ljust(48) + "old".rjust(10) + "new".rjust(10)
+          + "ratio".rjust(8))
+    compare(old, new)
+    quit()
+
+output = None
+names = sys.argv[1:]
+if (names[:1] == ["-o"]) :
+    output = names[1]
+    names = names[2:]
+if (len(names) == 0) :
+    names = list(benchmarks)
+
+results = {"meta" : metadata()}
+for name in names :
+    results[name] = benchmarks[name]()
+print(json.dumps(results, indent = 2))
+if (output != None) :
+    with open(output, "w") as file :
+        json.dump(results, file, indent = 2)
@@ -0,0 +1,246 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE book.py
+
+# SYNOPSIS
+# Provides functions for generating Polyglot opening books from
+# items, and the class Book for looking moves up in a book.
+# Typically only the function write_book() and the class Book will
+# be imported.
+
+# A Polyglot book is a sequence of 16 byte entries (a Zobrist key,
+# a move, a weight and a learn value, all big-endian) sorted by key.
+# Every move of every item is an entry; its weight comes from its
+# place among the variations of its node, the main variation being
+# heaviest. Entries for the same move in the same position, from
+# different items or transpositions, are combined by adding their
+# weights.
+
+# Books are generated in a single pass over the items, loaded one at
+# a time, with an external sort: the moves are collected as records
+# into runs of at most RUN_ENTRIES, each sorted and written to a
+# temporary file, and the runs are merged into the book.
+
+import os
+import mmap
+import heapq
+import struct
+import tempfile
+
+import chess
+import chess.polyglot
+
+import tree
+
+# A book entry: key, move, weight, learn.
+ENTRY = struct.Struct(">QHHI")
+
+# A record of the external sort: key, move and (uncombined) weight.
+# Records sort by key and move.
+RECORD = struct.Struct(">QHI")
+
+# Size of the key and move of a record.
+KEY_MOVE_SIZE = 10
+
+# Maximum weight of an entry.
+MAX_WEIGHT = 0xffff
+
+# Number of records in a run of the external sort.
+RUN_ENTRIES = 1 << 19
+
+# write_book()
+# Writes a Polyglot book of the items with the given filepaths.
+# Items are read as saved, without rolling them over.
+# Returns the number of entries in the book.
+def write_book(filepath, item_paths, run_entries = RUN_ENTRIES) :
+    with tempfile.TemporaryDirectory() as run_dir :
+        runs = []
+        records = []
+        for item_path in item_paths :
+            for record in tree_records(tree.load_raw(item_path)) :
+                records.append(record)
+                if (len(records) == run_entries) :
+                    runs.append(write_run(run_dir, len(runs), records))
+                    records = []
+        records.sort()
+        with open(filepath, "wb") as book :
+            if (len(runs) == 0) :
+                return write_entries(book, records)
+            runs.append(write_run(run_dir, len(runs), records))
+            return write_entries(book, heapq.merge(*map(read_run, runs)))
+
+# tree_records()
+# Generates the records of the moves of a tree.
+def tree_records(root) :
+    board = root.board()
+    stack = [(root, 0)]
+    while (len(stack) != 0) :
+        node, depth = stack.pop()
+        if (depth > 0) :
+            while (len(board.move_stack) >= depth) :
+                board.pop()
+            board.push(node.move)
+        key = chess.polyglot.zobrist_hash(board)
+        count = len(node.variations)
+        for index, child in enumerate(node.variations) :
+            move = polyglot_move(board, child.move)
+            yield RECORD.pack(key, move, count - index)
+        stack += [(child, depth + 1) for child in reversed(node.variations)]
+
+# polyglot_move()
+# Returns the Polyglot encoding of a move in the given position:
+# to_square | from_square << 6 | promotion << 12, with the
+# promotion piece numbered from 1 (knight), and castling encoded as
+# the king moving to the square of its rook.
+def polyglot_move(board, move) :
+    to_square = move.to_square
+    if (board.is_castling(move)) :
+        rook_file = 7 if board.is_kingside_castling(move) else 0
+        to_square = chess.square(rook_file, chess.square_rank(to_square))
+    code = to_square | (move.from_square << 6)
+    if (move.promotion != None) :
+        code |= (move.promotion - 1) << 12
+    return code
+
+# write_run()
+# Sorts records and writes them to a run file. Returns its path.
+def write_run(run_dir, index, records) :
+    records.sort()
+    path = os.path.join(run_dir, str(index))
+    with open(path, "wb") as run :
+        run.write(b"".join(records))
+    return path
+
+# read_run()
+# Generates the records of a run file.
+def read_run(path) :
+    with open(path, "rb") as run :
+        while (True) :
+            record = run.read(RECORD.size)
+            if (len(record) == 0) :
+                break
+            yield record
+
+# write_entries()
+# Writes sorted records to a book, combining the weights of records
+# with the same key and move. Returns the number of entries written.
+def write_entries(book, records) :
+    count = 0
+    current = None
+    total = 0
+    for record in records :
+        key_move = record[:KEY_MOVE_SIZE]
+        weight = int.from_bytes(record[KEY_MOVE_SIZE:], "big")
+        if (key_move != current) :
+            if (current != None) :
+                book.write(current + pack_weight(total))
+                count += 1
+            current = key_move
+            total = 0
+        total += weight
+    if (current != None) :
+        book.write(current + pack_weight(total))
+        count += 1
+    return count
+
+# pack_weight()
+# Returns the packed weight and learn value of an entry.
+def pack_weight(weight) :
+    return struct.pack(">HI", min(weight, MAX_WEIGHT), 0)
+
+# A Polyglot book, opened for lookup.
+# The file is memory mapped, and the entries of a key are found by
+# binary search.
+class Book :
+    def __init__(self, filepath) :
+        self.file = open(filepath, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.size = size // ENTRY.size
+        self.data = None
+        if (size != 0) :
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                                  access = mmap.ACCESS_READ)
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *args) :
+        self.close()
+
+    def __len__(self) :
+        return self.size
+
+    # close()
+    # Closes the book.
+    def close(self) :
+        if (self.data != None) :
+            self.data.close()
+        self.file.close()
+
+    # key()
+    # Returns the key of the entry with the given index.
+    def key(self, index) :
+        return struct.unpack_from(">Q", self.data, index * ENTRY.size)[0]
+
+    # entries()
+    # Returns the entries for a Zobrist key, as pairs (move, weight)
+    # of Polyglot moves and weights, in the order of the book.
+    def entries(self, key) :
+        low = 0
+        high = self.size
+        while (low < high) :
+            middle = (low + high) // 2
+            if (self.key(middle) < key) :
+                low = middle + 1
+            else :
+                high = middle
+        found = []
+        while (low < self.size and self.key(low) == key) :
+            entry = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            found.append((entry[1], entry[2]))
+            low += 1
+        return found
+
+    # moves()
+    # Returns the book moves in a position, as pairs (move, weight)
+    # of python chess moves and weights, heaviest first.
+    def moves(self, board) :
+        key = chess.polyglot.zobrist_hash(board)
+        found = [(board_move(board, move), weight)
+                 for move, weight in self.entries(key)]
+        found.sort(key = lambda pair : -pair[1])
+        return found
+
+# board_move()
+# Returns the python chess move of a Polyglot move in the given
+# position (see polyglot_move()).
+def board_move(board, code) :
+    to_square = code & 0x3f
+    from_square = (code >> 6) & 0x3f
+    promotion = (code >> 12) & 0x7
+    if (promotion != 0) :
+        return chess.Move(from_square, to_square, promotion + 1)
+    if (board.king(board.turn) == from_square and
+        board.rooks & board.occupied_co[board.turn] &
+        chess.BB_SQUARES[to_square]) :
+        king_file = 6 if to_square > from_square else 2
+        to_square = chess.square(king_file, chess.square_rank(to_square))
+    return chess.Move(from_square, to_square)
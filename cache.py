@@ -0,0 +1,207 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE cache.py
+
+# SYNOPSIS
+# Provides the in-process cache of loaded items, shared by the item
+# menu, the trainer and the manager (through tree.load() and
+# tree.save()), and the cache of the boards of training cards.
+
+# Entries are keyed by filepath and stamped with the modification
+# time and size of the file when it was loaded or saved; an entry
+# whose file has changed since is discarded. The cache is least
+# recently used, and holds items up to a budget of estimated memory.
+
+import os
+import collections
+
+import tree
+
+# Estimated memory of a loaded tree per solution, in bytes (two
+# nodes and a row of the training table).
+BYTES_PER_SOLUTION = 300
+
+# Default budget of estimated memory, in bytes.
+DEFAULT_BUDGET = 512 * 2**20
+
+# Default number of boards in the board cache.
+DEFAULT_BOARDS = 4096
+
+# An entry of the cache.
+# root is the loaded tree and flat its FlatTree, if one has been
+# built; cost is the estimated memory of the entry.
+class Entry :
+    __slots__ = ('stamp', 'root', 'flat', 'cost')
+
+    def __init__(self, stamp, root, cost) :
+        self.stamp = stamp
+        self.root = root
+        self.flat = None
+        self.cost = cost
+
+# The cache itself.
+class ItemCache :
+    def __init__(self, budget = DEFAULT_BUDGET) :
+        self.budget = budget
+        self.used = 0
+        self.entries = collections.OrderedDict()
+
+    # lookup()
+    # Returns the entry for filepath, or None if there is no entry
+    # or the file has changed since it was made.
+    def lookup(self, filepath) :
+        entry = self.entries.get(filepath)
+        if (entry == None) :
+            return None
+        if (entry.stamp != stamp(filepath)) :
+            self.discard(filepath)
+            return None
+        self.entries.move_to_end(filepath)
+        return entry
+
+    # store()
+    # Stores the tree just loaded from or saved to filepath, evicting
+    # the least recently used entries to stay within the budget.
+    # Returns the new entry.
+    def store(self, filepath, root) :
+        self.discard(filepath)
+        entry = Entry(stamp(filepath), root,
+                      len(root.table) * BYTES_PER_SOLUTION)
+        self.entries[filepath] = entry
+        self.used += entry.cost
+        while (self.used > self.budget and len(self.entries) > 1) :
+            self.discard(next(iter(self.entries)))
+        return entry
+
+    # restamp()
+    # Stamps the entry for filepath with its file, just written, if it
+    # still holds the given tree. Only assigns the stamp, so may be
+    # called from any thread (see writer.py).
+    def restamp(self, filepath, root) :
+        entry = self.entries.get(filepath)
+        if (entry != None and entry.root is root) :
+            entry.stamp = stamp(filepath)
+
+    # discard()
+    # Removes the entry for filepath, if any.
+    def discard(self, filepath) :
+        entry = self.entries.pop(filepath, None)
+        if (entry != None) :
+            self.used -= entry.cost
+
+    # clear()
+    # Removes all entries.
+    def clear(self) :
+        self.entries.clear()
+        self.used = 0
+
+# stamp()
+# Returns the modification time and size of a file, or None if it
+# does not exist.
+def stamp(filepath) :
+    try :
+        status = os.stat(filepath)
+    except FileNotFoundError :
+        return None
+    return (status.st_mtime_ns, status.st_size)
+
+# The cache of the positions of nodes, as python chess boards.
+# Reconstructing the position of a node replays its line from the
+# root, so costs time proportional to its depth; the trainer instead
+# preloads the positions of the cards of a queue at the start of a
+# session (see preload()), and looks them up here when they are
+# shown.
+# Entries are keyed by node; since the move of a node never changes,
+# they never go stale. Boards keep only their last move (enough to
+# highlight it) and are shared, so must not be modified.
+class BoardCache :
+    def __init__(self, capacity = DEFAULT_BOARDS) :
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+
+    # board()
+    # Returns the position of a node. A position not in the cache is
+    # derived from that of the parent, if it is in the cache, and
+    # otherwise reconstructed from the root.
+    def board(self, node) :
+        board = self.entries.get(node)
+        if (board != None) :
+            self.entries.move_to_end(node)
+            return board
+        parent = self.entries.get(node.parent)
+        if (parent != None) :
+            board = parent.copy(stack = 1)
+            board.push(node.move)
+        else :
+            board = node.board().copy(stack = 1)
+        self.store(node, board)
+        return board
+
+    # store()
+    # Stores the position of a node, evicting the least recently used
+    # positions to stay within capacity.
+    def store(self, node, board) :
+        self.entries[node] = board
+        self.entries.move_to_end(node)
+        while (len(self.entries) > self.capacity) :
+            self.entries.popitem(last = False)
+
+    # preload()
+    # Stores the positions of the given nodes of a tree, which must be
+    # in preorder (as in a training queue), with a single board: the
+    # line of each node is replayed only beyond the part it shares
+    # with the line of the node before, so that the total cost is at
+    # most the number of nodes on the lines, rather than their total
+    # depth. At most half capacity positions are stored, leaving room
+    # for those of the solutions of the problems.
+    def preload(self, nodes) :
+        nodes = nodes[:self.capacity // 2]
+        if (len(nodes) == 0) :
+            return
+        board = nodes[0].game().board()
+        line = []
+        for node in nodes :
+            path = []
+            ancestor = node
+            while (ancestor.parent != None) :
+                path.append(ancestor.code)
+                ancestor = ancestor.parent
+            path.reverse()
+            shared = 0
+            limit = min(len(line), len(path))
+            while (shared < limit and line[shared] == path[shared]) :
+                shared += 1
+            while (len(line) > shared) :
+                board.pop()
+                line.pop()
+            for code in path[shared:] :
+                board.push(tree.decode_move(code))
+                line.append(code)
+            self.store(node, board.copy(stack = 1))
+
+    # clear()
+    # Removes all entries.
+    def clear(self) :
+        self.entries.clear()
+
+# The caches of this process.
+items = ItemCache()
+boards = BoardCache()
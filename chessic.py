@@ -31,7 +31,9 @@ import stats
 import manager
 import paths
 import tree
-from graphics import clear
+import locks
+import queues
+from graphics import clear, write, read, print_in_use
 import trainer
 
 # Enumeration for the Chessic hierarchy;
@@ -60,25 +62,25 @@ def represents_int(string):
 # Prints options for the typical menu.
 def options(names) :
     num_names = len(names)
-    print ("")
+    write("")
     if (num_names != 0) :
-        print("[ID] select")
-    print("'n' new")
+        write("[ID] select")
+    write("'n' new")
     if (num_names != 0) :
-        print("'d' delete")
-    print("'b' back")
+        write("'d' delete")
+    write("'b' back")
 
 # new()
 # Creates a new asset (i.e. collection, category etc.).
 def new(dirpath, asset) :    
-    name = input("Name: ")
+    name = read("Name: ")
     while (True) :
         new_path = dirpath + "/" + name
         if (asset == Asset.ITEM) :
             new_path += '.rpt'
         if (not os.path.exists(new_path)) :
             break
-        name = input("That name is taken.\nChoose another: ")        
+        name = read("That name is taken.\nChoose another: ")        
     
     if (asset != Asset.ITEM) :
         os.mkdir(new_path)
@@ -88,20 +90,34 @@ def new(dirpath, asset) :
 # new()
 # Creates a new asset (i.e. collection, category etc.)..        
 def delete(dirpath, names, asset) :
-    command = input("ID to delete: ")
+    command = read("ID to delete: ")
     if (represents_int(command) and
         1 <= int(command) <= len(names)) :
         index = int(command) - 1
         name = names[index]
-        print (f"You are about to permanently delete `{name}'.")
-        check = input("Are you sure? (y/n):")
+        write(f"You are about to permanently delete `{name}'.")
+        check = read("Are you sure? (y/n):")
         if (check == "y") :
             path = dirpath + "/" + name
             if (asset == Asset.ITEM) :
-                os.remove(path)
+                delete_item(path)
             else :
                 shutil.rmtree(path)
 
+# delete_item()
+# Deletes an item with its lock file and prepared queue, unless
+# another process holds its lock.
+def delete_item(path) :
+    with locks.exclusive(path) as acquired :
+        if (not acquired) :
+            print_in_use()
+            return
+        os.remove(path)
+        if (os.path.exists(locks.lock_path(path))) :
+            os.remove(locks.lock_path(path))
+        if (os.path.exists(queues.sidecar_path(path))) :
+            os.remove(queues.sidecar_path(path))
+
 # menu()
 # Prints the typical menu for the given asset.
 # The item menu is significantly different; this function launches
@@ -110,8 +126,7 @@ def delete(dirpath, names, asset) :
 def menu(dirpath, asset):
     command = ""
     while(command != "b") :
-        names = os.listdir(dirpath)
-        names.sort()        
+        names = paths.listdir(dirpath)
         title(dirpath, asset)
         table(dirpath, names, asset)
         options(names)
@@ -122,24 +137,24 @@ def menu(dirpath, asset):
 def title(dirpath, asset) :
     clear()
     if (asset == Asset.MAIN) :
-        print("YOUR COLLECTIONS")
+        write("YOUR COLLECTIONS")
     elif (asset == Asset.COLLECTION) :
-        print("COLLECTION " + paths.collection_name(dirpath))
+        write("COLLECTION " + paths.collection_name(dirpath))
     elif (asset == Asset.CATEGORY) :
-        print("CATEGORY   " + paths.category_name(dirpath))
-        print("COLLECTION " + paths.collection_name(dirpath))
-    print("")
+        write("CATEGORY   " + paths.category_name(dirpath))
+        write("COLLECTION " + paths.collection_name(dirpath))
+    write("")
 
 # table()
 # Prints the whole table for the typical menu.
 def table(dirpath, names, asset) :
     if (len(names) == 0) :
         if (asset == Asset.MAIN) :
-            print("You have no collections.")
+            write("You have no collections.")
         elif (asset == Asset.COLLECTION) :
-            print("There are no categories in this collection.")
+            write("There are no categories in this collection.")
         elif (asset == Asset.CATEGORY) :
-            print("There are no items in this collection.")
+            write("There are no items in this collection.")
         return
 
     header_row()
@@ -160,7 +175,7 @@ def header_row() :
     string = "ID".ljust(3) + "COV.".ljust(5)
     string += "ITEM".ljust(20) + "WAITING".ljust(9) 
     string += "LEARNED".ljust(9) + "TOTAL".ljust(6)
-    print(string)
+    write(string)
 
 # info_row()
 # Prints an internal table row for the typical menu.
@@ -177,14 +192,14 @@ def info_row(info, name, index) :
     info_string = str(index).ljust(3) + coverage
     info_string += name.ljust(20) + str(waiting).ljust(9)
     info_string += str(learned).ljust(9) + str(size).ljust(7)
-    print(info_string)
+    write(info_string)
 
 # prompt()
 # Handles the typical menu prompt.
 # Returns the user's command.
 def prompt(dirpath, names, asset) :
     new_asset = next_asset(asset)
-    command = (input("\n:"))
+    command = (read("\n:"))
     if (represents_int(command) and
         1 <= int(command) <= len(names)) :
         index = int(command) - 1
@@ -219,7 +234,7 @@ def item_menu(filepath) :
         item_header(filepath, info)
         item_overview(info)
         item_options(info)
-        command = input("\n:")
+        command = read("\n:")
         if (command == "m") :
             manager.manage(filepath)
         elif (command == "t") :
@@ -235,10 +250,10 @@ def item_header(filepath, info) :
         status_msg = "Training available"
     else :
         status_msg = "Up to date"    
-    print("ITEM".ljust(width) + paths.item_name(filepath))
-    print("CATEGORY".ljust(width) + paths.category_name(filepath))
-    print("COLLECTION".ljust(width) +paths.collection_name(filepath))
-    print("STATUS".ljust(width) + status_msg)
+    write("ITEM".ljust(width) + paths.item_name(filepath))
+    write("CATEGORY".ljust(width) + paths.category_name(filepath))
+    write("COLLECTION".ljust(width) +paths.collection_name(filepath))
+    write("STATUS".ljust(width) + status_msg)
 
 # item_overview()
 # Prints information for the tree.
@@ -246,26 +261,26 @@ def item_overview(info) :
     width = 14
     learning = info[stats.STAT_FIRST_STEP]
     learning += info[stats.STAT_SECOND_STEP]
-    print("")
-    print("New".ljust(width) + str(info[stats.STAT_NEW]))
-    print("Learning".ljust(width) + str(learning))
-    print("Due".ljust(width) + str(info[stats.STAT_DUE]))
-    print("")
-    print("In review".ljust(width) + str(info[stats.STAT_REVIEW]))
-    print("Inactive".ljust(width) + str(info[stats.STAT_INACTIVE]))
-    print("Reachable".ljust(width) + str(info[stats.STAT_REACHABLE]))
-    print("Total".ljust(width) + str(info[stats.STAT_TOTAL]))
+    write("")
+    write("New".ljust(width) + str(info[stats.STAT_NEW]))
+    write("Learning".ljust(width) + str(learning))
+    write("Due".ljust(width) + str(info[stats.STAT_DUE]))
+    write("")
+    write("In review".ljust(width) + str(info[stats.STAT_REVIEW]))
+    write("Inactive".ljust(width) + str(info[stats.STAT_INACTIVE]))
+    write("Reachable".ljust(width) + str(info[stats.STAT_REACHABLE]))
+    write("Total".ljust(width) + str(info[stats.STAT_TOTAL]))
 
 # item_options()
 # Prints the options for the item menu.
 def item_options(info) :
     waiting = info[stats.STAT_NEW] + info[stats.STAT_FIRST_STEP]
     waiting += info[stats.STAT_SECOND_STEP] + info[stats.STAT_DUE]
-    print("")
+    write("")
     if (waiting > 0) :
-        print("'t' train")
-    print("'m' manage")
-    print("'b' back")
+        write("'t' train")
+    write("'m' manage")
+    write("'b' back")
     
 # initialise_sample_collection()
 # Creates the `Collections' folder and initialises it to replicate
@@ -276,7 +291,7 @@ def initialise_sample_collection(col_path) :
     os.mkdir(col_path + "/Sample-Collection/Sample-Category")
     sample_item_target = "Sample-Collections/Sample-Collection/Sample-Category/English.rpt"
     sample_item_destination = "Collections/Sample-Collection/Sample-Category/English.rpt"     
-    root = tree.load(sample_item_target)
+    root = tree.load_raw(sample_item_target)
     tree.save(sample_item_destination, root)
 
 ###############    
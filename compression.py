@@ -0,0 +1,117 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE compression.py
+
+# SYNOPSIS
+# Provides the optional compression of item files, with the codecs
+# of the standard library. It is enabled by the environment variable
+# CHESSIC_COMPRESSION, naming a codec and, optionally, its level:
+#
+#     CHESSIC_COMPRESSION=zlib:1 python3 chessic.py
+#
+# The codecs are zlib (levels 0 to 9, or -1 for zlib's own default;
+# by default 1) and lzma (presets 0 to 9, by default 0). Typically
+# only the functions encode() and decode() will be used, through
+# tree.dumps() and tree.read().
+
+# A compressed item file starts with a header: MAGIC, which no pickle
+# starts with, and a byte holding the id of its codec. Items are read
+# whatever their compression, so compressed and uncompressed items
+# may be mixed in a library, and the setting may be changed at any
+# time; each item is saved with the current setting the next time it
+# is saved.
+
+# Compression is off by default, since it makes cold loads faster
+# only where storage is slow. Loading is dominated by unpickling,
+# and decompressing adds to it; what is saved is the time to read
+# the bytes removed. zlib at level 1 shrinks an item about threefold
+# and decompresses at about 200MB/s of output, so it pays where items
+# are read at less than about 140MB/s, e.g. from spinning disks or
+# network storage, but not from a solid state disk (see
+# bench_compression() in benchmark.py, which measures both).
+
+import os
+import zlib
+import lzma
+
+# Marks the start of a compressed item file.
+MAGIC = b"CHZ"
+
+# Codecs by name: id, default level, and functions compressing at a
+# given level and decompressing.
+CODECS = {
+    "zlib" : (1, 1, lambda data, level : zlib.compress(data, level),
+              zlib.decompress),
+    "lzma" : (2, 0, lambda data, level : lzma.compress(data,
+                                                      preset = level),
+              lzma.decompress),
+}
+
+# Codecs by id.
+DECODERS = {codec[0] : codec[3] for codec in CODECS.values()}
+
+# Valid levels of each codec, by name.
+LEVELS = {"zlib" : range(-1, 10), "lzma" : range(0, 10)}
+
+# parse_setting()
+# Returns the codec name and level given by a setting of the form
+# <codec>[:<level>], or (None, None) if the setting is empty or
+# `none'. A setting naming an unknown codec or an invalid level raises
+# ValueError, so that it is reported at startup rather than by the
+# first save.
+def parse_setting(setting) :
+    if (setting == None or setting in ("", "none")) :
+        return None, None
+    name, separator, level = setting.partition(":")
+    if (name not in CODECS) :
+        raise ValueError(f"unknown compression codec `{name}'")
+    if (level == "") :
+        return name, CODECS[name][1]
+    try :
+        level = int(level)
+    except ValueError :
+        level = None
+    if (level not in LEVELS[name]) :
+        raise ValueError(f"invalid {name} compression level; expected "
+                         f"{LEVELS[name][0]} to {LEVELS[name][-1]}")
+    return name, level
+
+# The codec and level with which items are saved; the codec is None
+# if items are saved uncompressed.
+CODEC, LEVEL = parse_setting(os.environ.get("CHESSIC_COMPRESSION"))
+
+# encode()
+# Returns the contents of an item file holding the given pickled
+# data, compressed with the given codec (by default, that of the
+# setting).
+def encode(data, codec = CODEC, level = LEVEL) :
+    if (codec == None) :
+        return data
+    identity, default, compress, decompress = CODECS[codec]
+    return MAGIC + bytes([identity]) + compress(data, level)
+
+# decode()
+# Returns the pickled data held by the contents of an item file,
+# compressed or not.
+def decode(data) :
+    if (data[:len(MAGIC)] != MAGIC) :
+        return data
+    return DECODERS[data[len(MAGIC)]](data[len(MAGIC) + 1:])
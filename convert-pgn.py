@@ -25,34 +25,21 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
 import sys
-import chess
-import chess.pgn
 import tree
-
-# process()
-# Adds default training data to a solution; sets node.training
-# to None for all non-solution nodes when called on the root.
-def process(node) :
-    if (tree.is_raw_solution(node)) :
-        node.training = tree.TrainingData()
-    else :
-        node.training = None
-    if (not node.is_end()) :
-        for child in node.variations :
-            process(child)
+import reader
 
 # check_usage()
 # Checks that the command line paramaters make sense
 def check_usage(args) :
     if (len(args) != 4 or
-        (agrs[3] != "w" and args[3] != "b")) :
+        (args[3] != "w" and args[3] != "b")) :
         help_string = "usage: python3 convert-pgn.py"
         help_string += " <source-dir> <destination-dir> <w|b>"
         print(help_string)
         quit()
 
 # entry point
-check_args(sys.argv)
+check_usage(sys.argv)
 
 # setup
 source_dir = sys.argv[1]
@@ -64,10 +51,7 @@ colour = (sys.argv[3] == "w")
 for PGN in PGNs :
     PGN_path = source_dir + '/' + PGN
     RPT_path = destination_dir + '/' + PGN[:-4] + ".rpt"
-    pgn = open(PGN_path)
-    root = chess.pgn.read_game(pgn)
-    root.meta = tree.MetaData(colour)
-    root.training = None
-    process(root) # processes the whole tree
+    with open(PGN_path) as pgn :
+        root = reader.read_tree(pgn, colour)
     tree.update_statuses(root)
     tree.save(RPT_path, root)
@@ -0,0 +1,57 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# export-pgn.py
+
+# SYNOPSIS
+# A script that exports items to a PGN file.
+# Usage:
+#
+#     python3 export-pgn.py <source> <destination> [-a]
+#
+# The source is an item, a category, a collection or the whole
+# library; each item is written as one game. With `-a', solutions
+# are annotated with their training status and due date.
+
+import os
+import sys
+
+import paths
+import export
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) not in (3, 4) or
+        (len(args) == 4 and args[3] != "-a") or
+        not os.path.exists(args[1])) :
+        print("usage: python3 export-pgn.py <source> <destination> [-a]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    filepaths = paths.asset_item_paths(sys.argv[1].rstrip('/'))
+    with open(sys.argv[2], "w") as pgn :
+        export.export_items(pgn, filepaths, len(sys.argv) == 4)
+    print(f"Exported {len(filepaths)} items.")
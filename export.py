@@ -0,0 +1,180 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE export.py
+
+# SYNOPSIS
+# Provides functions for exporting items to PGN.
+# Typically only the functions export_items() and export_tree() will
+# be imported.
+
+# Each item is written as one game, whose variations are the lines
+# of the tree. The movetext is written token by token, as the tree
+# is walked with a single board, so that neither a python chess game
+# nor the PGN string is ever built: memory is bounded by the depth
+# of the tree, and items are loaded one at a time. Optionally, each
+# solution is annotated with a comment holding its training status
+# and, for solutions in review, its due date.
+
+import datetime
+
+import chess
+
+import tree
+
+# Maximum length of a line of movetext.
+LINE_WIDTH = 79
+
+# Operations of the walk in write_movetext().
+LINE = 0
+OPEN = 1
+CLOSE = 2
+PUSH = 3
+POP = 4
+
+# export_items()
+# Writes the items with the given filepaths to a PGN file, in order.
+# Items are exported as saved, without rolling them over.
+def export_items(file, filepaths, annotate = False) :
+    for filepath in filepaths :
+        root = tree.load_raw(filepath)
+        export_tree(file, root, event_name(filepath), annotate)
+
+# event_name()
+# Returns the name of an item for the Event tag of its game: its
+# filepath, without the extension.
+def event_name(filepath) :
+    if (filepath.endswith(".rpt")) :
+        return filepath[:-4]
+    return filepath
+
+# export_tree()
+# Writes a tree to a PGN file as a single game.
+def export_tree(file, root, event = "?", annotate = False) :
+    colour = "White" if root.meta.colour else "Black"
+    write_tag(file, "Event", event)
+    write_tag(file, "Site", "?")
+    write_tag(file, "Date", datetime.date.today().strftime("%Y.%m.%d"))
+    write_tag(file, "Round", "?")
+    write_tag(file, "White", "?")
+    write_tag(file, "Black", "?")
+    write_tag(file, "Result", "*")
+    write_tag(file, "Colour", colour)
+    if (root.board().fen() != chess.STARTING_FEN) :
+        write_tag(file, "SetUp", "1")
+        write_tag(file, "FEN", root.fen)
+    file.write("\n")
+    writer = Writer(file)
+    write_movetext(writer, root, annotate)
+    writer.token("*")
+    writer.end()
+    file.write("\n")
+
+# write_tag()
+# Writes a header tag.
+def write_tag(file, tag, value) :
+    value = value.replace('\\', '\\\\').replace('"', '\\"')
+    file.write(f'[{tag} "{value}"]\n')
+
+# write_movetext()
+# Writes the moves of a tree, with variations, to a Writer.
+# The tree is walked with an explicit stack of operations: LINE
+# writes the main move at a node and schedules the rest of the node;
+# OPEN and CLOSE delimit a side variation, OPEN writing its first
+# move; PUSH and POP move the board along the walk.
+def write_movetext(writer, root, annotate) :
+    board = root.board()
+    table = root.table if annotate else None
+    stack = [(LINE, root)]
+    while (len(stack) != 0) :
+        operation, node = stack.pop()
+        if (operation == LINE) :
+            if (len(node.variations) == 0) :
+                continue
+            main = node.variations[0]
+            write_move(writer, board, main, table)
+            stack += [(POP, main), (LINE, main), (PUSH, main)]
+            for child in reversed(node.variations[1:]) :
+                stack += [(CLOSE, child), (POP, child), (LINE, child),
+                          (PUSH, child), (OPEN, child)]
+        elif (operation == OPEN) :
+            writer.token("(")
+            writer.number = True
+            write_move(writer, board, node, table)
+        elif (operation == CLOSE) :
+            writer.token(")")
+            writer.number = True
+        elif (operation == PUSH) :
+            board.push(node.move)
+        else :
+            board.pop()
+
+# write_move()
+# Writes the move of a node, played from the board's position, with
+# its number if needed and its annotation if table is given.
+def write_move(writer, board, node, table) :
+    if (board.turn == chess.WHITE) :
+        writer.token(f"{board.fullmove_number}.")
+    elif (writer.number) :
+        writer.token(f"{board.fullmove_number}...")
+    writer.token(board.san(node.move))
+    writer.number = False
+    if (table != None and tree.is_solution(node)) :
+        writer.token(annotation(table, node.row))
+        writer.number = True
+
+# annotation()
+# Returns the comment holding the training data of a row.
+def annotation(table, row) :
+    status = tree.Status(table.status[row])
+    if (status == tree.Status.REVIEW) :
+        due = datetime.date.fromordinal(table.due[row])
+        return "{" + f"{status.name} due {due.isoformat()}" + "}"
+    return "{" + status.name + "}"
+
+# Writes movetext tokens to a file, in lines of at most LINE_WIDTH
+# characters. number records whether the next black move must be
+# given its number (at the start of a variation, or after one, or
+# after a comment).
+class Writer :
+    def __init__(self, file) :
+        self.file = file
+        self.line = []
+        self.length = 0
+        self.number = True
+
+    # token()
+    # Writes a token.
+    def token(self, text) :
+        if (self.length != 0 and
+            self.length + 1 + len(text) > LINE_WIDTH) :
+            self.end()
+        if (self.length != 0) :
+            self.length += 1
+        self.line.append(text)
+        self.length += len(text)
+
+    # end()
+    # Ends the current line.
+    def end(self) :
+        if (self.length != 0) :
+            self.file.write(" ".join(self.line) + "\n")
+        self.line = []
+        self.length = 0
@@ -20,9 +20,21 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 # MODULE graphics.py
 
 # SYNOPSIS 
-# This module implements a basic graphical chess board.
-# Typically only the functions clear() and print_board()
-# will be imported.
+# This module implements a basic graphical chess board, and the
+# screen composition layer through which all terminal output passes.
+# Typically only the functions clear(), write(), read() and
+# print_board() will be imported.
+
+# Rather than printing line by line, a screen (or `frame') is built
+# up in a buffer by write() and sent to the terminal in a single
+# call by flush(), which read() invokes before waiting for input.
+# clear() begins a new frame; the terminal is cleared with ANSI
+# control sequences when the frame is flushed. If the environment
+# variable CHESSIC_DIFF_FRAMES is set, only the rows which differ
+# from the previous frame are rewritten.
+
+import os
+import sys
 
 from colorama import Fore, Back, Style # handles coloured printing
 
@@ -32,13 +44,100 @@ white_pieces = ['\u2654','\u2655','\u2656',
 black_pieces = ['\u265a','\u265b','\u265c',
                 '\u265d','\u265e','\u265f']
 
-# clear()
-# `Clears' the terminal screen by inserting many line breaks.
+# ANSI control sequences.
+HOME = "\x1b[H"
+ERASE_DISPLAY = "\x1b[2J"
+ERASE_LINE = "\x1b[K"
+ERASE_BELOW = "\x1b[J"
+
+# Whether frames are diffed against the previous frame.
+diff_frames = (os.environ.get("CHESSIC_DIFF_FRAMES", "") != "")
+
+# The frame under composition.
+# lines holds the rows of the frame, including the rows occupied
+# by prompts and the user's replies, so that it mirrors the screen;
+# written is the number of rows already sent to the terminal;
+# previous holds the rows of the last frame shown (None if the
+# screen contents are unknown); fresh is true if the frame has not
+# been flushed since clear() was called.
+class Frame :
+    def __init__(self) :
+        self.lines = []
+        self.written = 0
+        self.previous = None
+        self.fresh = False
+
+frame = Frame()
 
+# clear()
+# Begins a new frame. The screen is cleared when it is flushed.
 def clear() :
-    height = 40
-    for x in range(height) :
-        print("")
+    if (not frame.fresh) :
+        frame.previous = frame.lines
+    frame.lines = []
+    frame.written = 0
+    frame.fresh = True
+
+# write()
+# Appends the given string to the frame, as print() would print it.
+def write(string = "") :
+    frame.lines += string.split("\n")
+
+# read()
+# Flushes the frame and prompts the user for input.
+# The prompt and the user's reply are recorded in the frame.
+def read(string = "") :
+    flush()
+    command = input(string)
+    rows = string.split("\n")
+    rows[-1] += command
+    frame.lines += rows
+    frame.written = len(frame.lines)
+    return command
+
+# flush()
+# Writes the unwritten part of the frame to the terminal in a single
+# call. A fresh frame is drawn in full, or diffed against the
+# previous frame if diff_frames is set.
+def flush() :
+    if (frame.fresh) :
+        if (diff_frames and frame.previous != None) :
+            output = frame_diff(frame.previous, frame.lines)
+        else :
+            output = HOME + ERASE_DISPLAY + join_rows(frame.lines)
+        frame.fresh = False
+    else :
+        output = join_rows(frame.lines[frame.written:])
+    frame.written = len(frame.lines)
+    sys.stdout.write(output)
+    sys.stdout.flush()
+
+# join_rows()
+# Returns the output string for the given rows, each terminated by
+# a line break.
+def join_rows(rows) :
+    if (len(rows) == 0) :
+        return ""
+    return "\n".join(rows) + "\n"
+
+# frame_diff()
+# Returns the output string that transforms the screen showing the
+# previous rows into one showing the current rows. Unchanged rows
+# are skipped; changed rows are rewritten in place and everything
+# below the current rows is erased.
+def frame_diff(previous, current) :
+    output = ""
+    for index, row in enumerate(current) :
+        if (index >= len(previous) or previous[index] != row) :
+            output += move_cursor(index) + row + ERASE_LINE
+    output += move_cursor(len(current)) + ERASE_BELOW
+    return output
+
+# move_cursor()
+# Returns the sequence moving the cursor to the start of the given
+# (zero-indexed) row.
+def move_cursor(row) :
+    return "\x1b[" + str(row + 1) + ";1H"
 
 # print_board()        
 # Pretty prints the board given as a unicode string from
@@ -48,6 +147,19 @@ def clear() :
 # .unicode is a python chess method that returns a unicode
 # string representation of the board
 def print_board(board,player) :        
+    write(board_print_string(board, player))
+
+# print_in_use()
+# Tells the user that an item cannot be opened because another
+# process (e.g. another terminal) holds its lock.
+def print_in_use() :
+    clear()
+    write("This item is in use elsewhere.")
+    read("Hit [Enter] to continue :")
+
+# board_print_string()
+# Returns the coloured string printed by print_board().
+def board_print_string(board, player) :
     board_string = board.unicode(invert_color = False,
                                  empty_square = " ")
     board_string = remove_spaces(board_string)
@@ -58,7 +170,7 @@ def print_board(board,player) :
     board_height = 8
     for row in range(board_height) :
         print_string += row_string(row, board_string)
-    print(print_string)    
+    return print_string
 
 # board_whitespace()    
 # Removes whitespace in the chess board string.
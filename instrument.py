@@ -0,0 +1,204 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE instrument.py
+
+# SYNOPSIS
+# Provides timers and counters for the hot paths of Chessic (loading,
+# saving, statistics, status updates and queue generation).
+# Instrumentation is enabled by the environment variable
+# CHESSIC_INSTRUMENT:
+#
+#     CHESSIC_INSTRUMENT=table python3 chessic.py
+#     CHESSIC_INSTRUMENT=json  python3 chessic.py
+#
+# and the measurements are written at exit, as a summary table or as
+# JSON, to standard error or to the file named by
+# CHESSIC_INSTRUMENT_FILE.
+
+# Functions are instrumented with the decorators timed() and
+# visited(). When instrumentation is disabled, both return the
+# function itself, so that there is no overhead at all.
+# timed() records the durations of calls in a histogram of power of
+# two buckets, in microseconds; calls made within a call to the same
+# function (i.e. recursive calls) are not timed separately.
+# visited() counts every call, which for the recursive walkers is
+# the number of nodes visited.
+# The server calls instrumented functions from several threads, so
+# timers and counters are only updated under a mutex, and the timers
+# active (for the recursion test) are kept per thread.
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import functools
+
+# Output format, or None if instrumentation is disabled.
+FORMAT = os.environ.get("CHESSIC_INSTRUMENT") or None
+
+# True if instrumentation is enabled.
+enabled = (FORMAT != None)
+
+# Timers by name.
+timers = {}
+
+# Counters by name.
+counters = {}
+
+# Mutex guarding the timers and counters.
+mutex = threading.Lock()
+
+# Per thread state: `active', the names of the timers of the calls
+# being timed.
+local = threading.local()
+
+# A timer: the number of calls, their total, minimum and maximum
+# durations in seconds, and a histogram of durations by bucket (a
+# bucket b holds durations of less than 2**b microseconds).
+class Timer :
+    __slots__ = ('calls', 'total', 'minimum', 'maximum', 'buckets')
+
+    def __init__(self) :
+        self.calls = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = 0.0
+        self.buckets = {}
+
+    # record()
+    # Records the duration of a call, in seconds. The caller holds the
+    # mutex.
+    def record(self, duration) :
+        self.calls += 1
+        self.total += duration
+        if (self.minimum == None or duration < self.minimum) :
+            self.minimum = duration
+        self.maximum = max(self.maximum, duration)
+        bucket = int(duration * 1e6).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    # summary()
+    # Returns the timer as a dictionary, with durations in
+    # milliseconds.
+    def summary(self) :
+        return {"calls" : self.calls,
+                "total_ms" : round(self.total * 1e3, 3),
+                "mean_ms" : round(self.total * 1e3 / self.calls, 3),
+                "min_ms" : round(self.minimum * 1e3, 3),
+                "max_ms" : round(self.maximum * 1e3, 3),
+                "histogram_us" : {f"<{2 ** bucket}" : count
+                                  for bucket, count
+                                  in sorted(self.buckets.items())}}
+
+# timed()
+# A decorator timing the calls of a function under the given name.
+def timed(name) :
+    def decorate(function) :
+        if (not enabled) :
+            return function
+        timer = timers.setdefault(name, Timer())
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs) :
+            active = getattr(local, "active", None)
+            if (active == None) :
+                active = local.active = set()
+            if (name in active) :
+                return function(*args, **kwargs)
+            active.add(name)
+            start = time.perf_counter()
+            try :
+                return function(*args, **kwargs)
+            finally :
+                duration = time.perf_counter() - start
+                active.discard(name)
+                with mutex :
+                    timer.record(duration)
+        return wrapper
+    return decorate
+
+# visited()
+# A decorator counting the calls of a function under the given name.
+def visited(name) :
+    def decorate(function) :
+        if (not enabled) :
+            return function
+        counters.setdefault(name, 0)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs) :
+            with mutex :
+                counters[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# count()
+# Adds to a counter. Callers should test `enabled' first, so as to
+# cost nothing when instrumentation is disabled.
+def count(name, amount = 1) :
+    with mutex :
+        counters[name] = counters.get(name, 0) + amount
+
+# report()
+# Returns the measurements as a dictionary.
+def report() :
+    with mutex :
+        return {"timers" : {name : timer.summary()
+                            for name, timer in sorted(timers.items())
+                            if timer.calls != 0},
+                "counters" : dict(sorted(counters.items()))}
+
+# table()
+# Returns the measurements as a summary table.
+def table() :
+    lines = ["timer".ljust(40) + "calls".rjust(8) + "total ms".rjust(12)
+             + "mean ms".rjust(10) + "max ms".rjust(10)]
+    measurements = report()
+    for name, summary in measurements["timers"].items() :
+        lines.append(name.ljust(40) + str(summary["calls"]).rjust(8)
+                     + f"{summary['total_ms']:.1f}".rjust(12)
+                     + f"{summary['mean_ms']:.3f}".rjust(10)
+                     + f"{summary['max_ms']:.1f}".rjust(10))
+    lines.append("")
+    lines.append("counter".ljust(40) + "count".rjust(12))
+    for name, value in measurements["counters"].items() :
+        lines.append(name.ljust(40) + str(value).rjust(12))
+    return "\n".join(lines) + "\n"
+
+# dump()
+# Writes the measurements in the chosen format.
+def dump() :
+    if (FORMAT == "json") :
+        text = json.dumps(report(), indent = 2) + "\n"
+    else :
+        text = table()
+    filepath = os.environ.get("CHESSIC_INSTRUMENT_FILE")
+    if (filepath) :
+        with open(filepath, "w") as file :
+            file.write(text)
+    else :
+        sys.stderr.write(text)
+
+if (enabled) :
+    atexit.register(dump)
@@ -0,0 +1,135 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE locks.py
+
+# SYNOPSIS
+# Provides advisory locks on items, so that several processes (two
+# terminals, or a terminal and a background job such as rollover.py)
+# can use the same library safely.
+
+# Anything that modifies an item holds an exclusive lock on it: a
+# training or management session for its whole length, and a job
+# while it rewrites the item. Reads take a shared lock when they can,
+# so that a writer waits for reads in progress; when an exclusive
+# lock is held elsewhere, they go ahead without it. This is safe
+# because an item file is never modified in place: tree.save() writes
+# a new file and renames it over the old one, so every read sees a
+# complete snapshot of the item as last saved.
+
+# The lock of an item is held on a separate lock file, since the
+# item file itself is replaced by every save. Locks are held by open
+# file descriptions (see flock(2)), so a lock held by this process is
+# recorded in held, and taken again by this process without waiting.
+# Where fcntl is not available, locking does nothing.
+
+import os
+import time
+import contextlib
+
+try :
+    import fcntl
+except ImportError :
+    fcntl = None
+
+# Time to wait for a lock before giving up, in seconds.
+TIMEOUT = 2.0
+
+# Interval between attempts to take a lock, in seconds.
+INTERVAL = 0.05
+
+# Locks held by this process, by filepath: pairs (file, exclusive).
+held = {}
+
+# lock_path()
+# Returns the path of the lock file of an item.
+def lock_path(filepath) :
+    dirpath, name = os.path.split(filepath)
+    return os.path.join(dirpath, "." + name + ".lock")
+
+# acquire()
+# Takes the lock of an item, exclusive or shared, waiting at most
+# timeout seconds. Returns true if the lock was taken (or is already
+# held by this process, exclusively if required).
+def acquire(filepath, exclusive, timeout = TIMEOUT) :
+    if (filepath in held) :
+        return held[filepath][1] or not exclusive
+    if (fcntl == None) :
+        held[filepath] = (None, exclusive)
+        return True
+    try :
+        file = open(lock_path(filepath), "a")
+    except OSError :
+        return not exclusive
+    operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    deadline = time.monotonic() + timeout
+    while (True) :
+        try :
+            fcntl.flock(file, operation | fcntl.LOCK_NB)
+            break
+        except BlockingIOError :
+            if (time.monotonic() >= deadline) :
+                file.close()
+                return False
+            time.sleep(INTERVAL)
+    held[filepath] = (file, exclusive)
+    return True
+
+# release()
+# Releases the lock of an item held by this process.
+def release(filepath) :
+    file, exclusive = held.pop(filepath)
+    if (file != None) :
+        file.close()
+
+# holds()
+# Returns true if this process holds the exclusive lock of an item.
+def holds(filepath) :
+    return filepath in held and held[filepath][1]
+
+# exclusive()
+# A context manager holding the exclusive lock of an item, if it can
+# be taken within timeout seconds; yields true if it was.
+@contextlib.contextmanager
+def exclusive(filepath, timeout = TIMEOUT) :
+    with locked(filepath, True, timeout) as acquired :
+        yield acquired
+
+# shared()
+# A context manager holding the shared lock of an item for a read,
+# if it is free; yields true if it was taken. The read may go ahead
+# either way.
+@contextlib.contextmanager
+def shared(filepath) :
+    with locked(filepath, False, 0) as acquired :
+        yield acquired
+
+# locked()
+# A context manager for acquire() and release(); a lock already held
+# by this process is left held.
+@contextlib.contextmanager
+def locked(filepath, exclusive, timeout) :
+    taken = (filepath not in held)
+    acquired = acquire(filepath, exclusive, timeout)
+    try :
+        yield acquired
+    finally :
+        if (taken and acquired) :
+            release(filepath)
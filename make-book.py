@@ -0,0 +1,53 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# make-book.py
+
+# SYNOPSIS
+# A script that writes a Polyglot opening book of items.
+# Usage:
+#
+#     python3 make-book.py <source> <destination>
+#
+# The source is an item, a category, a collection or the whole
+# library; see book.py.
+
+import os
+import sys
+
+import paths
+import book
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) != 3 or not os.path.exists(args[1])) :
+        print("usage: python3 make-book.py <source> <destination>")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    filepaths = paths.asset_item_paths(sys.argv[1].rstrip('/'))
+    count = book.write_book(sys.argv[2], filepaths)
+    print(f"Wrote {count} entries from {len(filepaths)} items.")
@@ -31,7 +31,9 @@ import os
 
 import tree
 import paths
-from graphics import print_board, clear
+import locks
+import writer
+from graphics import print_board, print_in_use, clear, write, read
 
 # represents_int()
 # Determines whether a string represents an integer.
@@ -44,74 +46,84 @@ def represents_int(string):
 
 # manage()
 # Launches the dialogue for tree management.
+# The item is locked for the whole session (see locks.py), and its
+# saves are written before the lock is released, even if the session
+# ends with an error.
 def manage(filepath):
-    root = tree.load(filepath)
-    colour = root.meta.colour
-    board = root.board()
-    node = root       
+    with locks.exclusive(filepath) as acquired :
+        if (not acquired) :
+            print_in_use()
+            return
+        try :
+            root = tree.load(filepath)
+            colour = root.meta.colour
+            board = root.board()
+            node = root       
 
-    command = ""
-    while(command != "c") :
-        clear()
-        print_turn(board)
-        print_board(board,colour)
-        print_moves(node, board)
-        print_options(node)
-        node, command = prompt(node, board, filepath)
+            command = ""
+            while(command != "c") :
+                clear()
+                print_turn(board)
+                print_board(board,colour)
+                print_moves(node, board)
+                print_options(node)
+                node, command = prompt(node, board, filepath)
+        finally :
+            writer.background.flush(filepath)
 
 # print_turn()
 # Prints the player to move in the board position.
 def print_turn(board) :
-    print("")
+    write("")
     if (board.turn) :
-        print("WHITE to play.\n")
+        write("WHITE to play.\n")
     else :
-        print("BLACK to play.\n")
+        write("BLACK to play.\n")
 
 # print_moves()        
 # Prints moves of the variations of the given node.
 def print_moves(node, board) :
     if (tree.is_raw_problem(node)) :
         if (node.is_end()) :
-            print("No solutions.")
+            write("No solutions.")
         else :
-            print("Solutions:")
+            write("Solutions:")
             for index, solution in enumerate(node.variations) :
                 san = board.san(solution.move)
-                print(str(index + 1).ljust(3) + san)
+                write(str(index + 1).ljust(3) + san)
     else :
         if (node.is_end()) :
-            print("No problems.")
+            write("No problems.")
         else :
-            print("Problems:")
+            write("Problems:")
             for index, problem in enumerate(node.variations) :
                 san = board.san(problem.move)                
-                print(str(index + 1).ljust(3) + san)
-    print("")
+                write(str(index + 1).ljust(3) + san)
+    write("")
 
 # print_options()
 # Prints the user options for the given node.
 def print_options(node) :
-    print ("<move> add move")
+    write("<move> add move")
     if (not node.is_end()) :
-        print ("<ID> play move")            
-        print("'d' delete")
+        write("<ID> play move")            
+        write("'d' delete")
     if (len(node.variations) > 1) :
-        print("'p' promote")
+        write("'p' promote")
     if (node.parent != None) :
-        print("'b' back")
-    print ("'c' close")
+        write("'b' back")
+    write("'c' close")
 
 # prompt()
 # Handles the user prompt at the bottom of the management dialogue.
 def prompt(node, board, filepath) :
-    command = input("\n:")
+    command = read("\n:")
     if (command == "b" and not tree.is_root(node)) :
         node = pop_move(node, board)
     elif (command == "d" and len(node.variations) != 0) :
         delete_move(node, board, filepath)            
     elif (command == "p" and len(node.variations) > 1) :
-        promote_move(node,board)
+        promote_move(node, board, filepath)
     elif (represents_int(command) and
           1 <= int(command) <= len(node.variations)) :
         node = play_move(node, board, int(command) - 1)
@@ -128,31 +140,37 @@ def pop_move(node, board) :
 
 # delete_move()
 # Deletes a move from the tree.
-# Statuses are updated and the tree is saved. This is best done
-# here, not at the end of manage(), because updating statuses
-# should be avoided when the tree is not modified.
+# Statuses are updated and the tree is saved (in the background,
+# see writer.py). This is best done here, not at the end of
+# manage(), because updating statuses should be avoided when the
+# tree is not modified.
 def delete_move(node, board, filepath) :
-    command = input("ID to delete: ")
+    command = read("ID to delete: ")
     if (represents_int(command) and
         1 <= int(command) <= len(node.variations)) :
         index = int(command) - 1
         variation = node.variations[index]
         san = board.san(variation.move)        
-        print(f"You are about to permanently delete '{san}'.")
-        command = input("Are you sure? (y/n): ")
+        write(f"You are about to permanently delete '{san}'.")
+        command = read("Are you sure? (y/n): ")
         if (command == "y") :
-            node.remove_variation(variation)
-            tree.update_statuses(node.game())
-            tree.save(filepath, node.game())            
+            with writer.background.guard :
+                tree.remove_child(node, variation)
+                tree.update_statuses(node.game())
+            writer.background.save(filepath, node.game())
 
 # promote_move()
 # Promotes a move to the main variation. 
-def promote_move(node,board) :
-    command = input("ID to promote: ")
+# The tree is saved, so that the loaded tree, which is shared through
+# the item cache, never differs from the file.
+def promote_move(node, board, filepath) :
+    command = read("ID to promote: ")
     if (represents_int(command) and
         1 <= int(command) <= len(node.variations)) :
         index = int(command) - 1
-        node.promote_to_main(node.variations[index])
+        with writer.background.guard :
+            node.promote_to_main(node.variations[index])
+        writer.background.save(filepath, node.game())
 
 # play_move()
 # Moves to the node reached by the given move.
@@ -163,21 +181,23 @@ def play_move(node, board, variation_index) :
 
 # add_move()
 # Adds a move to the tree.
-# Statuses are updated and the tree is saved. This is best done
-# here, not at the end of manage(), because updating statuses
-# should be avoided when the tree is not modified.
+# Statuses are updated and the tree is saved (in the background,
+# see writer.py). This is best done here, not at the end of
+# manage(), because updating statuses should be avoided when the
+# tree is not modified.
 def add_move(node, board, command, filepath) :
     if (is_valid_uci(command, board)) :
         move = chess.Move.from_uci(command)
     else :
         move = board.parse_san(command)
     if (node.has_variation(move)) :
-        print("\nMove already exists.")
-        input("Hit [Enter] to continue :")
+        write("\nMove already exists.")
+        read("Hit [Enter] to continue :")
     else :
-        tree.add_child(node, move)
-        tree.update_statuses(node.game())
-        tree.save(filepath, node.game())            
+        with writer.background.guard :
+            tree.add_child(node, move)
+            tree.update_statuses(node.game())
+        writer.background.save(filepath, node.game())
         board.push(move)        
         node = node.variation(move)
     return node
@@ -213,11 +233,11 @@ def new_tree_title(filepath) :
     clear()
     width = 22
     name = paths.item_name(filepath)
-    print("CREATING NEW ITEM ->".ljust(width) + name)
-    print("")
-    print("CATEGORY".ljust(width) + paths.category_name(filepath))
-    print("COLLECTION".ljust(width) +paths.collection_name(filepath))
-    print("")
+    write("CREATING NEW ITEM ->".ljust(width) + name)
+    write("")
+    write("CATEGORY".ljust(width) + paths.category_name(filepath))
+    write("COLLECTION".ljust(width) +paths.collection_name(filepath))
+    write("")
 
 # select_colour()
 # Returns the `tree colour' (i.e. the colour of the player who
@@ -226,7 +246,7 @@ def select_colour(filepath) :
     command = ""
     while (command != "w" and command != "b") :
         new_tree_title(filepath)
-        command = input("Select playing colour (w/b): ")
+        command = read("Select playing colour (w/b): ")
     if (command == "w") :
         return True
     else :
@@ -239,7 +259,7 @@ def select_position(filepath, colour) :
     command = "."
     while(command != "") :
         new_tree_title(filepath)
-        print("Choose starting position.\n")
+        write("Choose starting position.\n")
         print_board(board, colour)
         position_options(board)
         command = position_prompt(board)
@@ -248,17 +268,17 @@ def select_position(filepath, colour) :
 # position_options()
 # Prints options for the select_position() dialogue.
 def position_options(board) :
-    print("<move> play move")
-    print("<Enter> select position")
+    write("<move> play move")
+    write("<Enter> select position")
     if (len(board.move_stack) != 0) :
-        print("'b' backup")
+        write("'b' backup")
     else :
-        print("")
+        write("")
 
 # position_prompt()
 # Handles the prompt for the select_position() dialogue.
 def position_prompt(board) :
-    command = input("\n:")
+    command = read("\n:")
     clear()
     if (command == "b" and len(board.move_stack) != 0) :
         board.pop()
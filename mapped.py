@@ -0,0 +1,230 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE mapped.py
+
+# SYNOPSIS
+# Provides the fixed layout of item files, and a reader that maps
+# such a file into memory (see mmap) and views its columns in place.
+# Typically only the functions dumps() and loads(), through
+# tree.dumps() and tree.load_raw(), and open_item(), through
+# tree.load_mapped(), will be used.
+
+# An item file in the fixed layout holds, in order: a HEADER (MAGIC,
+# the VERSION, and the numbers of nodes, of rows of the training
+# table, of reachable solutions and of bytes of metadata); the
+# initial position and metadata, pickled; and, from the next multiple
+# of eight bytes, the COLUMNS, little-endian, one after the other.
+# The structure of the tree is held as by tree.flatten_structure():
+# the move code, number of children and row of each node, in
+# preorder. The training table is held by column. The rows of the
+# solutions reachable in training (see tree.reachable()) are held
+# too, since they depend only on the structure of the tree; so
+# statistics need read only those rows of the statuses and due
+# dates, and nothing of the structure.
+
+# A mapped item views each column of the file as a memoryview,
+# without copying it, so that only the pages read are brought into
+# memory, and they stay in the page cache rather than the heap. The
+# mapping is a snapshot: a save replaces the file rather than
+# modifying it, so the mapped file never changes.
+
+import sys
+import mmap
+import array
+import pickle
+import struct
+
+import tree
+
+# Marks the start of an item file in the fixed layout.
+MAGIC = b"CHFL"
+
+# Version of the layout.
+VERSION = 1
+
+# Header: MAGIC, VERSION, unused, numbers of nodes, rows, reachable
+# solutions and bytes of metadata.
+HEADER = struct.Struct("<4sHHIIII")
+
+# Columns in order: name, type code, and whether each has an entry
+# for every node, every row or every reachable solution. The columns
+# of four byte entries come first, so that every column is aligned.
+COLUMNS = (("rows", 'i', "nodes"),
+           ("due", 'i', "table"),
+           ("previous_due", 'i', "table"),
+           ("reachable", 'i', "reachable"),
+           ("codes", 'H', "nodes"),
+           ("counts", 'H', "nodes"),
+           ("status", 'b', "table"))
+
+# The views of a mapped item file: the initial position, metadata,
+# structure, training table and reachable rows. The table is a
+# tree.TrainingTable whose columns are views of the file, and so may
+# not be modified. A mapped item must be closed when done with, and
+# no views of its columns kept.
+class MappedItem :
+    def __init__(self, file) :
+        self.map = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+        self.buffer = memoryview(self.map)
+        self.fen, self.meta, columns = parse(self.buffer)
+        self.views = []
+        for name, start, end, typecode in columns :
+            self.views.append(view(self.buffer[start:end], typecode))
+        (self.rows, due, previous_due, self.reachable, self.codes,
+         self.counts, status) = self.views
+        self.table = tree.TrainingTable()
+        self.table.status = status
+        self.table.due = due
+        self.table.previous_due = previous_due
+
+    # close()
+    # Releases the views and unmaps the file.
+    def close(self) :
+        for column in self.views :
+            if (isinstance(column, memoryview)) :
+                column.release()
+        self.views = []
+        self.buffer.release()
+        self.map.close()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exception) :
+        self.close()
+
+# is_mapped()
+# Returns true if data (the start of an item file, at least) is in
+# the fixed layout.
+def is_mapped(data) :
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+# dumps()
+# Returns the contents of an item file holding a tree in the fixed
+# layout.
+def dumps(root) :
+    codes, counts, rows, reachable = flatten_columns(root)
+    table = root.table
+    meta = pickle.dumps((root.fen, root.meta))
+    columns = {"rows" : rows, "due" : table.due,
+               "previous_due" : table.previous_due,
+               "reachable" : reachable, "codes" : codes,
+               "counts" : counts, "status" : table.status}
+    parts = [HEADER.pack(MAGIC, VERSION, 0, len(codes), len(table),
+                         len(reachable), len(meta)), meta]
+    parts.append(bytes(start_of_columns(len(meta)) - HEADER.size
+                       - len(meta)))
+    for name, typecode, length in COLUMNS :
+        column = columns[name]
+        if (sys.byteorder == "big") :
+            column = array.array(typecode, column)
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b"".join(parts)
+
+# flatten_columns()
+# Returns the arrays of tree.flatten_structure() for a tree, and an
+# array of the rows of its reachable solutions, in preorder.
+def flatten_columns(root) :
+    codes = array.array('H')
+    counts = array.array('H')
+    rows = array.array('i')
+    reachable = array.array('i')
+    stack = [(root, True)]
+    while (len(stack) != 0) :
+        node, followed = stack.pop()
+        codes.append(node.code)
+        counts.append(len(node.variations))
+        rows.append(node.row)
+        if (followed and node.row >= 0) :
+            reachable.append(node.row)
+        if (len(node.variations) != 0) :
+            main = node.variations[0]
+            others = followed and main.row < 0
+            for child in reversed(node.variations[1:]) :
+                stack.append((child, others))
+            stack.append((main, followed))
+    return codes, counts, rows, reachable
+
+# start_of_columns()
+# Returns the offset of the columns, given the size of the metadata.
+def start_of_columns(meta_size) :
+    return (HEADER.size + meta_size + 7) // 8 * 8
+
+# parse()
+# Returns the initial position and metadata held by the contents of
+# an item file in the fixed layout, and the extent of each column,
+# as tuples (name, start, end, type code).
+def parse(data) :
+    (magic, version, unused, nodes, rows, reachable,
+     meta_size) = HEADER.unpack_from(data)
+    if (magic != MAGIC or version != VERSION) :
+        raise ValueError("not an item file in the fixed layout")
+    fen, meta = pickle.loads(data[HEADER.size:HEADER.size + meta_size])
+    lengths = {"nodes" : nodes, "table" : rows, "reachable" : reachable}
+    columns = []
+    start = start_of_columns(meta_size)
+    for name, typecode, length in COLUMNS :
+        end = start + lengths[length] * array.array(typecode).itemsize
+        columns.append((name, start, end, typecode))
+        start = end
+    return fen, meta, columns
+
+# view()
+# Returns a view of the bytes of a column as entries of the given
+# type; a copy, where the byte order is not little-endian.
+def view(data, typecode) :
+    if (sys.byteorder == "big") :
+        column = array.array(typecode, bytes(data))
+        column.byteswap()
+        return column
+    return data.cast(typecode)
+
+# loads()
+# Returns the tree held by the contents of an item file in the fixed
+# layout, built by build(): tree.rebuild(), or tree.flat_tree() for
+# a FlatTree. The columns are copied, so that the tree may be
+# modified.
+def loads(data, build) :
+    data = memoryview(data)
+    fen, meta, columns = parse(data)
+    copies = {}
+    for name, start, end, typecode in columns :
+        column = array.array(typecode)
+        column.frombytes(data[start:end])
+        if (sys.byteorder == "big") :
+            column.byteswap()
+        copies[name] = column
+    table = tree.TrainingTable()
+    table.status = copies["status"]
+    table.due = copies["due"]
+    table.previous_due = copies["previous_due"]
+    return build(fen, meta, table, copies["codes"], copies["counts"],
+                 copies["rows"])
+
+# open_item()
+# Maps the item file at filepath, returning a MappedItem, or None if
+# the file is not in the fixed layout.
+def open_item(filepath) :
+    with open(filepath, "rb") as file :
+        if (not is_mapped(file.read(len(MAGIC)))) :
+            return None
+        return MappedItem(file)
@@ -0,0 +1,87 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# merge-items.py
+
+# SYNOPSIS
+# A script that merges PGN files and items into a single item.
+# Usage:
+#
+#     python3 merge-items.py <destination> <w|b> <source> ...
+#
+# Each source is a PGN file, an item (.rpt), or a directory whose
+# PGN files and items are merged. If the destination item exists,
+# the sources are merged into it, and its training is kept.
+
+import os
+import sys
+
+import tree
+import merge
+import locks
+
+# source_paths()
+# Returns the paths of the PGN files and items given on the command
+# line, expanding directories.
+def source_paths(args) :
+    sources = []
+    for arg in args :
+        if (os.path.isdir(arg)) :
+            for filename in sorted(os.listdir(arg)) :
+                if (filename.endswith(".pgn") or
+                    filename.endswith(".rpt")) :
+                    sources.append(os.path.join(arg, filename))
+        else :
+            sources.append(arg)
+    return sources
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) < 4 or
+        (args[2] != "w" and args[2] != "b")) :
+        help_string = "usage: python3 merge-items.py"
+        help_string += " <destination> <w|b> <source> ..."
+        print(help_string)
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    destination = sys.argv[1]
+    colour = (sys.argv[2] == "w")
+    if (not locks.acquire(destination, True)) :
+        print(f"{destination} is in use.")
+        quit()
+    root = None
+    if (os.path.exists(destination)) :
+        root = tree.load(destination)
+        if (root.meta.colour != colour) :
+            print(f"{destination} is trained by the other colour.")
+            quit()
+    skipped = []
+    root = merge.merge(source_paths(sys.argv[3:]), colour, root, skipped)
+    tree.save(destination, root)
+    locks.release(destination)
+    for source in skipped :
+        print(f"Could not merge all of {source}.")
@@ -0,0 +1,215 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE merge.py
+
+# SYNOPSIS
+# Provides functions for merging PGN files and items into a single
+# training tree, and for re-importing an updated PGN into an item.
+# Typically only the functions merge() and reimport() will be
+# imported.
+
+# Sources are merged one at a time: PGN files are streamed through
+# the reader, and items are loaded and walked one by one, so that
+# memory is bounded by the merged tree and the largest item. Lines
+# shared with the tree are merged, and a line which transposes into
+# a position already in the tree continues from the node at that
+# position (see reader.Builder). A solution already in the tree keeps
+# its training data; a new solution merged from an item brings the
+# item's training data with it.
+
+import chess
+
+import tree
+import reader
+
+# merge()
+# Merges the sources, a list of paths of PGN files and items, into a
+# tree trained by the given colour. If root is None, a new tree is
+# created (see initial_fen()).
+# A game is merged if it starts from a position in the tree. PGN files
+# with games that could not be merged are read again once the rest
+# have been, as long as the tree grows. Items are merged if they
+# start from the initial position of the tree. The paths of sources
+# which could not be merged in full are appended to skipped, if given.
+# Statuses are updated, and the root is returned.
+def merge(sources, colour, root = None, skipped = None) :
+    if (root == None) :
+        fen = initial_fen(sources, colour)
+        root = tree.Root(fen, tree.MetaData(colour))
+    positions = {}
+    reader.index_positions(root, positions)
+    while (len(sources) != 0) :
+        size = len(positions)
+        deferred = []
+        for source in sources :
+            if (source.endswith(".rpt")) :
+                if (not merge_item(root, tree.load_raw(source), positions)
+                    and skipped != None) :
+                    skipped.append(source)
+            else :
+                with open(source) as file :
+                    if (not merge_pgn(root, file, positions)) :
+                        deferred.append(source)
+        sources = deferred
+        if (len(positions) == size) :
+            break
+    if (skipped != None) :
+        skipped += sources
+    tree.update_statuses(root)
+    return root
+
+# initial_fen()
+# Returns the FEN of the initial position for a tree merged from the
+# sources: the standard starting position if any game or item starts
+# there, otherwise the initial position of the first.
+def initial_fen(sources, colour) :
+    standard = reader.position_key(chess.STARTING_FEN)
+    first = None
+    for source in sources :
+        for fen in source_fens(source, colour) :
+            if (reader.position_key(fen) == standard) :
+                return chess.STARTING_FEN
+            if (first == None) :
+                first = chess.Board(fen).fen()
+    if (first == None) :
+        return chess.STARTING_FEN
+    return first
+
+# source_fens()
+# Generates the FEN of the initial position of each game of a PGN
+# file, or of an item trained by the given colour.
+def source_fens(source, colour) :
+    if (source.endswith(".rpt")) :
+        item = tree.load_raw(source)
+        if (item.meta.colour == colour) :
+            yield item.fen
+        return
+    with open(source) as file :
+        yield from game_fens(file)
+
+# game_fens()
+# Generates the FEN of the initial position of each game of a PGN
+# file.
+def game_fens(file) :
+    fen = chess.STARTING_FEN
+    for kind, value in reader.tokens(file) :
+        if (kind == reader.HEADER and value[0] == "FEN") :
+            fen = value[1]
+        elif (kind == reader.END) :
+            yield fen
+            fen = chess.STARTING_FEN
+
+# merge_pgn()
+# Merges the games of a PGN file into a tree. Returns False if some
+# games did not start from a position in the tree.
+def merge_pgn(root, file, positions) :
+    builder = reader.Builder(root, root.meta.colour, positions)
+    reader.build(builder, file)
+    return (builder.skipped == 0)
+
+# merge_item()
+# Merges an item into a tree. Returns False, merging nothing, if the
+# item is of the other colour or starts from a different position.
+def merge_item(root, item, positions) :
+    if (item.meta.colour != root.meta.colour or
+        reader.position_key(item.fen) != reader.position_key(root.fen)) :
+        return False
+    builder = reader.Builder(root, root.meta.colour, positions)
+    builder.start()
+    stack = [(item, (root, 0))]
+    while (len(stack) != 0) :
+        node, target = stack.pop()
+        for child in reversed(node.variations) :
+            builder.node, builder.depth = target
+            builder.sync()
+            if (child.row >= 0) :
+                data = tree.TrainingRow(item.table, child.row)
+            else :
+                data = builder.data
+            stack.append((child, builder.play(child.move, data)))
+    return True
+
+# reimport()
+# Updates a tree to the lines of a PGN file, as if the file had been
+# converted afresh, keeping the training data of every solution the
+# file still contains; new solutions are INACTIVE. If transpositions
+# is true, the file is read as by merge().
+# The tree read from the file is matched against the tree in a single
+# walk of both, so the update is linear in their size. Variations
+# take the order of the file.
+# Statuses are updated. Returns the numbers of solutions added and
+# removed.
+def reimport(root, file, transpositions = False) :
+    positions = {} if transpositions else None
+    update = reader.read_games(file, root.meta.colour,
+                               positions = positions)
+    if (reader.position_key(update.fen) != reader.position_key(root.fen)) :
+        raise ValueError("PGN does not start from the item's position")
+    added = 0
+    removed = 0
+    data = tree.TrainingData()
+    stack = [(root, update)]
+    while (len(stack) != 0) :
+        node, new = stack.pop()
+        children = {child.code : child for child in node.variations}
+        variations = []
+        for child in new.variations :
+            match = children.pop(child.code, None)
+            if (match == None) :
+                child.parent = node
+                added += graft(root, child, data)
+                variations.append(child)
+            else :
+                variations.append(match)
+                stack.append((match, child))
+        for child in children.values() :
+            removed += count_solutions(child)
+        node.variations = tuple(variations)
+    if (removed != 0) :
+        tree.compact(root)
+    tree.update_statuses(root)
+    return added, removed
+
+# graft()
+# Gives each solution of a subtree, new to the tree, a row of the
+# tree's training table holding data. Returns the number of solutions.
+def graft(root, node, data) :
+    count = 0
+    stack = [node]
+    while (len(stack) != 0) :
+        node = stack.pop()
+        if (node.row >= 0) :
+            node.row = root.table.append(data)
+            count += 1
+        stack += node.variations
+    return count
+
+# count_solutions()
+# Returns the number of solutions in a subtree.
+def count_solutions(node) :
+    count = 0
+    stack = [node]
+    while (len(stack) != 0) :
+        node = stack.pop()
+        if (node.row >= 0) :
+            count += 1
+        stack += node.variations
+    return count
@@ -26,6 +26,11 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 # the asset heirarchy; these functions returning the path pointing
 # to higher level assets. 
 
+# Names beginning with `.' are reserved for Chessic's own files
+# (see tree.ROLLOVER_STAMP, for example) and are never assets.
+
+import os
+
 # item_name()
 # Returns the item name from a filepath.
 def item_name(filepath) :
@@ -44,3 +49,55 @@ def collection_name(filepath) :
     path = filepath.split('/')
     return path[1]
 
+
+# collection_path()
+# Returns the path of the collection of an item, from its filepath.
+def collection_path(filepath) :
+    return os.path.dirname(os.path.dirname(filepath))
+
+# library_path()
+# Returns the path of the library (i.e. the directory containing
+# the collections) of an item, from its filepath, which may be
+# relative or absolute.
+def library_path(filepath) :
+    return os.path.dirname(collection_path(filepath))
+
+# listdir()
+# Returns the sorted names of the assets in a directory.
+def listdir(dirpath) :
+    names = [name for name in os.listdir(dirpath)
+             if not name.startswith('.')]
+    names.sort()
+    return names
+
+# item_paths()
+# Returns the filepaths of all items in the library.
+def item_paths(library) :
+    filepaths = []
+    for collection in listdir(library) :
+        filepaths += collection_item_paths(library + '/' + collection)
+    return filepaths
+
+# collection_item_paths()
+# Returns the filepaths of all items in a collection.
+def collection_item_paths(dirpath) :
+    filepaths = []
+    for category in listdir(dirpath) :
+        filepaths += category_item_paths(dirpath + '/' + category)
+    return filepaths
+
+# category_item_paths()
+# Returns the filepaths of all items in a category.
+def category_item_paths(dirpath) :
+    return [dirpath + '/' + item for item in listdir(dirpath)]
+
+# asset_item_paths()
+# Returns the filepaths of all items in an asset at any level of the
+# hierarchy: an item, a category, a collection or the library.
+def asset_item_paths(path) :
+    if (not os.path.isdir(path)) :
+        return [path]
+    filepaths = []
+    for name in listdir(path) :
+        filepaths += asset_item_paths(path + '/' + name)
+    return filepaths
@@ -0,0 +1,196 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE queues.py
+
+# SYNOPSIS
+# Provides prepared queues: the training queue of an item, worked
+# out in advance and saved in a small sidecar file, so that a
+# training session can show its first card without loading the item
+# (see trainer.play_prepared()). Queues are prepared by the daily
+# rollover (see rollover.py) and at the end of each session.
+
+# The sidecar of an item is the hidden file .<item>.queue beside it.
+# It holds a Prepared queue: the day it was prepared on, the stamp of
+# the item file it was prepared from (see cache.stamp()), the colour
+# of the item, the numbers of problems remaining shown by the
+# trainer, and a Card for each solution of the queue, in order. A
+# card holds the line of move codes of the solution, which identifies
+# it in the tree, the position of its problem, as FEN, and its
+# status. Only the first card is saved in the Prepared queue itself;
+# the rest follow it in the file, so that the start of a session
+# reads a constant amount. A prepared queue is only used on the day
+# it was prepared, and only if the item has not been saved since;
+# otherwise the trainer generates the queue from the item, as before.
+
+import os
+import array
+import pickle
+import datetime
+
+import chess
+
+import tree
+import cache
+import locks
+import stats
+import trainer
+
+# A card of a prepared queue.
+class Card :
+    __slots__ = ('line', 'fen', 'status')
+
+    def __init__(self, line, fen, status) :
+        self.line = line
+        self.fen = fen
+        self.status = status
+
+    def __getstate__(self) :
+        return (self.line, self.fen, self.status)
+
+    def __setstate__(self, state) :
+        self.line, self.fen, self.status = state
+
+# A prepared queue.
+# day is a date ordinal; counts are the numbers of new, learning and
+# due problems, as in trainer.remaining_string().
+class Prepared :
+    __slots__ = ('day', 'stamp', 'colour', 'counts', 'cards')
+
+    def __init__(self, day, stamp, colour, counts, cards) :
+        self.day = day
+        self.stamp = stamp
+        self.colour = colour
+        self.counts = counts
+        self.cards = cards
+
+    def __getstate__(self) :
+        return (self.day, self.stamp, self.colour, self.counts,
+                self.cards)
+
+    def __setstate__(self, state) :
+        (self.day, self.stamp, self.colour, self.counts,
+         self.cards) = state
+
+# sidecar_path()
+# Returns the path of the sidecar of an item.
+def sidecar_path(filepath) :
+    dirpath, name = os.path.split(filepath)
+    return os.path.join(dirpath, "." + name + ".queue")
+
+# read()
+# Returns the prepared queue of an item, or None if it has none that
+# is up to date. Only the first card is read, unless whole is true.
+def read(filepath, whole = False) :
+    try :
+        with open(sidecar_path(filepath), "rb") as file :
+            prepared = pickle.load(file)
+            if (not isinstance(prepared, Prepared) or
+                prepared.day != datetime.date.today().toordinal() or
+                prepared.stamp != cache.stamp(filepath)) :
+                return None
+            if (whole) :
+                prepared.cards += pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError) :
+        return None
+    return prepared
+
+# prepare()
+# Prepares the queue of a tree, as saved at filepath, and saves it in
+# the sidecar, unless the sidecar is up to date. The caller must hold
+# the item's lock, and the tree must have been saved (i.e. no save of
+# it may be pending in the background). As the sidecar is only an
+# aid, nothing is done if it cannot be written.
+def prepare(filepath, root) :
+    if (read(filepath) != None) :
+        return
+    queue = trainer.generate_queue(root)
+    problems = [node.parent for node in queue]
+    positions = cache.BoardCache(2 * len(problems) + 2)
+    positions.preload(problems)
+    cards = [Card(line_codes(node), positions.board(node.parent).fen(),
+                  node.training.status.value)
+             for node in queue]
+    info = stats.training_stats(root)
+    counts = (info[stats.STAT_NEW],
+              info[stats.STAT_FIRST_STEP] + info[stats.STAT_SECOND_STEP],
+              info[stats.STAT_DUE])
+    prepared = Prepared(datetime.date.today().toordinal(),
+                        cache.stamp(filepath), root.meta.colour, counts,
+                        cards[:1])
+    path = sidecar_path(filepath)
+    dirpath, name = os.path.split(path)
+    temporary = os.path.join(dirpath, f"{name}.{os.getpid()}.tmp")
+    try :
+        with open(temporary, "wb") as file :
+            pickle.dump(prepared, file)
+            pickle.dump(cards[1:], file)
+        os.replace(temporary, path)
+    except OSError :
+        pass
+
+# prepare_item()
+# Rolls over the item at filepath, if need be, and prepares its
+# queue, unless another process holds its lock. Used by the daily
+# rollover in place of tree.rollover_item(), whose results it
+# returns; an item with a prepared queue up to date is not loaded.
+def prepare_item(filepath) :
+    with locks.exclusive(filepath, 0) as acquired :
+        if (not acquired) :
+            return None
+        if (read(filepath) != None) :
+            return False
+        root = tree.load_raw(filepath)
+        rolled = tree.needs_rollover(root)
+        if (rolled) :
+            tree.rollover(root)
+            tree.save(filepath, root)
+        prepare(filepath, root)
+        return rolled
+
+# resolve()
+# Returns the training queue of a prepared queue (of its first card
+# only, unless it was read whole), as solutions of the tree it was
+# prepared from. The positions of the problems are put in the board
+# cache from the cards, so that no line is replayed.
+def resolve(root, prepared) :
+    queue = []
+    for card in prepared.cards :
+        node = root
+        for code in card.line :
+            for child in node.variations :
+                if (child.code == code) :
+                    node = child
+                    break
+        queue.append(node)
+    preloaded = cache.boards.capacity // 2
+    for node, card in zip(queue[:preloaded], prepared.cards) :
+        cache.boards.store(node.parent, chess.Board(card.fen))
+    return queue
+
+# line_codes()
+# Returns the move codes of the line from the root to a node.
+def line_codes(node) :
+    codes = array.array('H')
+    while (node.parent != None) :
+        codes.append(node.code)
+        node = node.parent
+    codes.reverse()
+    return codes
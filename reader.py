@@ -0,0 +1,399 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE reader.py
+
+# SYNOPSIS
+# Provides a streaming PGN reader that builds training trees
+# directly, without building python chess games.
+# Typically only the functions read_tree() and read_games() will
+# be imported.
+
+# The PGN is read line by line and split into tokens; comments,
+# NAGs, move numbers and escaped lines are discarded. Moves are
+# added to the tree as they are read, and validated against a
+# single board that is moved along the tree to the current line
+# whenever a move has to be parsed. Common moves are resolved
+# without generating legal moves (see resolve_san()), and parsed
+# moves are cached by node, so lines which revisit part of the tree
+# are neither parsed nor played on the board again.
+
+import re
+
+import chess
+import chess.polyglot
+
+import tree
+import instrument
+
+# Token kinds.
+HEADER = 0
+MOVE = 1
+OPEN = 2
+CLOSE = 3
+END = 4
+
+# A header line, e.g. [FEN "..."].
+HEADER_PATTERN = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+
+# Movetext tokens. A comment that is not closed on its line
+# continues on the following lines.
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>\{[^}]*\}?)
+  | (?P<line_comment>;.*)
+  | (?P<open>\()
+  | (?P<close>\))
+  | (?P<nag>\$\d+)
+  | (?P<result>1-0|0-1|1/2-1/2|\*)
+  | (?P<number>\d+\.+)
+  | (?P<move>[a-zA-Z][^\s(){};$]*|0-0(?:-0)?[+#]?)
+  | (?P<other>\S)
+""", re.VERBOSE)
+
+# tokens()
+# Generates the tokens of a PGN file as pairs (kind, value).
+# A HEADER has the value (tag, value); a MOVE has its SAN, without
+# annotation symbols; an END marks the end of each game.
+def tokens(file) :
+    in_comment = False
+    in_movetext = False
+    for line in file :
+        if (in_comment) :
+            end = line.find('}')
+            if (end < 0) :
+                continue
+            line = line[end + 1:]
+            in_comment = False
+        if (line.startswith('%')) :
+            continue
+        if (line.startswith('[')) :
+            match = HEADER_PATTERN.match(line)
+            if (match != None) :
+                if (in_movetext) :
+                    yield END, None
+                    in_movetext = False
+                yield HEADER, (match.group(1), match.group(2))
+                continue
+        for match in TOKEN_PATTERN.finditer(line) :
+            kind = match.lastgroup
+            if (kind == "move") :
+                in_movetext = True
+                yield MOVE, match.group().rstrip("!?")
+            elif (kind == "open") :
+                yield OPEN, None
+            elif (kind == "close") :
+                yield CLOSE, None
+            elif (kind == "result") :
+                yield END, None
+                in_movetext = False
+            elif (kind == "comment") :
+                if (not match.group().endswith('}')) :
+                    in_comment = True
+                    break
+            elif (kind == "line_comment") :
+                break
+            elif (kind == "other") :
+                raise ValueError("unexpected `" + match.group()
+                                 + "' in PGN")
+    if (in_movetext) :
+        yield END, None
+
+# SAN moves that can be resolved without generating legal moves.
+SAN_PATTERN = re.compile(r"^([NBRQ])?([a-h])?([1-8])?x?([a-h][1-8])[+#]?$")
+
+# Piece types by SAN letter.
+PIECE_TYPES = {"N" : chess.KNIGHT, "B" : chess.BISHOP,
+               "R" : chess.ROOK, "Q" : chess.QUEEN}
+
+# resolve_san()
+# Returns the legal move for a SAN in the given position.
+# Python chess generates legal moves to parse a SAN; this function
+# handles the common case of a single candidate piece, which is not
+# pinned, in a position that is not check, without doing so. Such a
+# move is legal exactly when its destination is not occupied by a
+# piece of the mover. Everything else (castling, king moves,
+# promotions, en passant, ambiguity, errors) is left to python chess.
+def resolve_san(board, san) :
+    match = SAN_PATTERN.match(san)
+    if (match == None or board.is_check()) :
+        return board.parse_san(san)
+    piece, file, rank, square = match.groups()
+    to_square = chess.SQUARE_NAMES.index(square)
+    to_mask = chess.BB_SQUARES[to_square]
+    turn = board.turn
+    if (piece != None) :
+        candidates = (board.attackers_mask(turn, to_square) &
+                      board.pieces_mask(PIECE_TYPES[piece], turn))
+        if (board.occupied_co[turn] & to_mask) :
+            return board.parse_san(san)
+    elif (chess.square_rank(to_square) in (0, 7)) :
+        return board.parse_san(san)
+    elif (file != None) :
+        if (not board.occupied_co[not turn] & to_mask) :
+            return board.parse_san(san)
+        candidates = (board.attackers_mask(turn, to_square) &
+                      board.pieces_mask(chess.PAWN, turn))
+    else :
+        candidates = pawn_push_origin(board, to_square)
+    if (file != None) :
+        candidates &= chess.BB_FILES[chess.FILE_NAMES.index(file)]
+    if (rank != None) :
+        candidates &= chess.BB_RANKS[int(rank) - 1]
+    if (chess.popcount(candidates) != 1) :
+        return board.parse_san(san)
+    from_square = chess.lsb(candidates)
+    if (board.is_pinned(turn, from_square)) :
+        return board.parse_san(san)
+    return chess.Move(from_square, to_square)
+
+# pawn_push_origin()
+# Returns the mask of the square from which a pawn of the side to
+# move can be pushed to the given empty square, or 0.
+def pawn_push_origin(board, to_square) :
+    if (board.occupied & chess.BB_SQUARES[to_square]) :
+        return 0
+    step = -8 if board.turn else 8
+    pawns = board.pieces_mask(chess.PAWN, board.turn)
+    origin = chess.BB_SQUARES[to_square + step]
+    if (pawns & origin) :
+        return origin
+    double_rank = 3 if board.turn else 4
+    if (chess.square_rank(to_square) == double_rank and
+        not board.occupied & origin) :
+        return pawns & chess.BB_SQUARES[to_square + 2 * step]
+    return 0
+
+# position_key()
+# Returns the part of a FEN that identifies the position, ignoring
+# the move counters.
+def position_key(fen) :
+    return " ".join(fen.split()[:4])
+
+# index_positions()
+# Adds the position of every node of a tree to positions, a
+# dictionary from Zobrist keys to a node at each position, with its
+# depth. The first node in preorder with variations is preferred, as
+# it holds the continuations of the position (see Builder).
+def index_positions(root, positions) :
+    board = root.board()
+    stack = [(root, 0)]
+    while (len(stack) != 0) :
+        node, depth = stack.pop()
+        while (len(board.move_stack) >= depth and depth > 0) :
+            board.pop()
+        if (depth > 0) :
+            board.push(tree.decode_move(node.code))
+        key = chess.polyglot.zobrist_hash(board)
+        known = positions.get(key)
+        if (known == None or
+            (len(known[0].variations) == 0 and
+             len(node.variations) != 0)) :
+            positions[key] = (node, depth)
+        stack += [(child, depth + 1) for child in reversed(node.variations)]
+
+# read_tree()
+# Reads the first game of a PGN file into a new tree, trained by
+# the given colour.
+def read_tree(file, colour) :
+    return read_games(file, colour, limit = 1)
+
+# read_games()
+# Reads the games of a PGN file into a tree, trained by the given
+# colour, merging lines that the games share. If root is None, a new
+# tree is created whose initial position is that of the first game.
+# Games starting from a different position than the tree are
+# skipped. At most limit games are read, if limit is given.
+# If positions is given, transpositions are unified (see Builder).
+# Returns the root.
+@instrument.timed("reader.read_games")
+def read_games(file, colour, root = None, limit = None,
+               positions = None) :
+    builder = Builder(root, colour, positions)
+    build(builder, file, limit)
+    return builder.root
+
+# build()
+# Reads the games of a PGN file with the given Builder, at most limit
+# games if limit is given.
+def build(builder, file, limit = None) :
+    for kind, value in tokens(file) :
+        if (kind == HEADER) :
+            builder.header(value)
+        elif (kind == MOVE) :
+            builder.move(value)
+        elif (kind == OPEN) :
+            builder.open()
+        elif (kind == CLOSE) :
+            builder.close()
+        elif (kind == END) :
+            builder.end()
+            if (builder.games == limit) :
+                break
+    if (builder.root == None) :
+        builder.start()
+
+# Builder
+# Holds the state of the tree under construction.
+# node is the last node of the current line and depth its distance
+# from the root; branches holds, for each open variation, the node
+# and depth to return to. The board is only brought up to date with
+# the current line when a move has to be parsed; board_node is the
+# node whose position it holds. before is the node and depth from
+# which the last move was played, to which a variation returns.
+
+# If positions is given, it maps the Zobrist key of each position in
+# the tree to the first node found at that position, with its depth
+# (see index_positions()); it is kept up to date as moves are added.
+# A line that transposes into a known position continues from that
+# node, so that the continuations of both lines are added, and
+# trained, there once. Likewise, a game starting from a position in
+# the tree is read from that position.
+class Builder :
+    def __init__(self, root, colour, positions = None) :
+        self.root = root
+        self.colour = colour
+        self.positions = positions
+        self.fen = chess.STARTING_FEN
+        self.node = None
+        self.depth = 0
+        self.before = None
+        self.branches = []
+        self.board = None
+        self.board_node = None
+        self.skip = False
+        self.games = 0
+        self.skipped = 0
+        self.moves = {}
+        self.data = tree.TrainingData()
+
+    # header()
+    # Handles a header of the next game.
+    def header(self, value) :
+        tag, text = value
+        if (tag == "FEN") :
+            self.fen = text
+
+    # start()
+    # Begins the movetext of a game.
+    def start(self) :
+        fen = chess.Board(self.fen).fen()
+        if (self.root == None) :
+            self.root = tree.Root(fen, tree.MetaData(self.colour))
+        self.node = self.root
+        self.depth = 0
+        self.skip = (position_key(fen) != position_key(self.root.fen))
+        if (self.skip and self.positions != None) :
+            key = chess.polyglot.zobrist_hash(chess.Board(fen))
+            if (key in self.positions) :
+                self.node, self.depth = self.positions[key]
+                self.skip = False
+        self.before = None
+        self.branches = []
+        if (self.board == None) :
+            self.board = self.root.board()
+            self.board_node = self.root
+
+    # move()
+    # Adds a move to the current line, unless it is already present.
+    def move(self, san) :
+        if (self.node == None) :
+            self.start()
+        if (self.skip) :
+            return
+        key = (self.node, san)
+        target = self.moves.get(key)
+        if (target == None) :
+            self.sync()
+            target = self.play(resolve_san(self.board, san), self.data)
+            self.moves[key] = target
+        self.before = (self.node, self.depth)
+        self.node, self.depth = target
+
+    # play()
+    # Adds a move at the current node, unless it is already present;
+    # a new solution is given a row holding data. The board must be
+    # up to date with the current line.
+    # Returns the node from which the line continues, and its depth.
+    def play(self, move, data) :
+        child = self.node.variation(move)
+        if (child == None) :
+            child = self.node.add_variation(move)
+            if (self.board.turn == self.colour) :
+                child.row = self.root.table.append(data)
+        target = (child, self.depth + 1)
+        if (self.positions != None) :
+            self.board.push(move)
+            self.board_node = child
+            key = chess.polyglot.zobrist_hash(self.board)
+            target = self.positions.setdefault(key, target)
+        return target
+
+    # sync()
+    # Brings the board up to date with the current line.
+    def sync(self) :
+        board = self.board
+        node = self.node
+        depth = self.depth
+        path = []
+        while (len(board.move_stack) > depth) :
+            board.pop()
+            self.board_node = self.board_node.parent
+        while (depth > len(board.move_stack)) :
+            path.append(node)
+            node = node.parent
+            depth -= 1
+        while (node is not self.board_node) :
+            path.append(node)
+            node = node.parent
+            board.pop()
+            self.board_node = self.board_node.parent
+        for node in reversed(path) :
+            board.push(tree.decode_move(node.code))
+        self.board_node = self.node
+
+    # open()
+    # Begins a variation: the last move is taken back.
+    def open(self) :
+        if (self.skip) :
+            return
+        if (self.before == None) :
+            raise ValueError("variation without a move in PGN")
+        self.branches.append((self.node, self.depth, self.before))
+        self.node, self.depth = self.before
+
+    # close()
+    # Ends a variation, returning to the line it branched from.
+    def close(self) :
+        if (self.skip) :
+            return
+        if (len(self.branches) == 0) :
+            raise ValueError("unmatched `)' in PGN")
+        self.node, self.depth, self.before = self.branches.pop()
+
+    # end()
+    # Ends a game.
+    def end(self) :
+        if (self.node == None) :
+            self.start()
+        self.games += 1
+        if (self.skip) :
+            self.skipped += 1
+        self.fen = chess.STARTING_FEN
+        self.node = None
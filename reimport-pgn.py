@@ -0,0 +1,62 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# reimport-pgn.py
+
+# SYNOPSIS
+# A script that updates an item to a new version of its PGN,
+# keeping the training progress of unchanged lines.
+# Usage:
+#
+#     python3 reimport-pgn.py <item> <pgn> [-t]
+#
+# With `-t', transpositions are unified as by merge-items.py; use it
+# for items that were merged.
+
+import sys
+
+import tree
+import merge
+import locks
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) not in (3, 4) or
+        (len(args) == 4 and args[3] != "-t")) :
+        print("usage: python3 reimport-pgn.py <item> <pgn> [-t]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    item = sys.argv[1]
+    if (not locks.acquire(item, True)) :
+        print(f"{item} is in use.")
+        quit()
+    root = tree.load(item)
+    with open(sys.argv[2]) as pgn :
+        added, removed = merge.reimport(root, pgn, len(sys.argv) == 4)
+    tree.save(item, root)
+    locks.release(item)
+    print(f"Added {added} and removed {removed} solutions.")
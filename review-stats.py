@@ -0,0 +1,106 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# review-stats.py
+
+# SYNOPSIS
+# A script that prints analyses of the review log of a library (see
+# analytics.py). Usage:
+#
+#     python3 review-stats.py [<library-dir>]
+#
+# The library defaults to `Collections'. Printed are the retention
+# by interval, the items with the highest lapse rates, and the number
+# of answers in each month.
+
+import os
+import sys
+
+import paths
+import reviews
+import analytics
+
+# Number of items listed by lapse rate.
+ITEMS_LISTED = 20
+
+# print_retention()
+# Prints the retention by interval.
+def print_retention(analysis) :
+    print("RETENTION")
+    print("interval".ljust(16) + "reviews".rjust(10) + "recalled".rjust(10))
+    for bound, count, recalled in analysis.retention_curve() :
+        print(f"< {bound} days".ljust(16) + str(count).rjust(10)
+              + f"{100 * recalled:9.1f}%")
+    print("")
+
+# print_lapse_rates()
+# Prints the items with the highest lapse rates.
+def print_lapse_rates(analysis, library) :
+    names = {reviews.item_id(filepath) : filepath[len(library) + 1:]
+             for filepath in paths.item_paths(library)}
+    rates = sorted(analysis.lapse_rates().items(),
+                   key = lambda pair : -pair[1][1])
+    print("LAPSE RATES")
+    print("item".ljust(48) + "reviews".rjust(10) + "lapsed".rjust(10))
+    for item, (count, rate) in rates[:ITEMS_LISTED] :
+        name = names.get(item, f"(removed item {item:08x})")
+        print(name[:47].ljust(48) + str(count).rjust(10)
+              + f"{100 * rate:9.1f}%")
+    print("")
+
+# print_workload()
+# Prints the number of answers in each month.
+def print_workload(analysis) :
+    months = {}
+    for date, new, learning, review in analysis.workload() :
+        totals = months.setdefault(date.strftime("%Y-%m"), [0, 0, 0])
+        totals[0] += new
+        totals[1] += learning
+        totals[2] += review
+    print("WORKLOAD")
+    print("month".ljust(16) + "new".rjust(10) + "learning".rjust(10)
+          + "review".rjust(10))
+    for month, (new, learning, review) in months.items() :
+        print(month.ljust(16) + str(new).rjust(10)
+              + str(learning).rjust(10) + str(review).rjust(10))
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) > 2) :
+        print("usage: python3 review-stats.py [<library-dir>]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    library = sys.argv[1].rstrip('/') if len(sys.argv) > 1 else "Collections"
+    path = os.path.join(library, reviews.REVIEW_LOG)
+    if (not os.path.exists(path)) :
+        print("No reviews have been recorded.")
+        quit()
+    analysis = analytics.analyse(path)
+    print(f"{analysis.records} answers recorded.\n")
+    print_retention(analysis)
+    print_lapse_rates(analysis, library)
+    print_workload(analysis)
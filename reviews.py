@@ -0,0 +1,127 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE reviews.py
+
+# SYNOPSIS
+# Provides the review log: an append-only record of every answer
+# given in training, kept in the file REVIEW_LOG at the top of the
+# library. The log is read by analytics.py.
+
+# Each answer is a fixed size binary RECORD (little-endian):
+#
+#     item      a 32 bit id of the item (see item_id())
+#     solution  a 32 bit id of the solution (see solution_id())
+#     day       the day of the answer, as a date ordinal
+#     result    the trainer.Result of the answer
+#     status    the tree.Status of the solution when answered
+#     interval  the days since the solution was last reviewed, for
+#               solutions in REVIEW; otherwise zero
+#
+# Ids are hashes, so that they survive the renumbering of rows of
+# training tables: an item is identified by its path in the library,
+# and a solution by its line of moves from the root.
+# Records are appended with a single write to a file opened for
+# appending, so several processes may log to the same library. The
+# log is only a record; if it cannot be written, training goes on.
+
+import os
+import zlib
+import struct
+import datetime
+
+import tree
+import paths
+
+# Name of the review log, at the top of the library.
+REVIEW_LOG = ".reviews"
+
+# A record of the log.
+RECORD = struct.Struct("<IIIBBH")
+
+# Largest interval recorded, in days.
+MAX_INTERVAL = 0xffff
+
+# Number of records read at a time.
+BLOCK_RECORDS = 1 << 16
+
+# Log files open for appending, by path.
+logs = {}
+
+# log_path()
+# Returns the path of the review log of the library of an item.
+def log_path(filepath) :
+    library = paths.library_path(filepath)
+    return os.path.join(library, REVIEW_LOG)
+
+# item_id()
+# Returns the id of an item: a hash of its path in the library.
+def item_id(filepath) :
+    library = paths.library_path(filepath)
+    return zlib.crc32(os.path.relpath(filepath, library).encode())
+
+# solution_id()
+# Returns the id of a solution: a hash of its line of move codes.
+def solution_id(solution) :
+    codes = []
+    node = solution
+    while (node.parent != None) :
+        codes.append(node.code)
+        node = node.parent
+    return zlib.crc32(struct.pack(f"<{len(codes)}H", *reversed(codes)))
+
+# record()
+# Appends the answer to a solution of the item at filepath to the
+# review log. Must be called before the result is handled, i.e.
+# while the solution still has the status and dates it was answered
+# with.
+def record(filepath, solution, result) :
+    training = solution.training
+    status = training.status
+    today = datetime.date.today()
+    interval = 0
+    if (status == tree.Status.REVIEW) :
+        interval = (today - training.previous_due).days
+        interval = min(max(interval, 0), MAX_INTERVAL)
+    data = RECORD.pack(item_id(filepath), solution_id(solution),
+                       today.toordinal(), result.value, status.value,
+                       interval)
+    path = log_path(filepath)
+    try :
+        log = logs.get(path)
+        if (log == None) :
+            log = open(path, "ab", buffering = 0)
+            logs[path] = log
+        log.write(data)
+    except OSError :
+        pass
+
+# read_blocks()
+# Generates the records of a log in blocks of whole records, as
+# bytes, reading at most block_records records at a time. A partial
+# record at the end of the log is ignored.
+def read_blocks(path, block_records = BLOCK_RECORDS) :
+    with open(path, "rb") as log :
+        while (True) :
+            block = log.read(block_records * RECORD.size)
+            block = block[:len(block) - len(block) % RECORD.size]
+            if (len(block) == 0) :
+                break
+            yield block
@@ -0,0 +1,82 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# rollover.py
+
+# SYNOPSIS
+# A script that performs the daily rollover for every item in a
+# library, so that the interactive interface never has to.
+# Usage:
+#
+#     python3 rollover.py [<library-dir>]
+#
+# The library defaults to `Collections'. Items are processed in
+# parallel, and on success the rollover is recorded in the library
+# (see tree.ROLLOVER_STAMP). The training queue of each item is
+# prepared at the same time, so that sessions start at once (see
+# queues.py). Intended to be run shortly after midnight, e.g. from
+# cron:
+#
+#     5 0 * * * cd /path/to/Chessic && python3 rollover.py
+
+import sys
+import concurrent.futures
+
+import tree
+import paths
+import queues
+
+# rollover_library()
+# Rolls over every item in the library in parallel, preparing its
+# queue, and records the rollover. Items locked by another process
+# are left to roll over when next loaded, and the rollover is then
+# not recorded.
+# Returns the numbers of items rolled over and left.
+def rollover_library(library) :
+    filepaths = paths.item_paths(library)
+    with concurrent.futures.ProcessPoolExecutor() as executor :
+        results = list(executor.map(queues.prepare_item, filepaths,
+                                    chunksize = 16))
+    left = results.count(None)
+    if (left == 0) :
+        tree.record_rollover(library)
+    return results.count(True), left
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) > 2) :
+        print("usage: python3 rollover.py [<library-dir>]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    if (len(sys.argv) == 2) :
+        library = sys.argv[1].rstrip('/')
+    else :
+        library = "Collections"
+    count, left = rollover_library(library)
+    print(f"Rolled over {count} items.")
+    if (left != 0) :
+        print(f"{left} items are in use and were left.")
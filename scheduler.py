@@ -0,0 +1,143 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE scheduler.py
+
+# SYNOPSIS
+# Provides capacity-aware scheduling, which spreads the reviews of
+# the whole library evenly over the days. It is enabled by the
+# environment variable CHESSIC_CAPACITY, the number of reviews per
+# day the user is willing to do:
+#
+#     CHESSIC_CAPACITY=150 python3 chessic.py
+#
+# Otherwise due dates are chosen at random, as they always were
+# (see trainer.new_due_date()).
+
+# A solution recalled in review may be given any wait in a window
+# determined by its previous gap (see trainer.new_due_date()). With
+# a capacity, the scheduler holds a histogram of the due dates of
+# all solutions in review in the library, and chooses the wait as
+# follows: days of the window already at capacity are avoided, if
+# possible; of the rest, the least loaded (within TOLERANCE
+# solutions) are found, and the one nearest a target drawn at random
+# from the window, as before, is chosen. Reviews thus fill the
+# valleys between busy days rather than piling onto them, while
+# waits keep the spread of random scheduling where the load allows.
+# The histogram is built once a day per library and kept up to date
+# with every date scheduled. The scheduler in use is set by use()
+# before each answer is handled, so that it is always that of the
+# item's library, built today.
+
+import os
+import random
+import datetime
+
+import tree
+import paths
+
+# Reviews per day, or None if capacity-aware scheduling is disabled.
+CAPACITY = int(os.environ.get("CHESSIC_CAPACITY") or 0) or None
+
+# Difference in load, in solutions, within which days are considered
+# equally loaded.
+TOLERANCE = 2
+
+# The scheduler in use, if any (see use()).
+current = None
+
+# Schedulers by library.
+schedulers = {}
+
+# A capacity-aware scheduler.
+# histogram maps date ordinals to the number of solutions due then;
+# day is the date ordinal on which it was built.
+class Scheduler :
+    def __init__(self, capacity, histogram = None, rng = random) :
+        self.capacity = capacity
+        self.histogram = histogram if histogram != None else {}
+        self.rng = rng
+        self.day = datetime.date.today().toordinal()
+
+    # choose()
+    # Returns a wait, in days, between low and high inclusive, for a
+    # solution recalled today.
+    def choose(self, today, low, high) :
+        start = today.toordinal()
+        loads = [(self.histogram.get(start + wait, 0), wait)
+                 for wait in range(low, high + 1)]
+        below = [pair for pair in loads if pair[0] < self.capacity]
+        if (len(below) != 0) :
+            loads = below
+        least = min(loads)[0]
+        target = self.rng.randint(low, high)
+        return min((abs(wait - target), wait) for load, wait in loads
+                   if load <= least + TOLERANCE)[1]
+
+    # add()
+    # Records a solution scheduled for the given date.
+    def add(self, due) :
+        day = due.toordinal()
+        self.histogram[day] = self.histogram.get(day, 0) + 1
+
+# use()
+# Sets the scheduler in use to that of the library of an item, if a
+# capacity is configured; otherwise none is used.
+def use(filepath) :
+    global current
+    current = None
+    if (CAPACITY != None) :
+        current = library_scheduler(paths.library_path(filepath))
+
+# library_scheduler()
+# Returns the scheduler of a library, building its histogram if it
+# has not been built today.
+def library_scheduler(library) :
+    scheduler = schedulers.get(library)
+    today = datetime.date.today().toordinal()
+    if (scheduler == None or scheduler.day != today) :
+        scheduler = Scheduler(CAPACITY, library_histogram(library))
+        schedulers[library] = scheduler
+    return scheduler
+
+# library_histogram()
+# Returns the histogram of the due dates of the solutions in review
+# in a library, from today on. Items are mapped into memory where
+# possible, so that only their training tables are read.
+def library_histogram(library) :
+    histogram = {}
+    for filepath in paths.item_paths(library) :
+        item = tree.load_mapped(filepath)
+        if (item == None) :
+            add_table(histogram, tree.load_flat(filepath).table)
+            continue
+        with item :
+            add_table(histogram, item.table)
+    return histogram
+
+# add_table()
+# Adds the due dates, from today on, of the solutions in review in a
+# training table to a histogram.
+def add_table(histogram, table) :
+    today = datetime.date.today().toordinal()
+    review = tree.Status.REVIEW.value
+    for status, due in zip(table.status, table.due) :
+        if (status == review and due >= today) :
+            histogram[due] = histogram.get(due, 0) + 1
@@ -0,0 +1,474 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE server.py
+
+# SYNOPSIS
+# A local HTTP/JSON training service, for browsers and other
+# clients. Usage:
+#
+#     python3 server.py [<library-dir>] [<port>]
+#
+# The library defaults to `Collections' and the port to 8642. The
+# server listens on localhost only. Endpoints:
+#
+#     GET  /library                  items, with compact statistics
+#     GET  /queue?item=<i>[&limit=n] the training queue of an item
+#     POST /answer                   {"item": <i>, "card": <id>,
+#                                     "result": "easy"|"okay"|"hard"}
+#     GET  /board?fen=<f>[&flip=1]   a position, as FEN and SVG
+#     GET  /board?item=<i>&card=<id> the problem of a card
+#
+# Items are named by their path in the library, e.g.
+# `Collection/Category/Item.rpt', and cards by the row of their
+# solution in the training table.
+
+# Training follows the trainer exactly: an item's session holds its
+# tree and queue (see trainer.generate_queue()), and answers are
+# handled by trainer.handle_result(). A session holds the item's lock
+# (see locks.py) while it is open. Once saved, a session is closed,
+# and the lock released, when it has been idle for SESSION_TIMEOUT
+# seconds, or when its tree needs to be rolled over (i.e. after
+# midnight); the next request opens it afresh, with a new queue.
+# Answers only mark a session dirty; dirty items are saved together
+# every FLUSH_INTERVAL seconds, so that an item is written at most
+# once per interval however many answers it receives. The tree is
+# pickled in the event loop, so that it is never pickled while an
+# answer modifies it, and written to disk in a worker thread.
+
+import os
+import sys
+import json
+import time
+import asyncio
+import urllib.parse
+import concurrent.futures
+
+import chess
+import chess.svg
+
+import tree
+import stats
+import paths
+import locks
+import cache
+import trainer
+import reviews
+import sync
+import scheduler
+
+# Default port.
+PORT = 8642
+
+# Interval between saves of dirty items, in seconds.
+FLUSH_INTERVAL = 1.0
+
+# Time after which an idle session is closed, in seconds.
+SESSION_TIMEOUT = 300.0
+
+# Maximum size of a request body, in bytes.
+MAX_BODY = 1 << 16
+
+# Training results by name.
+RESULTS = {"easy" : trainer.Result.EASY,
+           "okay" : trainer.Result.OKAY,
+           "hard" : trainer.Result.HARD}
+
+# Reasons of HTTP statuses.
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found",
+           405 : "Method Not Allowed", 409 : "Conflict",
+           500 : "Internal Server Error"}
+
+# An error to be reported to the client with an HTTP status.
+class RequestError(Exception) :
+    def __init__(self, status, message) :
+        Exception.__init__(self, message)
+        self.status = status
+
+# The training session of an item.
+# cards maps the row of each solution in the queue to its node;
+# dirty records that the tree has changed since it was last saved;
+# used is the time of its last request, as by time.monotonic().
+class Session :
+    def __init__(self, filepath) :
+        self.filepath = filepath
+        self.root = tree.load(filepath)
+        scheduler.use(filepath)
+        self.queue = trainer.generate_queue(self.root)
+        trainer.preload_queue(self.queue)
+        self.cards = {node.row : node for node in self.queue}
+        self.dirty = False
+        self.saving = False
+        self.used = time.monotonic()
+
+    # answer()
+    # Handles the result of a card in the queue, as the trainer does,
+    # and records it in the review log and the journal. The scheduler
+    # of the item's library is set for each answer, since the server
+    # serves items of any library, and on any day.
+    def answer(self, row, result) :
+        node = self.cards.get(row)
+        if (node == None or node not in self.queue) :
+            raise RequestError(404, "card is not in the queue")
+        self.queue.remove(node)
+        reviews.record(self.filepath, node, result)
+        scheduler.use(self.filepath)
+        trainer.handle_result(result, node, self.queue)
+        sync.record(self.filepath, node)
+        self.dirty = True
+        return node
+
+# The server state: the library and the sessions of its items, by
+# filepath.
+class Server :
+    def __init__(self, library) :
+        self.library = os.path.normpath(library)
+        self.sessions = {}
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.writes = set()
+
+    # session()
+    # Returns the session of an item, opening it if need be.
+    def session(self, item) :
+        filepath = self.filepath(item)
+        session = self.sessions.get(filepath)
+        if (session == None) :
+            if (not locks.acquire(filepath, True, 0)) :
+                raise RequestError(409, "item is in use elsewhere")
+            try :
+                session = Session(filepath)
+            except Exception :
+                locks.release(filepath)
+                raise
+            self.sessions[filepath] = session
+        session.used = time.monotonic()
+        return session
+
+    # expire()
+    # Closes the saved sessions that have been idle for SESSION_TIMEOUT
+    # seconds, or whose trees need to be rolled over, releasing their
+    # locks.
+    def expire(self) :
+        now = time.monotonic()
+        for filepath, session in list(self.sessions.items()) :
+            if (session.dirty or session.saving) :
+                continue
+            if (now - session.used >= SESSION_TIMEOUT or
+                tree.needs_rollover(session.root)) :
+                del self.sessions[filepath]
+                locks.release(filepath)
+
+    # filepath()
+    # Returns the filepath of an item named by its path in the
+    # library, which must not leave the library.
+    def filepath(self, item) :
+        if (item == None) :
+            raise RequestError(400, "no item given")
+        filepath = os.path.normpath(os.path.join(self.library, item))
+        if (not filepath.startswith(self.library + os.sep) or
+            filepath.count(os.sep) != self.library.count(os.sep) + 3 or
+            not os.path.isfile(filepath)) :
+            raise RequestError(404, "no such item")
+        return filepath
+
+    # library_view()
+    # Returns the items of the library with compact statistics.
+    def library_view(self) :
+        items = []
+        for filepath in paths.item_paths(self.library) :
+            waiting, learned, size = stats.item_stats(filepath)
+            item = filepath[len(self.library) + 1:]
+            collection, category, name = item.split('/')
+            items.append({"item" : item,
+                          "collection" : collection,
+                          "category" : category,
+                          "name" : name[:-4],
+                          "waiting" : waiting,
+                          "learned" : learned,
+                          "size" : size})
+        return {"items" : items}
+
+    # queue_view()
+    # Returns the queue of an item, or its first limit cards.
+    def queue_view(self, item, limit) :
+        session = self.session(item)
+        queue = session.queue
+        if (limit != None) :
+            queue = queue[:limit]
+        return {"item" : item,
+                "remaining" : len(session.queue),
+                "cards" : [card_view(node) for node in queue]}
+
+    # answer()
+    # Handles an answer; returns the new state of the card.
+    def answer(self, body) :
+        try :
+            request = json.loads(body)
+            item = request["item"]
+            row = int(request["card"])
+            result = RESULTS[request["result"]]
+        except (ValueError, KeyError, TypeError) :
+            raise RequestError(400, "expected item, card and result")
+        session = self.session(item)
+        node = session.answer(row, result)
+        training = node.training
+        return {"card" : row,
+                "status" : training.status.name,
+                "due" : training.due.isoformat(),
+                "requeued" : node in session.queue,
+                "remaining" : len(session.queue)}
+
+    # board_view()
+    # Returns a position given by FEN, or the problem of a card.
+    def board_view(self, query) :
+        flip = (query.get("flip") == "1")
+        lastmove = None
+        if ("fen" in query) :
+            try :
+                board = chess.Board(query["fen"])
+            except ValueError :
+                raise RequestError(400, "invalid FEN")
+        else :
+            session = self.session(query.get("item"))
+            try :
+                node = session.cards[int(query.get("card"))]
+            except (ValueError, TypeError, KeyError) :
+                raise RequestError(404, "no such card")
+            board = cache.boards.board(node.parent)
+            flip = not session.root.meta.colour
+            if (board.move_stack) :
+                lastmove = board.peek()
+        svg = chess.svg.board(board, flipped = flip, lastmove = lastmove)
+        return {"fen" : board.fen(), "svg" : svg}
+
+    # route()
+    # Handles a request; returns the response as a dictionary.
+    def route(self, method, target, body) :
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if (url.path == "/answer") :
+            if (method != "POST") :
+                raise RequestError(405, "use POST")
+            return self.answer(body)
+        if (method != "GET") :
+            raise RequestError(405, "use GET")
+        if (url.path == "/library") :
+            return self.library_view()
+        if (url.path == "/queue") :
+            limit = query.get("limit")
+            if (limit != None) :
+                limit = int(limit) if limit.isdigit() else None
+            return self.queue_view(query.get("item"), limit)
+        if (url.path == "/board") :
+            return self.board_view(query)
+        raise RequestError(404, "no such endpoint")
+
+    # flush()
+    # Saves every dirty item: each tree is pickled here, and written
+    # in the writer thread. An item that cannot be saved is reported,
+    # and stays dirty, so that it is saved again at the next flush.
+    async def flush(self) :
+        writes = []
+        for session in self.sessions.values() :
+            if (session.dirty and not session.saving) :
+                try :
+                    data = tree.dumps(session.filepath, session.root)
+                except Exception as error :
+                    report_error(session.filepath, error)
+                    continue
+                session.dirty = False
+                session.saving = True
+                write = self.executor.submit(tree.write,
+                                             session.filepath, data)
+                self.writes.add(write)
+                writes.append((session, write))
+        for session, write in writes :
+            try :
+                await asyncio.wrap_future(write)
+                cache.items.store(session.filepath, session.root)
+            except Exception as error :
+                session.dirty = True
+                report_error(session.filepath, error)
+            finally :
+                self.writes.discard(write)
+                session.saving = False
+
+    # flush_periodically()
+    # Flushes dirty items every FLUSH_INTERVAL seconds, then closes
+    # the sessions expired. An error is reported, and does not stop
+    # later flushes.
+    async def flush_periodically(self) :
+        while (True) :
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try :
+                await self.flush()
+                self.expire()
+            except Exception as error :
+                report_error(self.library, error)
+
+    # close()
+    # Waits for writes in progress, saves every dirty item (and every
+    # item whose write was in progress, in case it failed) and
+    # releases the locks of all items.
+    def close(self) :
+        for write in list(self.writes) :
+            try :
+                write.result()
+            except Exception :
+                pass
+        self.executor.shutdown()
+        for session in self.sessions.values() :
+            try :
+                if (session.dirty or session.saving) :
+                    tree.save(session.filepath, session.root)
+                    session.dirty = False
+            except Exception as error :
+                report_error(session.filepath, error)
+            finally :
+                locks.release(session.filepath)
+        self.sessions = {}
+
+    # handle()
+    # Serves the requests of a connection, which is kept alive until
+    # the client closes it or asks to close it. A request that cannot
+    # be read is answered, and the connection closed; an unexpected
+    # error in handling a request is reported with status 500.
+    async def handle(self, reader, writer) :
+        try :
+            while (True) :
+                try :
+                    request = await read_request(reader)
+                except RequestError as error :
+                    write_response(writer, error.status,
+                                   {"error" : str(error)})
+                    await writer.drain()
+                    break
+                if (request == None) :
+                    break
+                method, target, headers, body = request
+                try :
+                    status, response = 200, self.route(method, target,
+                                                        body)
+                except RequestError as error :
+                    status, response = error.status, {"error" : str(error)}
+                except Exception as error :
+                    status = 500
+                    response = {"error" : f"{type(error).__name__}: {error}"}
+                write_response(writer, status, response)
+                await writer.drain()
+                if (headers.get("connection") == "close") :
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) :
+            pass
+        finally :
+            writer.close()
+
+# report_error()
+# Reports an error in saving an item, or in the server's upkeep, on
+# standard error.
+def report_error(path, error) :
+    print(f"{path}: {type(error).__name__}: {error}", file = sys.stderr)
+
+# card_view()
+# Returns a card of the queue: the problem position, and the
+# solution move and status.
+def card_view(node) :
+    board = cache.boards.board(node.parent)
+    move = node.move
+    return {"card" : node.row,
+            "problem" : board.fen(),
+            "solution" : move.uci(),
+            "san" : board.san(move),
+            "status" : node.training.status.name}
+
+# read_request()
+# Reads an HTTP request; returns the method, target, headers (with
+# lower case names) and body, or None at the end of the connection.
+async def read_request(reader) :
+    line = await reader.readline()
+    if (len(line) == 0) :
+        return None
+    parts = line.decode("latin-1").split()
+    if (len(parts) != 3) :
+        raise ConnectionError("malformed request line")
+    method, target, version = parts
+    headers = {}
+    while (True) :
+        line = await reader.readline()
+        if (line in (b"\r\n", b"\n", b"")) :
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+    length = headers.get("content-length", "0")
+    if (not length.isdigit()) :
+        raise RequestError(400, "invalid content-length")
+    length = int(length)
+    if (length > MAX_BODY) :
+        raise ConnectionError("request body too large")
+    body = await reader.readexactly(length)
+    return method, target, headers, body
+
+# write_response()
+# Writes an HTTP response with a JSON body.
+def write_response(writer, status, response) :
+    body = json.dumps(response).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n")
+    writer.write(head.encode() + body)
+
+# serve()
+# Runs the server until it is cancelled; saves and unlocks items on
+# the way out. If started is given, it is called with the port once
+# the server is listening.
+async def serve(library, port = PORT, started = None) :
+    state = Server(library)
+    server = await asyncio.start_server(state.handle, "127.0.0.1", port)
+    flusher = asyncio.ensure_future(state.flush_periodically())
+    try :
+        if (started != None) :
+            started(server.sockets[0].getsockname()[1])
+        async with server :
+            await server.serve_forever()
+    finally :
+        flusher.cancel()
+        state.close()
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) > 3 or (len(args) == 3 and not args[2].isdigit())) :
+        print("usage: python3 server.py [<library-dir>] [<port>]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    library = sys.argv[1].rstrip('/') if len(sys.argv) > 1 else "Collections"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    print(f"Serving {library} on http://127.0.0.1:{port}/")
+    try :
+        asyncio.run(serve(library, port))
+    except KeyboardInterrupt :
+        pass
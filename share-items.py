@@ -0,0 +1,59 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# share-items.py
+
+# SYNOPSIS
+# A script that makes the items of a collection share the storage of
+# identical subtrees, in a subtree store (see store.py). Usage:
+#
+#     python3 share-items.py <collection-dir>
+#
+# The store is created if need be and every item is saved through
+# it; from then on, the items of the collection are always saved
+# through the store. Running the script again removes chunks of the
+# store that are no longer used.
+
+import os
+import sys
+
+import store
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) != 2 or not os.path.isdir(args[1])) :
+        print("usage: python3 share-items.py <collection-dir>")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    collection = sys.argv[1].rstrip('/')
+    saved = store.create(collection)
+    removed = store.collect(collection)
+    print(f"Saved {saved} items through the store.")
+    if (removed == None) :
+        print("Some items are in use; unused chunks were kept.")
+    else :
+        print(f"Removed {removed} unused chunks.")
@@ -0,0 +1,87 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# snapshot-library.py
+
+# SYNOPSIS
+# A script that takes, lists and restores snapshots of a library
+# (see snapshots.py). Usage:
+#
+#     python3 snapshot-library.py create [<library-dir>]
+#     python3 snapshot-library.py list [<library-dir>]
+#     python3 snapshot-library.py restore <snapshot> [<library-dir>]
+#                                         [<asset>]
+#
+# The library defaults to `Collections'. Creating a snapshot also
+# prunes old snapshots by the retention policy. A snapshot is
+# restored in full, or only under an asset (a collection, category
+# or item) given by its path in the library, e.g.
+# `English/Openings/Sicilian.rpt'. Intended to be run daily, e.g.
+# from cron after the rollover:
+#
+#     10 0 * * * cd /path/to/Chessic && python3 snapshot-library.py create
+
+import sys
+
+import snapshots
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    command = args[1] if len(args) > 1 else None
+    if (not ((command in ("create", "list") and len(args) in (2, 3)) or
+             (command == "restore" and len(args) in (3, 4, 5)))) :
+        print("usage: python3 snapshot-library.py create [<library-dir>]")
+        print("       python3 snapshot-library.py list [<library-dir>]")
+        print("       python3 snapshot-library.py restore <snapshot> "
+              "[<library-dir>] [<asset>]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    command = sys.argv[1]
+    arguments = sys.argv[3:] if command == "restore" else sys.argv[2:]
+    if (len(arguments) != 0) :
+        library = arguments[0].rstrip('/')
+    else :
+        library = "Collections"
+    if (command == "create") :
+        files, changed = snapshots.create(library)
+        removed, unused = snapshots.prune(library)
+        print(f"Took a snapshot of {files} files, {changed} changed.")
+        if (removed != 0) :
+            print(f"Removed {removed} old snapshots.")
+    elif (command == "list") :
+        for name in snapshots.snapshot_names(library) :
+            print(name)
+    else :
+        name = sys.argv[2]
+        if (name not in snapshots.snapshot_names(library)) :
+            print(f"There is no snapshot `{name}'.")
+            quit()
+        asset = arguments[1] if len(arguments) > 1 else ""
+        restored, left = snapshots.restore(library, name, asset)
+        print(f"Restored {restored} items.")
+        if (left != 0) :
+            print(f"{left} items are in use and were left.")
@@ -0,0 +1,243 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE snapshots.py
+
+# SYNOPSIS
+# Provides incremental snapshots of a library, from which deleted or
+# damaged items can be restored. Typically only the functions
+# create(), prune() and restore() will be used, through the script
+# snapshot-library.py.
+
+# Snapshots are kept in the directory SNAPSHOT_DIR at the top of the
+# library. A snapshot is a manifest, named by the day it was taken,
+# mapping the path of every item (and subtree store chunk; see
+# store.py) in the library to an object: a file in OBJECT_DIR named
+# by the SHA-1 hash of its contents, so each version of an item is
+# kept once, however many snapshots hold it. An object is a hard
+# link to the file it was taken from, where the file system allows,
+# so nothing is copied: items are never modified in place (see
+# locks.py), so the linked file never changes. The manifest also
+# records the inode, modification time and size of each file; a file
+# whose inode, modification time and size are those of the last
+# snapshot is taken to be unchanged, and is neither read nor linked
+# again. So a snapshot costs a stat of each file, and the rest only
+# for the files changed.
+# A second snapshot on the same day replaces the first.
+# Snapshots are pruned by a retention policy: the latest snapshot of
+# each of the last DAILY days, WEEKLY weeks and MONTHLY months with
+# snapshots are kept. Objects in no manifest kept are removed.
+
+import os
+import json
+import shutil
+import hashlib
+import datetime
+
+import tree
+import paths
+import locks
+import store
+
+# Name of the snapshot directory, at the top of the library.
+SNAPSHOT_DIR = ".snapshots"
+
+# Name of the object directory, in the snapshot directory.
+OBJECT_DIR = "objects"
+
+# Numbers of daily, weekly and monthly snapshots kept.
+DAILY = 14
+WEEKLY = 8
+MONTHLY = 12
+
+# snapshot_dir()
+# Returns the path of the snapshot directory of a library.
+def snapshot_dir(library) :
+    return os.path.join(library, SNAPSHOT_DIR)
+
+# manifest_path()
+# Returns the path of the manifest of a snapshot.
+def manifest_path(library, name) :
+    return os.path.join(snapshot_dir(library), name + ".json")
+
+# snapshot_names()
+# Returns the names of the snapshots of a library, oldest first.
+def snapshot_names(library) :
+    dirpath = snapshot_dir(library)
+    if (not os.path.isdir(dirpath)) :
+        return []
+    return sorted(name[:-len(".json")] for name in os.listdir(dirpath)
+                  if name.endswith(".json"))
+
+# read_manifest()
+# Returns the manifest of a snapshot: a dictionary of lists [object,
+# inode, modification time, size] by path, relative to the library.
+def read_manifest(library, name) :
+    with open(manifest_path(library, name)) as file :
+        return json.load(file)
+
+# library_files()
+# Returns the paths, relative to the library, of the files kept in
+# snapshots: the items and the chunks of the subtree stores.
+def library_files(library) :
+    files = [os.path.relpath(filepath, library)
+             for filepath in paths.item_paths(library)]
+    for collection in paths.listdir(library) :
+        chunks = os.path.join(library, collection, store.STORE_DIR)
+        if (os.path.isdir(chunks)) :
+            files += [os.path.join(collection, store.STORE_DIR, name)
+                      for name in os.listdir(chunks)
+                      if not name.startswith('.')]
+    return files
+
+# create()
+# Takes a snapshot of a library, named by today's date. Returns the
+# numbers of files in the snapshot and of files changed since the
+# last snapshot.
+def create(library) :
+    objects = os.path.join(snapshot_dir(library), OBJECT_DIR)
+    os.makedirs(objects, exist_ok = True)
+    names = snapshot_names(library)
+    previous = read_manifest(library, names[-1]) if names else {}
+    manifest = {}
+    changed = 0
+    for relpath in library_files(library) :
+        filepath = os.path.join(library, relpath)
+        try :
+            status = os.stat(filepath)
+        except FileNotFoundError :
+            continue
+        entry = previous.get(relpath)
+        if (entry != None and entry[1:] == [status.st_ino,
+                                            status.st_mtime_ns,
+                                            status.st_size]) :
+            manifest[relpath] = entry
+            continue
+        entry = add_object(objects, filepath)
+        if (entry != None) :
+            manifest[relpath] = entry
+            changed += 1
+    name = datetime.date.today().isoformat()
+    temporary = manifest_path(library, f".{name}.{os.getpid()}.tmp")
+    with open(temporary, "w") as file :
+        json.dump(manifest, file)
+    os.replace(temporary, manifest_path(library, name))
+    return len(manifest), changed
+
+# add_object()
+# Adds the file at filepath to the objects, unless its contents are
+# there already. The file is linked (or copied) first, and the link
+# hashed, so that a save replacing the file meanwhile cannot make
+# the object differ from its name. Returns the manifest entry of the
+# file, or None if it has gone.
+def add_object(objects, filepath) :
+    temporary = os.path.join(objects, f".{os.getpid()}.tmp")
+    if (os.path.exists(temporary)) :
+        os.remove(temporary)
+    try :
+        try :
+            os.link(filepath, temporary)
+        except FileNotFoundError :
+            return None
+        except OSError :
+            shutil.copy2(filepath, temporary)
+    except FileNotFoundError :
+        return None
+    status = os.stat(temporary)
+    digest = hashlib.sha1()
+    with open(temporary, "rb") as file :
+        for block in iter(lambda : file.read(1 << 20), b"") :
+            digest.update(block)
+    name = digest.hexdigest()
+    if (os.path.exists(os.path.join(objects, name))) :
+        os.remove(temporary)
+    else :
+        os.replace(temporary, os.path.join(objects, name))
+    return [name, status.st_ino, status.st_mtime_ns, status.st_size]
+
+# retained()
+# Returns the names of the snapshots kept by the retention policy.
+def retained(names, daily = DAILY, weekly = WEEKLY, monthly = MONTHLY) :
+    kept = set()
+    for count, period in ((daily, lambda day : day),
+                          (weekly, lambda day : day.isocalendar()[:2]),
+                          (monthly, lambda day : (day.year, day.month))) :
+        periods = set()
+        for name in reversed(names) :
+            key = period(datetime.date.fromisoformat(name))
+            if (key not in periods and len(periods) < count) :
+                periods.add(key)
+                kept.add(name)
+    return kept
+
+# prune()
+# Removes the snapshots not kept by the retention policy, and the
+# objects of no snapshot kept. Returns the numbers of snapshots and
+# objects removed.
+def prune(library, daily = DAILY, weekly = WEEKLY, monthly = MONTHLY) :
+    names = snapshot_names(library)
+    kept = retained(names, daily, weekly, monthly)
+    removed = [name for name in names if name not in kept]
+    for name in removed :
+        os.remove(manifest_path(library, name))
+    live = set()
+    for name in kept :
+        live.update(entry[0] for entry in
+                    read_manifest(library, name).values())
+    objects = os.path.join(snapshot_dir(library), OBJECT_DIR)
+    unused = 0
+    if (os.path.isdir(objects)) :
+        for name in os.listdir(objects) :
+            if (not name.startswith('.') and name not in live) :
+                os.remove(os.path.join(objects, name))
+                unused += 1
+    return len(removed), unused
+
+# restore()
+# Restores the files of a snapshot under an asset of the library,
+# given by its path relative to the library (by default, the whole
+# library). Items are written as tree.save() writes them, under their
+# locks; items locked elsewhere are left. Store chunks are restored
+# only if missing. Files not in the snapshot are left as they are.
+# Returns the numbers of items restored and left.
+def restore(library, name, asset = "") :
+    manifest = read_manifest(library, name)
+    objects = os.path.join(snapshot_dir(library), OBJECT_DIR)
+    prefix = os.path.normpath(asset) + os.sep if asset else ""
+    restored = left = 0
+    for relpath, entry in sorted(manifest.items()) :
+        if (not (relpath + os.sep).startswith(prefix)) :
+            continue
+        filepath = os.path.join(library, relpath)
+        with open(os.path.join(objects, entry[0]), "rb") as file :
+            data = file.read()
+        os.makedirs(os.path.dirname(filepath), exist_ok = True)
+        if (os.path.basename(os.path.dirname(relpath)) ==
+            store.STORE_DIR) :
+            if (not os.path.exists(filepath)) :
+                tree.write(filepath, data)
+            continue
+        with locks.exclusive(filepath) as acquired :
+            if (not acquired) :
+                left += 1
+                continue
+            tree.write(filepath, data)
+            restored += 1
+    return restored, left
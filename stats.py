@@ -23,10 +23,24 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 # SYNOPSIS
 # Provides functions calculating statistics.
 
+# NumPy is optional. If it is installed, statistics of items and
+# collections are computed with vectorised operations over the
+# flattened trees and training tables (see vectorised_stats());
+# otherwise by linear scans in python.
+# Items saved in the fixed layout are mapped into memory rather than
+# loaded (see mapped.py), and only the statuses and due dates of
+# their reachable solutions are read.
+
 import datetime
 import trainer
 import tree
-import os
+import instrument
+import paths
+
+try :
+    import numpy
+except ImportError :
+    numpy = None
 
 STAT_NEW = 0
 STAT_FIRST_STEP = 1
@@ -47,11 +61,16 @@ STAT_SIZE = 2
 # The number of positions with status NEW, FIRST_STEP, SECOND_STEP,
 # REVIEW, INACTIVE; the number of positions due for recall; the
 # number of positions reachable.
-def training_stats(node) :
+@instrument.timed("stats.training_stats")
+@instrument.visited("stats.training_stats.visits")
+def training_stats(node, table = None) :
+    if (table == None) :
+        table = node.game().table
     stats = [0,0,0,0,0,0,0]
     if (tree.is_solution(node)) :
-        status = node.training.status
-        due_date = node.training.due
+        training = tree.TrainingRow(table, node.row)
+        status = training.status
+        due_date = training.due
         if (status == tree.Status.NEW) :
             stats[STAT_NEW] += 1
         elif (status == tree.Status.FIRST_STEP) :
@@ -71,17 +90,52 @@ def training_stats(node) :
     if (not node.is_end()) :
         if (tree.is_solution(node.variations[0])) :
             # search only the main variation
-            child_stats = training_stats(node.variations[0])
+            child_stats = training_stats(node.variations[0], table)
             for index in range(len(stats)) :
                 stats[index] += child_stats[index]
         else :
             # search all variations
             for child in node.variations :
-                child_stats = training_stats(child)
+                child_stats = training_stats(child, table)
                 for index in range(len(stats)) :
                     stats[index] += child_stats[index]
     return stats
 
+# Indices into the training_stats() list for each Status value.
+STATUS_STATS = {tree.Status.NEW.value : STAT_NEW,
+                tree.Status.FIRST_STEP.value : STAT_FIRST_STEP,
+                tree.Status.SECOND_STEP.value : STAT_SECOND_STEP,
+                tree.Status.REVIEW.value : STAT_REVIEW,
+                tree.Status.INACTIVE.value : STAT_INACTIVE}
+
+# flat_training_stats()
+# Produces the training_stats() list for a FlatTree, by a linear
+# scan over its reachable solutions.
+def flat_training_stats(flat) :
+    mask = tree.reachable(flat)
+    solution = flat.solution
+    rows = flat.row
+    return rows_training_stats(flat.table, (rows[index]
+                                            for index in range(len(mask))
+                                            if mask[index] and
+                                            solution[index]))
+
+# rows_training_stats()
+# Produces the training_stats() list for the given rows of a
+# training table, those of the reachable solutions.
+def rows_training_stats(table, rows) :
+    stats = [0,0,0,0,0,0,0]
+    status = table.status
+    due = table.due
+    today = datetime.date.today().toordinal()
+    review = tree.Status.REVIEW.value
+    for row in rows :
+        stats[STATUS_STATS[status[row]]] += 1
+        if (status[row] == review and due[row] <= today) :
+            stats[STAT_DUE] += 1
+        stats[STAT_REACHABLE] += 1
+    return stats
+
 # total_training_positions()
 # Should be called on the root node of a PGN.
 def total_training_positions(node) :
@@ -94,43 +148,153 @@ def total_training_positions(node) :
             count += total_training_positions(child)                 
     return count
 
-# item_stats()
-# Compact statistics.
-# Returns a triple of statistics for the given item: the number
-# of positions waiting; of positions learned; and positions in total.
-def item_stats(filepath) :
-    root = tree.load(filepath)
-    stats = training_stats(root)
+# vectorised_reachable()
+# Returns a boolean NumPy array flagging the reachable nodes of a
+# FlatTree, as tree.reachable() does.
+# A node is reachable if every node on its path from the root is
+# `allowed' - i.e. is the main variation, or its parent's children
+# are not solutions. The conjunction along each path is computed
+# by pointer jumping: after each step, up[index] is an ancestor
+# twice as far away, and mask[index] covers the path up to it.
+def vectorised_reachable(flat) :
+    if (instrument.enabled) :
+        instrument.count("stats.vectorised_reachable.nodes", len(flat))
+    up = numpy.frombuffer(flat.parent, dtype = numpy.int32).copy()
+    up[0] = 0
+    first_child = numpy.frombuffer(flat.first_child,
+                                   dtype = numpy.int32)
+    solution = numpy.frombuffer(flat.solution, dtype = numpy.bool_)
+    first = first_child[up]
+    mask = ((first == numpy.arange(len(up))) | ~solution[first])
+    mask[0] = True
+    while (up.any()) :
+        mask = mask & mask[up]
+        up = up[up]
+    return mask
+
+# reachable_columns()
+# Returns NumPy arrays of the statuses and due dates of the
+# reachable solutions of a FlatTree.
+def reachable_columns(flat) :
+    mask = vectorised_reachable(flat)
+    mask &= numpy.frombuffer(flat.solution, dtype = numpy.bool_)
+    rows = numpy.frombuffer(flat.row, dtype = numpy.int32)[mask]
+    status = numpy.frombuffer(flat.table.status, dtype = numpy.int8)
+    due = numpy.frombuffer(flat.table.due, dtype = numpy.int32)
+    return status[rows], due[rows]
+
+# mapped_columns()
+# Returns NumPy arrays of the statuses and due dates of the
+# reachable solutions of a mapped item, as reachable_columns() does.
+# Only the pages holding those rows are read.
+def mapped_columns(item) :
+    rows = numpy.frombuffer(item.reachable, dtype = numpy.int32)
+    status = numpy.frombuffer(item.table.status, dtype = numpy.int8)
+    due = numpy.frombuffer(item.table.due, dtype = numpy.int32)
+    return status[rows], due[rows]
+
+# vectorised_stats()
+# Produces the training_stats() list from arrays of the statuses
+# and due dates of reachable solutions.
+def vectorised_stats(status, due) :
+    stats = [0,0,0,0,0,0,0]
+    counts = numpy.bincount(status, minlength = len(STATUS_STATS) + 1)
+    for value, index in STATUS_STATS.items() :
+        stats[index] = int(counts[value])
+    today = datetime.date.today().toordinal()
+    review = (status == tree.Status.REVIEW.value)
+    stats[STAT_DUE] = int(numpy.count_nonzero(review & (due <= today)))
+    stats[STAT_REACHABLE] = len(status)
+    return stats
+
+# item_training_stats()
+# Produces the training_stats() list for a FlatTree, using NumPy
+# if it is available.
+@instrument.timed("stats.item_training_stats")
+def item_training_stats(flat) :
+    if (numpy == None) :
+        return flat_training_stats(flat)
+    return vectorised_stats(*reachable_columns(flat))
+
+# mapped_training_stats()
+# Produces the training_stats() list for a mapped item, using NumPy
+# if it is available.
+@instrument.timed("stats.mapped_training_stats")
+def mapped_training_stats(item) :
+    if (numpy == None) :
+        return rows_training_stats(item.table, item.reachable)
+    return vectorised_stats(*mapped_columns(item))
+
+# compact_stats()
+# Converts a training_stats() list into compact statistics: the
+# number of positions waiting; of positions learned; and positions
+# in total.
+def compact_stats(stats) :
     waiting = stats[STAT_NEW] + stats[STAT_FIRST_STEP]
     waiting += stats[STAT_SECOND_STEP] + stats[STAT_DUE]
     learned = stats[STAT_REVIEW]
     size = stats[STAT_REACHABLE]
     return [waiting, learned, size]
 
+# item_stats()
+# Compact statistics.
+# Returns a triple of statistics for the given item: the number
+# of positions waiting; of positions learned; and positions in total.
+def item_stats(filepath) :
+    item = tree.load_mapped(filepath)
+    if (item != None) :
+        with item :
+            return compact_stats(mapped_training_stats(item))
+    flat = tree.load_flat(filepath)
+    return compact_stats(item_training_stats(flat))
+
 # item_stats_full()
 # Full set of statistics.
 # Returns the training_stats() list with the total number of
 # positions appended.
+# The item is loaded in full, so that it is in the item cache when
+# it is trained or managed from the item menu.
 def item_stats_full(filepath) :
-    root = tree.load(filepath)    
-    return training_stats(root) + [total_training_positions(root)]
+    tree.load(filepath)
+    flat = tree.load_flat(filepath)
+    total = sum(flat.solution)
+    return item_training_stats(flat) + [total]
+
+# items_stats()
+# Returns compact statistics for the given items together.
+# With NumPy, the columns of all items are concatenated and
+# counted at once.
+@instrument.timed("stats.items_stats")
+def items_stats(filepaths) :
+    if (numpy == None) :
+        stats = [0,0,0]
+        for filepath in filepaths :
+            temp_stats = item_stats(filepath)
+            stats = list(sum(stat) for stat in zip(stats, temp_stats))
+        return stats
+    columns = [item_columns(filepath) for filepath in filepaths]
+    if (len(columns) == 0) :
+        return [0,0,0]
+    status = numpy.concatenate([column[0] for column in columns])
+    due = numpy.concatenate([column[1] for column in columns])
+    return compact_stats(vectorised_stats(status, due))
+
+# item_columns()
+# Returns NumPy arrays of the statuses and due dates of the
+# reachable solutions of an item, mapping it if possible.
+def item_columns(filepath) :
+    item = tree.load_mapped(filepath)
+    if (item == None) :
+        return reachable_columns(tree.load_flat(filepath))
+    with item :
+        return mapped_columns(item)
 
 # category_stats()
 # Returns compact statistics for the given category.
 def category_stats(dirpath) :
-    stats = [0,0,0]
-    items = os.listdir(dirpath)
-    for item in items :
-        temp_stats = item_stats(dirpath + '/' + item)
-        stats = list(sum(stat) for stat in zip(stats, temp_stats))
-    return stats
+    return items_stats(paths.category_item_paths(dirpath))
 
 # category_stats()
 # Returns compact statistics for the given collection.
 def collection_stats(dirpath) :
-    stats = [0,0,0]
-    categories = os.listdir(dirpath)
-    for category in categories :
-        temp_stats = category_stats(dirpath + '/' + category)
-        stats = list(sum(stat) for stat in zip(stats, temp_stats))
-    return stats
+    return items_stats(paths.collection_item_paths(dirpath))
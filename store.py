@@ -0,0 +1,370 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE store.py
+
+# SYNOPSIS
+# Provides the content-addressed subtree store, in which the items of
+# a collection share the storage of identical subtrees of moves.
+# Typically only the functions dumps(), resolve() and collect() will
+# be used, through tree.save() and tree.load_raw().
+
+# A collection uses a store if it has a directory STORE_DIR. The
+# move structure of each of its items is then cut into chunks of
+# roughly CHUNK_NODES nodes, each saved once in the store as a file
+# named by the hash of its contents; a chunk refers to the chunks
+# below it by their hashes, so identical subtrees (in related items,
+# or transpositions within an item) hash alike and are stored once.
+# Chunks are cut bottom up, by the size of the subtree not already
+# cut, so that where a chunk is cut depends only on what is below it.
+# The item file itself holds a Reference: the initial position, the
+# metadata, the training table and the hash of the top chunk. The
+# training data is never shared: the table is saved with its rows in
+# preorder of the solutions, which are identified on loading by
+# their depth, as in tree.is_raw_solution() (see tree.rebuild()).
+
+# Only identical subtrees are shared. Items extending a common
+# repertoire below a few of its positions share all of it but the
+# chunks on the paths from those positions up to the root, which
+# differ from item to item (and so are stored once per item); items
+# extending it everywhere share little, since then most chunks hold
+# some extension. Items sharing only a line of opening moves share
+# nothing worth having: such a line is a few nodes.
+
+# A chunk file holds a header (numbers of nodes and references), the
+# move codes and numbers of children of its nodes in preorder, and
+# the references, as SHA-1 digests. A node whose subtree is another
+# chunk has the number of children CUT, and its move code is zero.
+# Chunks read are kept in memory, so that items sharing chunks are
+# loaded faster too.
+
+import os
+import sys
+import array
+import pickle
+import struct
+import hashlib
+import threading
+import collections
+
+import tree
+import paths
+import locks
+import mapped
+
+# Name of the store directory of a collection.
+STORE_DIR = ".store"
+
+# Number of nodes at which a subtree is cut into a chunk.
+CHUNK_NODES = 512
+
+# Number of children marking a node whose subtree is another chunk.
+CUT = 0xffff
+
+# Chunk header: numbers of nodes and references.
+HEADER = struct.Struct("<II")
+
+# Size of a reference.
+DIGEST_SIZE = 20
+
+# Number of nodes of the chunks kept in memory.
+CACHE_NODES = 1 << 22
+
+# The saved form of an item in a collection with a store.
+class Reference :
+    __slots__ = ('fen', 'meta', 'table', 'digest')
+
+    def __init__(self, fen, meta, table, digest) :
+        self.fen = fen
+        self.meta = meta
+        self.table = table
+        self.digest = digest
+
+    def __getstate__(self) :
+        return (self.fen, self.meta, self.table, self.digest)
+
+    def __setstate__(self, state) :
+        self.fen, self.meta, self.table, self.digest = state
+
+# A chunk read from the store: its codes and numbers of children, the
+# indices of its cut nodes and the digests of their chunks.
+class Chunk :
+    __slots__ = ('codes', 'counts', 'cuts', 'refs')
+
+    def __init__(self, codes, counts, refs) :
+        self.codes = codes
+        self.counts = counts
+        self.cuts = [index for index in range(len(counts))
+                     if counts[index] == CUT]
+        self.refs = refs
+
+# The chunks kept in memory, least recently used first, by digest.
+chunks = collections.OrderedDict()
+chunk_nodes = 0
+mutex = threading.Lock()
+
+# store_path()
+# Returns the path of the store of the collection of an item.
+def store_path(filepath) :
+    return os.path.join(paths.collection_path(filepath), STORE_DIR)
+
+# has_store()
+# Returns true if the collection of an item has a store.
+def has_store(filepath) :
+    return os.path.isdir(store_path(filepath))
+
+# dumps()
+# Returns the data of a tree to be saved at filepath: its Reference,
+# pickled, after saving its chunks in the store. Returns None if the
+# solutions of the tree are not those identified by depth, in which
+# case the tree must be saved in full.
+def dumps(filepath, root) :
+    codes, counts, rows = tree.flatten_structure(root)
+    if (not rows_by_depth(root, counts, rows)) :
+        return None
+    table = root.table
+    solutions = [row for row in rows if row >= 0]
+    ordered = tree.TrainingTable()
+    ordered.status = array.array('b', (table.status[row]
+                                       for row in solutions))
+    ordered.due = array.array('i', (table.due[row] for row in solutions))
+    ordered.previous_due = array.array('i', (table.previous_due[row]
+                                             for row in solutions))
+    digest = write_chunks(store_path(filepath), codes, counts)
+    return pickle.dumps(Reference(root.fen, root.meta, ordered, digest))
+
+# rows_by_depth()
+# Returns true if exactly the nodes identified as solutions by their
+# depth (see tree.rebuild()) have rows, given the flattened structure
+# of a tree.
+def rows_by_depth(root, counts, rows) :
+    parity = 0 if root.turn() != root.meta.colour else 1
+    levels = [counts[0]]
+    if (rows[0] >= 0) :
+        return False
+    for index in range(1, len(counts)) :
+        while (levels[-1] == 0) :
+            levels.pop()
+        levels[-1] -= 1
+        if ((rows[index] >= 0) != (len(levels) % 2 == parity)) :
+            return False
+        levels.append(counts[index])
+    return True
+
+# write_chunks()
+# Cuts a flattened structure into chunks and saves those not already
+# in the store. Returns the digest of the top chunk.
+def write_chunks(store, codes, counts) :
+    size, cut = cut_points(counts)
+    stack = []
+    digest = None
+    for index in range(len(codes)) :
+        while (len(stack) != 0 and stack[-1][3] <= index) :
+            digest = finish_chunk(store, stack)
+        if (cut[index]) :
+            if (len(stack) != 0) :
+                stack[-1][0].append(0)
+                stack[-1][1].append(CUT)
+            stack.append([array.array('H'), array.array('H'), [],
+                          index + size[index]])
+        stack[-1][0].append(codes[index])
+        stack[-1][1].append(counts[index])
+    while (len(stack) != 0) :
+        digest = finish_chunk(store, stack)
+    return digest
+
+# cut_points()
+# Returns the sizes of the subtrees of a flattened structure, and
+# flags marking the nodes at which chunks are cut: the root, and any
+# node whose subtree, less the chunks cut below it, has at least
+# CHUNK_NODES nodes.
+def cut_points(counts) :
+    total = len(counts)
+    size = [0] * total
+    cut = bytearray(total)
+    stack = []
+    for index in range(total - 1, -1, -1) :
+        full = 1
+        weight = 1
+        for child in range(counts[index]) :
+            child_full, child_weight = stack.pop()
+            full += child_full
+            weight += child_weight
+        size[index] = full
+        if (weight >= CHUNK_NODES or index == 0) :
+            cut[index] = 1
+            weight = 1
+        stack.append((full, weight))
+    return size, cut
+
+# finish_chunk()
+# Saves the chunk on top of the stack, whose digest becomes the next
+# reference of the chunk below. Returns the digest.
+def finish_chunk(store, stack) :
+    codes, counts, refs, end = stack.pop()
+    data = encode_chunk(codes, counts, refs)
+    digest = hashlib.sha1(data).digest()
+    if (len(stack) != 0) :
+        stack[-1][2].append(digest)
+    write_chunk(store, digest, data)
+    return digest
+
+# encode_chunk()
+# Returns the contents of a chunk file.
+def encode_chunk(codes, counts, refs) :
+    if (sys.byteorder == "big") :
+        codes = array.array('H', codes)
+        counts = array.array('H', counts)
+        codes.byteswap()
+        counts.byteswap()
+    return (HEADER.pack(len(codes), len(refs)) + codes.tobytes()
+            + counts.tobytes() + b"".join(refs))
+
+# decode_chunk()
+# Returns the Chunk held by the contents of a chunk file.
+def decode_chunk(data) :
+    size, references = HEADER.unpack_from(data)
+    start = HEADER.size
+    codes = array.array('H', data[start:start + 2 * size])
+    counts = array.array('H', data[start + 2 * size:start + 4 * size])
+    if (sys.byteorder == "big") :
+        codes.byteswap()
+        counts.byteswap()
+    start += 4 * size
+    refs = [data[start + DIGEST_SIZE * index:
+                 start + DIGEST_SIZE * (index + 1)]
+            for index in range(references)]
+    return Chunk(codes, counts, refs)
+
+# write_chunk()
+# Saves a chunk in the store, unless it is already there. The chunk
+# is written to a temporary file which then replaces any other copy,
+# so that a chunk is never seen half written. The store is checked
+# every time, since collect() in another process may have removed
+# the chunk since it was last written here.
+def write_chunk(store, digest, data) :
+    name = digest.hex()
+    filepath = os.path.join(store, name)
+    if (not os.path.exists(filepath)) :
+        temporary = os.path.join(
+            store, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temporary, "wb") as file :
+            file.write(data)
+        os.replace(temporary, filepath)
+
+# read_chunk()
+# Returns the Chunk with the given digest, from memory if possible.
+def read_chunk(store, digest) :
+    global chunk_nodes
+    with mutex :
+        chunk = chunks.get(digest)
+        if (chunk != None) :
+            chunks.move_to_end(digest)
+            return chunk
+    with open(os.path.join(store, digest.hex()), "rb") as file :
+        chunk = decode_chunk(file.read())
+    with mutex :
+        if (digest not in chunks) :
+            chunks[digest] = chunk
+            chunk_nodes += len(chunk.codes)
+            while (chunk_nodes > CACHE_NODES and len(chunks) > 1) :
+                evicted = chunks.popitem(last = False)[1]
+                chunk_nodes -= len(evicted.codes)
+    return chunk
+
+# resolve()
+# Returns the tree of the Reference loaded from filepath.
+def resolve(filepath, reference) :
+    codes = array.array('H')
+    counts = array.array('H')
+    expand(store_path(filepath), reference.digest, codes, counts)
+    return tree.rebuild(reference.fen, reference.meta, reference.table,
+                        codes, counts, None)
+
+# expand()
+# Appends the codes and numbers of children of the chunk with the
+# given digest, and of the chunks below it, in preorder.
+def expand(store, digest, codes, counts) :
+    chunk = read_chunk(store, digest)
+    start = 0
+    for cut, ref in zip(chunk.cuts, chunk.refs) :
+        codes.extend(chunk.codes[start:cut])
+        counts.extend(chunk.counts[start:cut])
+        expand(store, ref, codes, counts)
+        start = cut + 1
+    codes.extend(chunk.codes[start:])
+    counts.extend(chunk.counts[start:])
+
+# create()
+# Creates the store of a collection, and saves its items through it.
+# Returns the number of items saved.
+def create(collection) :
+    os.makedirs(os.path.join(collection, STORE_DIR), exist_ok = True)
+    saved = 0
+    for filepath in paths.collection_item_paths(collection) :
+        with locks.exclusive(filepath) as acquired :
+            if (acquired) :
+                tree.save(filepath, tree.load_raw(filepath))
+                saved += 1
+    return saved
+
+# collect()
+# Removes the chunks of a collection's store that no item refers to.
+# Nothing is removed unless every item of the collection can be
+# locked, since an item being saved may refer to chunks not yet
+# found in any file. Returns the number of chunks removed, or None.
+def collect(collection) :
+    store = os.path.join(collection, STORE_DIR)
+    filepaths = paths.collection_item_paths(collection)
+    taken = []
+    try :
+        for filepath in filepaths :
+            if (locks.holds(filepath)) :
+                continue
+            if (not locks.acquire(filepath, True, 0)) :
+                return None
+            taken.append(filepath)
+        live = set()
+        for filepath in filepaths :
+            data = tree.read(filepath)
+            if (mapped.is_mapped(data)) :
+                continue
+            reference = pickle.loads(data)
+            if (isinstance(reference, Reference)) :
+                mark(store, reference.digest, live)
+        removed = 0
+        for name in os.listdir(store) :
+            if (not name.startswith('.') and name not in live) :
+                os.remove(os.path.join(store, name))
+                removed += 1
+        return removed
+    finally :
+        for filepath in taken :
+            locks.release(filepath)
+
+# mark()
+# Adds the names of a chunk and the chunks below it to live.
+def mark(store, digest, live) :
+    name = digest.hex()
+    if (name in live) :
+        return
+    live.add(name)
+    for ref in read_chunk(store, digest).refs :
+        mark(store, ref, live)
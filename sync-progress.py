@@ -0,0 +1,76 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# sync-progress.py
+
+# SYNOPSIS
+# A script that carries training progress between copies of a
+# library, e.g. on two machines, by small bundles of the changes
+# made to each (see sync.py). Usage:
+#
+#     python3 sync-progress.py export <bundle> [<library-dir>]
+#     python3 sync-progress.py import <bundle> [<library-dir>]
+#
+# The library defaults to `Collections'. Exporting writes the
+# training progress of every solution answered since the last export
+# from this library; importing applies a bundle exported from the
+# other copy, keeping any solution answered here later than there.
+# To sync two machines, export on each and import on the other.
+
+import sys
+
+import sync
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) not in (3, 4) or args[1] not in ("export", "import")) :
+        print("usage: python3 sync-progress.py export <bundle> "
+              "[<library-dir>]")
+        print("       python3 sync-progress.py import <bundle> "
+              "[<library-dir>]")
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    bundle = sys.argv[2]
+    if (len(sys.argv) == 4) :
+        library = sys.argv[3].rstrip('/')
+    else :
+        library = "Collections"
+    if (sys.argv[1] == "export") :
+        count, items = sync.export_bundle(library, bundle)
+        print(f"Exported {count} solutions of {items} items.")
+    else :
+        try :
+            taken, kept, missing, left = sync.import_bundle(library, bundle)
+        except ValueError as error :
+            print(error)
+            quit()
+        print(f"Imported {taken} solutions; kept {kept} answered here "
+              "since.")
+        if (missing != 0) :
+            print(f"{missing} solutions are not in this library.")
+        if (left != 0) :
+            print(f"{left} items are in use and were left.")
@@ -0,0 +1,326 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE sync.py
+
+# SYNOPSIS
+# Provides the synchronisation of training progress between copies
+# of a library (e.g. on two machines) by bundles of the changes made
+# to each. Typically only the functions record(), export_bundle()
+# and import_bundle() will be used; the latter two through the
+# script sync-progress.py.
+
+# Every answer given in training is recorded in the journal, the
+# file JOURNAL at the top of the library: a fixed size RECORD of the
+# item and solution answered (with the ids of reviews.py) and the
+# time of the answer, in seconds since the epoch. The journal is
+# only appended to, so the answers since any point are those after
+# an offset in it; the offset up to which the journal was last
+# exported is kept in the file SYNC_POINT.
+# A bundle holds, for each item answered since the sync point, the
+# current training data of each solution answered (its status and
+# dates) with the time it was last answered, the solution being
+# identified by its line of move codes. Exporting loads only the
+# items answered, and importing only the items in the bundle.
+# As a bundle comes from another machine, it holds plain data only,
+# compressed: a BUNDLE_HEADER giving the size of an index, the index
+# in JSON (a list of the item paths, relative to the library, with
+# their numbers of solutions), then for each solution in turn a
+# BUNDLE_RECORD (status, due and previous due dates as ordinals, time
+# answered and length of the line in plies) and its line. A bundle
+# is checked in full before any of it is applied.
+# Conflicts are resolved by the latest answer: a solution answered
+# here later than in the bundle keeps its own training data.
+# Imported changes are not journaled, so are not exported back.
+
+import os
+import json
+import time
+import zlib
+import struct
+import datetime
+
+import tree
+import paths
+import locks
+import reviews
+
+# Name of the journal, at the top of the library.
+JOURNAL = ".journal"
+
+# Name of the file holding the offset of the journal last exported.
+SYNC_POINT = ".sync"
+
+# A record of the journal: item id, solution id and time.
+RECORD = struct.Struct("<IId")
+
+# Bundle header: size of the index.
+BUNDLE_HEADER = struct.Struct("<I")
+
+# A solution in a bundle: status, due and previous due dates, time and
+# number of plies of its line.
+BUNDLE_RECORD = struct.Struct("<biidH")
+
+# Number of records read at a time.
+BLOCK_RECORDS = 1 << 12
+
+# Journal files open for appending, by path.
+journals = {}
+
+# journal_path()
+# Returns the path of the journal of the library of an item.
+def journal_path(filepath) :
+    library = paths.library_path(filepath)
+    return os.path.join(library, JOURNAL)
+
+# record()
+# Appends the answer to a solution of the item at filepath to the
+# journal. As the journal is only an aid, training goes on if it
+# cannot be written.
+def record(filepath, solution) :
+    data = RECORD.pack(reviews.item_id(filepath),
+                       reviews.solution_id(solution), time.time())
+    path = journal_path(filepath)
+    try :
+        journal = journals.get(path)
+        if (journal == None) :
+            journal = open(path, "ab", buffering = 0)
+            journals[path] = journal
+        journal.write(data)
+    except OSError :
+        pass
+
+# read_sync_point()
+# Returns the offset of the journal of a library last exported.
+def read_sync_point(library) :
+    try :
+        with open(os.path.join(library, SYNC_POINT)) as file :
+            return int(file.read().strip())
+    except (OSError, ValueError) :
+        return 0
+
+# write_sync_point()
+# Records the offset of the journal of a library last exported.
+def write_sync_point(library, offset) :
+    with open(os.path.join(library, SYNC_POINT), "w") as file :
+        file.write(f"{offset}\n")
+
+# read_changes()
+# Returns the latest time of each answer in the journal of a library
+# after an offset, by pairs (item id, solution id), and the offset
+# of the end of the journal.
+def read_changes(library, offset) :
+    changes = {}
+    path = os.path.join(library, JOURNAL)
+    if (not os.path.exists(path)) :
+        return changes, offset
+    with open(path, "rb") as journal :
+        journal.seek(offset)
+        data = journal.read()
+    data = data[:len(data) - len(data) % RECORD.size]
+    for item, solution, moment in RECORD.iter_unpack(data) :
+        key = (item, solution)
+        changes[key] = max(moment, changes.get(key, moment))
+    return changes, offset + len(data)
+
+# read_recent()
+# Returns the latest time of each answer in the journal of a library
+# since a given time, by pairs (item id, solution id). The journal is
+# read backwards from its end, only as far as that time.
+def read_recent(library, since) :
+    recent = {}
+    path = os.path.join(library, JOURNAL)
+    if (not os.path.exists(path)) :
+        return recent
+    with open(path, "rb") as journal :
+        end = journal.seek(0, os.SEEK_END)
+        end -= end % RECORD.size
+        while (end > 0) :
+            start = max(0, end - BLOCK_RECORDS * RECORD.size)
+            journal.seek(start)
+            data = journal.read(end - start)
+            records = list(RECORD.iter_unpack(data))
+            for item, solution, moment in reversed(records) :
+                if (moment < since) :
+                    return recent
+                key = (item, solution)
+                recent[key] = max(moment, recent.get(key, moment))
+            end = start
+    return recent
+
+# export_bundle()
+# Writes to path a bundle of the training data of the solutions of a
+# library answered since its sync point, and moves the sync point to
+# the end of the journal. Returns the numbers of solutions and items
+# in the bundle.
+def export_bundle(library, path) :
+    changes, end = read_changes(library, read_sync_point(library))
+    by_item = {}
+    for (item, solution), moment in changes.items() :
+        by_item.setdefault(item, {})[solution] = moment
+    index = []
+    body = []
+    for filepath in paths.item_paths(library) :
+        answered = by_item.get(reviews.item_id(filepath))
+        if (answered == None) :
+            continue
+        root = tree.load_raw(filepath)
+        count = 0
+        for solution, line in solution_lines(root, answered) :
+            training = solution.training
+            body.append(BUNDLE_RECORD.pack(training.status.value,
+                                           training.due.toordinal(),
+                                           training.previous_due.toordinal(),
+                                           answered[zlib.crc32(line)],
+                                           len(line) // 2))
+            body.append(line)
+            count += 1
+        index.append([os.path.relpath(filepath, library), count])
+    header = json.dumps(index).encode()
+    data = BUNDLE_HEADER.pack(len(header)) + header + b"".join(body)
+    with open(path, "wb") as file :
+        file.write(zlib.compress(data, 9))
+    write_sync_point(library, end)
+    return sum(count for relpath, count in index), len(index)
+
+# solution_lines()
+# Generates the solutions of a tree whose ids are among the given
+# ids, with their lines of move codes, packed as for
+# reviews.solution_id().
+def solution_lines(root, ids) :
+    codes = []
+    stack = [(root, 0)]
+    while (len(stack) != 0) :
+        node, depth = stack.pop()
+        if (depth != 0) :
+            del codes[depth - 1:]
+            codes.append(node.code)
+        if (tree.is_solution(node)) :
+            line = struct.pack(f"<{len(codes)}H", *codes)
+            if (zlib.crc32(line) in ids) :
+                yield node, line
+        for child in reversed(node.variations) :
+            stack.append((child, depth + 1))
+
+# import_bundle()
+# Applies a bundle to a library. The training data of each solution
+# in the bundle is taken, unless the solution has been answered here
+# since. Items locked elsewhere are left. Returns the numbers of
+# solutions taken, kept (answered here since), and missing (their
+# items or lines are not in this library), and of items left.
+def import_bundle(library, path) :
+    items = read_bundle(path)
+    times = [record[4] for records in items.values()
+             for record in records]
+    recent = read_recent(library, min(times, default = 0))
+    taken = kept = missing = left = 0
+    for relpath, records in items.items() :
+        filepath = os.path.join(library, relpath)
+        if (not os.path.exists(filepath)) :
+            missing += len(records)
+            continue
+        with locks.exclusive(filepath) as acquired :
+            if (not acquired) :
+                left += 1
+                continue
+            root = tree.load(filepath)
+            item = reviews.item_id(filepath)
+            changed = False
+            for line, status, due, previous_due, moment in records :
+                solution = find_line(root, line)
+                if (solution == None or not tree.is_solution(solution)) :
+                    missing += 1
+                elif (recent.get((item, zlib.crc32(line)), 0) > moment) :
+                    kept += 1
+                else :
+                    table = root.table
+                    table.status[solution.row] = status
+                    table.due[solution.row] = due
+                    table.previous_due[solution.row] = previous_due
+                    taken += 1
+                    changed = True
+            if (changed) :
+                tree.save(filepath, root)
+    return taken, kept, missing, left
+
+# read_bundle()
+# Returns the solutions in a bundle by item path: for each, its line
+# and training data and the time it was answered. Raises ValueError
+# if the file is not a well-formed bundle.
+def read_bundle(path) :
+    with open(path, "rb") as file :
+        try :
+            data = zlib.decompress(file.read())
+        except zlib.error :
+            raise ValueError(f"{path}: not a bundle")
+    try :
+        size, = BUNDLE_HEADER.unpack_from(data)
+        offset = BUNDLE_HEADER.size + size
+        index = json.loads(data[BUNDLE_HEADER.size:offset])
+        items = {}
+        for relpath, count in index :
+            check_relpath(relpath)
+            records = []
+            for record in range(count) :
+                status, due, previous_due, moment, plies = \
+                    BUNDLE_RECORD.unpack_from(data, offset)
+                offset += BUNDLE_RECORD.size
+                line = data[offset:offset + 2 * plies]
+                offset += 2 * plies
+                tree.Status(status)
+                if (len(line) != 2 * plies or
+                    not valid_ordinal(due) or
+                    not valid_ordinal(previous_due)) :
+                    raise ValueError("invalid solution")
+                records.append((line, status, due, previous_due, moment))
+            items[relpath] = records
+    except (ValueError, TypeError, struct.error) as error :
+        raise ValueError(f"{path}: malformed bundle ({error})")
+    if (offset != len(data)) :
+        raise ValueError(f"{path}: malformed bundle (trailing data)")
+    return items
+
+# check_relpath()
+# Raises ValueError unless a path from a bundle names a file within
+# the library.
+def check_relpath(relpath) :
+    if (not isinstance(relpath, str) or os.path.isabs(relpath) or
+        os.path.normpath(relpath).split(os.sep)[0] in (os.curdir,
+                                                       os.pardir)) :
+        raise ValueError(f"invalid item path `{relpath}'")
+
+# valid_ordinal()
+# Returns true if a number is the ordinal of a date.
+def valid_ordinal(ordinal) :
+    return (1 <= ordinal <= datetime.date.max.toordinal())
+
+# find_line()
+# Returns the node of a tree reached by a line of move codes, packed
+# as for reviews.solution_id(), or None if the tree has no such line.
+def find_line(root, line) :
+    node = root
+    for code in struct.unpack(f"<{len(line) // 2}H", line) :
+        for child in node.variations :
+            if (child.code == code) :
+                node = child
+                break
+        else :
+            return None
+    return node
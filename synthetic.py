@@ -0,0 +1,187 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE synthetic.py
+
+# SYNOPSIS
+# Generates synthetic training trees and libraries for benchmarking.
+# As a script:
+#
+#     python3 synthetic.py <destination> <size> [<items>] [<seed>]
+#
+# writes a tree of the given number of nodes to the destination
+# item, or, if a number of items is given, a library of that many
+# such items (in one collection and category) to the destination
+# directory.
+# Trees are deterministic for a given seed. They are grown line by
+# line from the root, as a repertoire is: at a problem the line
+# follows the main solution (occasionally adding an alternative),
+# and at other nodes it follows an existing reply or branches into
+# a new one.
+
+import os
+import sys
+import random
+import datetime
+
+import chess
+
+import tree
+
+# Default proportions of solution statuses.
+DEFAULT_MIX = {tree.Status.NEW : 0.05,
+               tree.Status.FIRST_STEP : 0.02,
+               tree.Status.SECOND_STEP : 0.02,
+               tree.Status.REVIEW : 0.5,
+               tree.Status.INACTIVE : 0.41}
+
+# generate()
+# Returns a synthetic tree of the given number of nodes.
+# colour   the colour of the tree;
+# depth    the maximum length of a line, in plies;
+# branching the maximum number of replies at a non-problem node;
+# mix      a dictionary of solution status proportions;
+# legal    if true, moves are legal chess moves; otherwise they are
+#          arbitrary codes, which is much faster but means that
+#          positions cannot be reconstructed.
+def generate(size, colour = True, depth = 30, branching = 3,
+             seed = 0, mix = None, legal = True) :
+    rng = random.Random(seed)
+    root = tree.Root(chess.STARTING_FEN, tree.MetaData(colour))
+    count = 1
+    while (count < size) :
+        count += grow_line(root, rng, depth, branching, size - count,
+                           legal)
+    assign_statuses(root, rng, mix)
+    return root
+
+# grow_line()
+# Walks a line from the root, or from the node start, adding at most
+# limit new nodes. Returns the number of nodes added.
+def grow_line(root, rng, depth, branching, limit, legal, start = None) :
+    node = root if start == None else start
+    board = node.board() if legal else None
+    turn = root.turn()
+    ancestor = node
+    while (ancestor.parent != None) :
+        turn = not turn
+        ancestor = ancestor.parent
+    added = 0
+    length = rng.randint(depth // 2, depth)
+    for ply in range(length) :
+        if (added == limit) :
+            break
+        count = len(node.variations)
+        if (turn == root.meta.colour) :
+            extend = (count == 0 or rng.random() < 0.02)
+            chosen = 0
+        else :
+            extend = (count == 0 or
+                      (count < branching and rng.random() < 0.3))
+            chosen = rng.randrange(max(count, 1))
+        if (extend) :
+            child = new_child(root, node, board, rng,
+                              turn == root.meta.colour)
+            if (child == None) :
+                break
+            added += 1
+        else :
+            child = node.variations[chosen]
+        if (legal) :
+            board.push(child.move)
+        node = child
+        turn = not turn
+    return added
+
+# new_child()
+# Adds a new child to node, with a random move not already present;
+# returns the child, or None if no such move exists.
+def new_child(root, node, board, rng, is_solution) :
+    existing = [child.code for child in node.variations]
+    if (board != None) :
+        codes = [tree.encode_move(move) for move in board.legal_moves]
+        codes = [code for code in codes if code not in existing]
+        if (len(codes) == 0) :
+            return None
+        code = rng.choice(codes)
+    else :
+        code = rng.randrange(1, 4096)
+        while (code in existing) :
+            code = rng.randrange(1, 4096)
+    child = tree.Node(node, code)
+    if (is_solution) :
+        child.row = root.table.append(tree.TrainingData())
+    node.variations += (child,)
+    return child
+
+# assign_statuses()
+# Assigns random statuses, in the given proportions, to all
+# solutions. Solutions in review are given due dates around today.
+def assign_statuses(root, rng, mix) :
+    if (mix == None) :
+        mix = DEFAULT_MIX
+    statuses = list(mix)
+    weights = [mix[status] for status in statuses]
+    today = datetime.date.today().toordinal()
+    table = root.table
+    for row in range(len(table)) :
+        status = rng.choices(statuses, weights)[0]
+        table.status[row] = status.value
+        if (status == tree.Status.REVIEW) :
+            due = today + rng.randint(-5, 60)
+            table.due[row] = due
+            table.previous_due[row] = due - rng.randint(1, 60)
+
+# generate_library()
+# Writes a library of synthetic items to the given directory, in a
+# single collection and category, with distinct seeds. Keyword
+# arguments are passed to generate(). Returns the item filepaths.
+def generate_library(library, items, size, seed = 0, **options) :
+    category = library + "/Synthetic/Items"
+    os.makedirs(category, exist_ok = True)
+    filepaths = []
+    for item in range(items) :
+        filepath = f"{category}/{item}.rpt"
+        tree.save(filepath, generate(size, seed = seed + item, **options))
+        filepaths.append(filepath)
+    return filepaths
+
+# check_usage()
+# Checks that the command line paramaters make sense
+def check_usage(args) :
+    if (len(args) not in (3, 4, 5) or
+        not all(arg.isdigit() for arg in args[2:])) :
+        help_string = "usage: python3 synthetic.py"
+        help_string += " <destination> <size> [<items>] [<seed>]"
+        print(help_string)
+        quit()
+
+###############
+# entry point #
+###############
+
+if (__name__ == "__main__") :
+    check_usage(sys.argv)
+    size = int(sys.argv[2])
+    seed = int(sys.argv[4]) if len(sys.argv) == 5 else 0
+    if (len(sys.argv) == 3) :
+        tree.save(sys.argv[1], generate(size))
+    else :
+        generate_library(sys.argv[1], int(sys.argv[3]), size, seed)
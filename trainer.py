@@ -27,13 +27,21 @@ import datetime
 import chess
 import chess.pgn
 import random
-import copy
 import enum
+import concurrent.futures
 
 import tree
 import stats
 import paths
-from graphics import print_board, clear
+import locks
+import cache
+import writer
+import queues
+import reviews
+import sync
+import scheduler
+import instrument
+from graphics import print_board, print_in_use, clear, write, read
 
 # constants for results of training problems
 class Result(enum.Enum) :
@@ -44,43 +52,136 @@ class Result(enum.Enum) :
 
 # train()
 # Launches the training dialogue for the given tree.
+# The item is locked for the whole session (see locks.py), and its
+# saves are written before the lock is released, even if the session
+# ends with an error. A session starts from the item's prepared
+# queue, if it is up to date, and its queue is prepared again for the
+# next session (see queues.py).
 def train(filepath):
-    root = tree.load(filepath)
-    colour = root.meta.colour
-    queue = generate_queue(root)
-    play_queue(queue, root, filepath)
+    with locks.exclusive(filepath) as acquired :
+        if (not acquired) :
+            print_in_use()
+            return
+        root = None
+        try :
+            prepared = queues.read(filepath)
+            if (prepared != None) :
+                root = play_prepared(prepared, filepath)
+            else :
+                root = tree.load(filepath)
+                scheduler.use(filepath)
+                queue = generate_queue(root)
+                preload_queue(queue)
+                play_queue(queue, root, filepath, session_counts(root))
+        finally :
+            writer.background.flush(filepath)
+        if (root != None) :
+            queues.prepare(filepath, root)
 
 # play_queue()
 # Plays through the given a training queue.
-# The tree is saved at the close of this function, and never
-# before; i.e. functions called by this function should not save
-# the tree.
-def play_queue(queue, root, filepath) :
+# counts are the numbers of problems remaining, as returned by
+# session_counts(), and are kept up to date as results are handled.
+# Each result is recorded in the review log (see reviews.py).
+# The tree is saved after each result, in the background (see
+# writer.py), and by this function only; i.e. functions called by
+# this function should not save the tree.
+def play_queue(queue, root, filepath, counts) :
     while(len(queue) != 0) :
         node = queue.pop(0)
-        result = play_node(node, filepath)
+        result = play_node(node, filepath, counts)
         if (result == Result.PAUSE) :
             break
-        handle_result(result, node, queue)
-        tree.save(filepath, root)                        
+        answer(result, node, queue, root, filepath, counts)
+
+# play_prepared()
+# Plays through a prepared queue. The first card is shown from the
+# prepared queue alone, while the item is loaded in the background,
+# so the time it takes to appear does not depend on the size of the
+# item; the rest of the queue is played as by play_queue(). If the
+# prepared queue is out of date by then (e.g. the day has changed, and
+# the item was rolled over on loading), the rest of the queue is
+# generated from the item instead. Returns the root of the item, or
+# None if the queue is empty.
+def play_prepared(prepared, filepath) :
+    if (len(prepared.cards) == 0) :
+        return None
+    with concurrent.futures.ThreadPoolExecutor(1) as loader :
+        loading = loader.submit(tree.load, filepath)
+        result = play_card(prepared.cards[0], prepared, filepath)
+        root = loading.result()
+    scheduler.use(filepath)
+    whole = queues.read(filepath, True)
+    if (whole != None) :
+        queue = queues.resolve(root, whole)
+        node = queue.pop(0)
+        counts = list(whole.counts)
+    else :
+        node = queues.resolve(root, prepared)[0]
+        queue = [other for other in generate_queue(root)
+                 if other is not node]
+        preload_queue(queue)
+        counts = session_counts(root)
+    if (result != Result.PAUSE) :
+        answer(result, node, queue, root, filepath, counts)
+        play_queue(queue, root, filepath, counts)
+    return root
+
+# answer()
+# Records and handles the result of a solution, and saves the tree
+# in the background. The answer is journaled for synchronisation
+# (see sync.py). The scheduler is set for each answer, so that a
+# session running past midnight schedules with the new day's
+# histogram.
+def answer(result, node, queue, root, filepath, counts) :
+    reviews.record(filepath, node, result)
+    scheduler.use(filepath)
+    with writer.background.guard :
+        handle_result(result, node, queue, counts)
+    sync.record(filepath, node)
+    writer.background.save(filepath, root)
 
 # play_node()
 # Challenges the user to solve a problem and returns the result.
-def play_node(node, filepath) :
-    problem = copy.copy(node.parent)
-    solution = copy.copy(node)
-    if (pose_problem(filepath, problem) == Result.PAUSE) :
+def play_node(node, filepath, counts) :
+    problem = node.parent
+    solution = node
+    if (pose_problem(filepath, problem, counts) == Result.PAUSE) :
         return Result.PAUSE
     return show_solution(solution)
 
+# play_card()
+# As play_node(), for a card of a prepared queue (see queues.py).
+def play_card(card, prepared, filepath) :
+    board = chess.Board(card.fen)
+    status = tree.Status(card.status)
+    result = False
+    while (result == False) :
+        problem_title(filepath)
+        write(status_name(status) + counts_string(prepared.counts)
+              + "\n\n\n")
+        print_board(board, prepared.colour)
+        problem_options()
+        result = problem_prompt()
+    if (result == Result.PAUSE) :
+        return result
+    board.push(tree.decode_move(card.line[-1]))
+    result = False
+    while (result == False) :
+        print_board(board, prepared.colour)
+        solution_options(status)
+        result = solution_prompt(status)
+    return result
+
 # pose_problem()
 # Shows the user the problem.
-def pose_problem(filepath, problem) :
+def pose_problem(filepath, problem, counts) :
+    board = cache.boards.board(problem)
     result = False
     while (result == False) :
         problem_title(filepath)
-        info_line(problem)
-        print_board(problem.board(), problem.game().meta.colour)
+        info_line(problem, counts)
+        print_board(board, problem.game().meta.colour)
         problem_options()
         result = problem_prompt()
     return result
@@ -91,26 +192,30 @@ def problem_title(filepath) :
     clear()
     width = 18
     name = paths.item_name(filepath)
-    print("TRAINING ITEM ->".ljust(width) + name)
-    print("CATEGORY".ljust(width) + paths.category_name(filepath))
-    print("COLLECTION".ljust(width)+paths.collection_name(filepath))
-    print("")
+    write("TRAINING ITEM ->".ljust(width) + name)
+    write("CATEGORY".ljust(width) + paths.category_name(filepath))
+    write("COLLECTION".ljust(width)+paths.collection_name(filepath))
+    write("")
 
 # info_line()
-# Prints user information for the problem and the session.
-def info_line(problem) :
+# Prints user information for the problem and the session, given the
+# numbers of problems remaining.
+def info_line(problem, counts) :
     string = status_string(problem)
-    string += remaining_string(problem.game())
+    string += counts_string(counts)
     string += "\n\n\n"
-    print(string)
+    write(string)
 
 # status_string()
 # Prints the `status' of a problem, for the user's information.
 # This status is either NEW, LEARNING or REVIEW.
 def status_string(problem) :
+    return status_name(problem.variations[0].training.status)
+
+# status_name()
+# Returns the `status' shown for a solution with the given status.
+def status_name(status) :
     width = 18
-    solution = problem.variations[0]
-    status = solution.training.status
     if (status == tree.Status.NEW) :
         string = "NEW".ljust(width)
     elif (status == tree.Status.FIRST_STEP or
@@ -124,23 +229,51 @@ def status_string(problem) :
 # Prints the number of problems remaining in the session in the
 # form <NEW> | <LEARNING> | <REVIEW>.
 def remaining_string(root) :
-    info = stats.training_stats(root)        
-    new = str(info[stats.STAT_NEW])
-    learn = info[stats.STAT_FIRST_STEP]
-    learn = str(learn + info[stats.STAT_SECOND_STEP])
-    due = str(info[stats.STAT_DUE]) 
-    return new + " | " + learn + " | " + due
+    return counts_string(session_counts(root))
+
+# session_counts()
+# Returns the numbers of new, learning and due problems of a tree, as
+# a list, by a scan of the whole tree. A session does this once, and
+# then keeps the numbers up to date in handle_result(), so that the
+# cost of showing a card does not depend on the size of the item.
+def session_counts(root) :
+    info = stats.training_stats(root)
+    return [info[stats.STAT_NEW],
+            info[stats.STAT_FIRST_STEP] + info[stats.STAT_SECOND_STEP],
+            info[stats.STAT_DUE]]
+
+# count_index()
+# Returns the index into the list of session_counts() counting a
+# solution with the given training data, or None if none does.
+def count_index(training) :
+    status = training.status
+    if (status == tree.Status.NEW) :
+        return 0
+    if (status == tree.Status.FIRST_STEP or
+        status == tree.Status.SECOND_STEP) :
+        return 1
+    if (status == tree.Status.REVIEW and
+        training.due <= datetime.date.today()) :
+        return 2
+    return None
+
+# counts_string()
+# Returns the numbers of new, learning and due problems in the form
+# of remaining_string().
+def counts_string(counts) :
+    new, learn, due = counts
+    return str(new) + " | " + str(learn) + " | " + str(due)
 
 # problem_options()
 # Prints the options for the below the problem.
 def problem_options() :
-    print("\n\n<Enter> show solution")
-    print("'p' pause session")
+    write("\n\n<Enter> show solution")
+    write("'p' pause session")
 
 # problem_prompt()
 # Handles the prompt for the problem.
 def problem_prompt() :
-    command = input("\n:")
+    command = read("\n:")
     clear()
     if (command == "p") :
         return Result.PAUSE
@@ -152,31 +285,30 @@ def problem_prompt() :
 # show_solution()
 # Presents a solution to the user.
 def show_solution(solution) :
+    board = cache.boards.board(solution)
     result = False
     while(result == False) :
-        print_board(solution.board(), solution.game().meta.colour)
-        solution_options(solution)
-        result = solution_prompt(solution)
+        print_board(board, solution.game().meta.colour)
+        solution_options(solution.training.status)
+        result = solution_prompt(solution.training.status)
     return result
 
 # solution_options()
 # Prints user options for supplying the training result.
 # If a problem is NEW there are no options; otherwise the
 # user chooses between `easy,' `okay' or `hard'.
-def solution_options(solution) :
-    status = solution.training.status
+def solution_options(status) :
     if (status == tree.Status.NEW) :
-        print("\n\n\n<enter> continue\n")
+        write("\n\n\n<enter> continue\n")
     else :
-        print("\n'e'      easy")
-        print("<enter>  okay")
-        print("'h'      hard\n")
+        write("\n'e'      easy")
+        write("<enter>  okay")
+        write("'h'      hard\n")
 
 # solution_prompt()
 # Handles the solution prompt and returns the result.
-def solution_prompt(solution) :
-    status = solution.training.status
-    command = input(":")
+def solution_prompt(status) :
+    command = read(":")
     clear()
     if (status == tree.Status.NEW) :
         if (command == "") :
@@ -197,23 +329,53 @@ def solution_prompt(solution) :
 # Produces the training queue for the given tree.
 # The queue is a list of `solutions', each of which is a node in the
 # tree, whose parent is the corresponding `problem'.
+@instrument.timed("trainer.generate_queue")
+def generate_queue(root) :
+    return queue_solutions(root)
+
+# preload_queue()
+# Preloads the positions of the problems of a training queue into the
+# board cache, at the start of a session, so that showing a card does
+# not depend on the depth of its line.
+def preload_queue(queue) :
+    cache.boards.preload([node.parent for node in queue])
+
+# queue_solutions()
+# Produces the training queue below the given node.
 # This is recursive function.
 # A queue of at most one solution is produced for each node, and
 # added to the queue obtained by the recursive call to children.
 # All problems are searched, but only the first solution is
 # searched; this is why the main variation in the list of solutions
 # is the only solution trained.
-def generate_queue(node) :
+@instrument.visited("trainer.generate_queue.visits")
+def queue_solutions(node) :
     queue = []    
     if (tree.is_solution(node) and is_queueable(node)) :
         queue.append(node)
     if (not node.is_end()) :
         if (tree.is_solution(node.variations[0])) :
             child = node.variations[0]
-            queue += generate_queue(child)
+            queue += queue_solutions(child)
         else :
             for child in node.variations :
-                queue += generate_queue(child)
+                queue += queue_solutions(child)
+    return queue
+
+# generate_flat_queue()
+# Produces the same queue as generate_queue() from a FlatTree that
+# includes its nodes, by a linear scan.
+@instrument.timed("trainer.generate_flat_queue")
+def generate_flat_queue(flat) :
+    queue = []
+    mask = tree.reachable(flat)
+    solution = flat.solution
+    rows = flat.row
+    today = datetime.date.today().toordinal()
+    for index in range(len(mask)) :
+        if (mask[index] and solution[index] and
+            is_queueable_row(flat.table, rows[index], today)) :
+            queue.append(flat.nodes[index])
     return queue
 
 # is_queueable()
@@ -221,13 +383,20 @@ def generate_queue(node) :
 # Those marked as NEW, FIRST_STEP or SECOND_STEP are queued, along
 # with those marked REVIEW whose due date is on or before today.
 def is_queueable(solution) :
-    status = solution.training.status
-    due_date = solution.training.due
-    today = datetime.date.today()
-    if (status == tree.Status.NEW or
-        status == tree.Status.FIRST_STEP or
-        status == tree.Status.SECOND_STEP or
-        (status == tree.Status.REVIEW and due_date <= today)) :
+    table = solution.game().table
+    today = datetime.date.today().toordinal()
+    return is_queueable_row(table, solution.row, today)
+
+# is_queueable_row()
+# As is_queueable(), for the given row of a training table; today
+# is given as an ordinal.
+def is_queueable_row(table, row, today) :
+    status = table.status[row]
+    if (status == tree.Status.NEW.value or
+        status == tree.Status.FIRST_STEP.value or
+        status == tree.Status.SECOND_STEP.value or
+        (status == tree.Status.REVIEW.value and
+         table.due[row] <= today)) :
         return True
     else :
         return False
@@ -239,9 +408,14 @@ def is_queueable(solution) :
 # 2) the problem is scheduled for a later date.
 # In both cases the status (almost always) changes.
 # This function covers all cases.
+# If counts (see session_counts()) are given, they are updated for
+# the new status of the solution.
 # It could be rewritten with switch statements, but it is debatable
 # whether this 'pythonic' syntax is any better.
-def handle_result(result, solution, queue) :
+@instrument.timed("trainer.handle_result")
+def handle_result(result, solution, queue, counts = None) :
+    if (counts != None) :
+        before = count_index(solution.training)
     status = solution.training.status    
     root = solution.game()
     if (status == tree.Status.NEW) :
@@ -271,9 +445,17 @@ def handle_result(result, solution, queue) :
             schedule(solution, result)            
         elif (result == Result.OKAY) :
             schedule(solution, result)
-        elif (result == HARD) :
+        elif (result == Result.HARD) :
             requeue(solution, queue, tree.Status.FIRST_STEP)
 
+    if (counts != None) :
+        after = count_index(solution.training)
+        if (before != after) :
+            if (before != None) :
+                counts[before] -= 1
+            if (after != None) :
+                counts[after] += 1
+
 # schedule()
 # Schedules a solution based on the status, result, and previous
 # due date.
@@ -286,6 +468,8 @@ def schedule(solution, result) :
         solution.training.due = new_due_date(solution, result, today)
     solution.training.previous_due = today
     solution.training.status = tree.Status.REVIEW
+    if (scheduler.current != None) :
+        scheduler.current.add(solution.training.due)
 
 # first_due_date()
 # Determines the scheduled date for a solution which has been
@@ -300,6 +484,9 @@ def first_due_date(result, today) :
 # new_due_date()
 # Determines the scheduled date for a solution which has been
 # successfully recalled. 
+# The wait is drawn from the window between multiplier and
+# multiplier + 1 times the previous gap; with capacity-aware
+# scheduling, the scheduler chooses it (see scheduler.py).
 def new_due_date(solution, result, today) :
     if (result != Result.EASY) :
         multiplier = 2
@@ -308,8 +495,13 @@ def new_due_date(solution, result, today) :
     gap = (solution.training.due -
            solution.training.previous_due).days
     min_recall_wait = 365
-    wait = min(min_recall_wait,
-               int(gap * (multiplier + random.random())))
+    if (scheduler.current != None) :
+        low = min(min_recall_wait, gap * multiplier)
+        high = min(min_recall_wait, max(low, gap * (multiplier + 1) - 1))
+        wait = scheduler.current.choose(today, low, high)
+    else :
+        wait = min(min_recall_wait,
+                   int(gap * (multiplier + random.random())))
     return today + datetime.timedelta(days = wait)    
 
 # requeue()
@@ -23,9 +23,9 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 # SYNOPSIS
 # Provides the definition and interface for Chessic training trees.
 
-# A training tree is a python chess game (i.e. a tree of nodes),
-# with training data appended to particular nodes - those identified
-# as `solutions' to `problems'.
+# A training tree is a tree of nodes, each reached from its parent
+# by a move, with training data appended to particular nodes - those
+# identified as `solutions' to `problems'.
 # Every tree has a `colour' - the training player plays the pieces
 # of that colour.
 # A problem is a position (i.e. node) in which the training player
@@ -34,14 +34,49 @@ along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
 # The root node, by definition, is never a solution, but it may
 # be a problem.
 
-# Trees are saved and loaded using pickle. An implementation
-# based on a custom filetype is envisaged for future releases.
+# Nodes are instances of the compact class Node, which implements
+# the parts of the python chess GameNode interface used by Chessic.
+# Moves are stored as integer codes, and the training data of all
+# solutions is stored by column in a TrainingTable attached to the
+# root; a solution refers to its row of the table. Conversion to
+# and from python chess games happens only at the PGN boundary
+# (see from_game() and to_game()).
 
+# Trees are saved in a fixed layout of flat columns, which can be
+# mapped into memory and read in place (see mapped.py). Trees saved
+# by earlier versions were pickled: a root pickled its tree as flat
+# arrays rather than as linked nodes, and before that, trees were
+# pickled python chess games; both are still loaded, the latter
+# converted. In a collection with a subtree store, the moves of a
+# tree are saved in the store, shared with other items, and the item
+# file refers to them (see store.py). Item files may be compressed
+# (see compression.py).
+
+# The daily `rollover' of a tree (updating its metadata and statuses
+# on the first access of the day) is normally performed for the
+# whole library by the script rollover.py, which records its
+# completion in the file ROLLOVER_STAMP at the top of the library.
+# Trees loaded from a library rolled over today are not checked;
+# otherwise load() rolls the tree over itself.
+
+import io
+import os
+import gc
 import pickle
 import datetime
+import array
 import chess
+import chess.pgn
 import enum
-import copy
+
+import paths
+import cache
+import store
+import compression
+import mapped
+import writer
+import locks
+import instrument
 
 # Enumeration for training statuses.
 # Every solution in a tree has one of the following statuses.
@@ -52,7 +87,9 @@ class Status(enum.Enum) :
     REVIEW = 4
     INACTIVE = 5
 
-# Training data appended to a solution.
+# Training data for a single solution.
+# Used to initialise rows of the TrainingTable, and found in trees
+# saved by earlier versions.
 class TrainingData :
     def __init__(self) :
         today = datetime.date.today()        
@@ -77,6 +114,359 @@ class MetaData:
         self.new_remaining = self.new_limit
         self.new_marked = 0
 
+# Training data for all solutions of a tree, stored by column.
+# status holds Status values; due and previous_due hold dates as
+# ordinals (see datetime.date.toordinal()).
+class TrainingTable :
+    __slots__ = ('status', 'due', 'previous_due')
+
+    def __init__(self) :
+        self.status = array.array('b')
+        self.due = array.array('i')
+        self.previous_due = array.array('i')
+
+    def __len__(self) :
+        return len(self.status)
+
+    # append()
+    # Appends a row holding the given TrainingData; returns its index.
+    def append(self, data) :
+        self.status.append(data.status.value)
+        self.due.append(data.due.toordinal())
+        self.previous_due.append(data.previous_due.toordinal())
+        return len(self.status) - 1
+
+# A view of one row of a TrainingTable, with the attributes of
+# TrainingData.
+class TrainingRow :
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table, row) :
+        self.table = table
+        self.row = row
+
+    @property
+    def status(self) :
+        return Status(self.table.status[self.row])
+
+    @status.setter
+    def status(self, status) :
+        self.table.status[self.row] = status.value
+
+    @property
+    def due(self) :
+        return datetime.date.fromordinal(self.table.due[self.row])
+
+    @due.setter
+    def due(self, date) :
+        self.table.due[self.row] = date.toordinal()
+
+    @property
+    def previous_due(self) :
+        ordinal = self.table.previous_due[self.row]
+        return datetime.date.fromordinal(ordinal)
+
+    @previous_due.setter
+    def previous_due(self, date) :
+        self.table.previous_due[self.row] = date.toordinal()
+
+# encode_move()
+# Returns the integer code of a python chess move:
+# from_square | to_square << 6 | promotion << 12.
+def encode_move(move) :
+    code = move.from_square | (move.to_square << 6)
+    if (move.promotion != None) :
+        code |= move.promotion << 12
+    return code
+
+# decode_move()
+# Returns the python chess move with the given code.
+def decode_move(code) :
+    promotion = code >> 12
+    if (promotion == 0) :
+        promotion = None
+    return chess.Move(code & 63, (code >> 6) & 63, promotion)
+
+# Interned move codes, so that nodes with the same move share one
+# int object.
+code_objects = {}
+
+# A node of a training tree.
+# code is the code of the move leading to the node, variations is
+# a tuple of child nodes (the first being the main variation), and
+# row is the node's row in the training table if it is a solution,
+# and -1 otherwise.
+class Node :
+    __slots__ = ('parent', 'code', 'variations', 'row')
+
+    def __init__(self, parent, code) :
+        self.parent = parent
+        self.code = code_objects.setdefault(code, code)
+        self.variations = ()
+        self.row = -1
+
+    @property
+    def move(self) :
+        return decode_move(self.code)
+
+    # training
+    # The node's TrainingRow, or None if the node is not a solution.
+    @property
+    def training(self) :
+        if (self.row < 0) :
+            return None
+        return TrainingRow(self.game().table, self.row)
+
+    def game(self) :
+        node = self
+        while (node.parent != None) :
+            node = node.parent
+        return node
+
+    def board(self) :
+        codes = []
+        node = self
+        while (node.parent != None) :
+            codes.append(node.code)
+            node = node.parent
+        board = node.board()
+        for code in reversed(codes) :
+            board.push(decode_move(code))
+        return board
+
+    def is_end(self) :
+        return len(self.variations) == 0
+
+    def has_variation(self, move) :
+        return self.variation(move) != None
+
+    # variation()
+    # Returns the child reached by the given move, or None.
+    def variation(self, move) :
+        code = encode_move(move)
+        for child in self.variations :
+            if (child.code == code) :
+                return child
+        return None
+
+    def add_variation(self, move) :
+        child = Node(self, encode_move(move))
+        self.variations += (child,)
+        return child
+
+    def remove_variation(self, child) :
+        self.variations = tuple(variation for variation
+                                in self.variations
+                                if variation is not child)
+
+    def promote_to_main(self, child) :
+        self.variations = (child,) + tuple(variation for variation
+                                           in self.variations
+                                           if variation is not child)
+
+# The root node of a training tree.
+# fen is the initial position, meta the tree's MetaData and table
+# its TrainingTable.
+class Root(Node) :
+    __slots__ = ('fen', 'meta', 'table')
+
+    def __init__(self, fen, meta) :
+        Node.__init__(self, None, 0)
+        self.fen = fen
+        self.meta = meta
+        self.table = TrainingTable()
+
+    def game(self) :
+        return self
+
+    def board(self) :
+        return chess.Board(self.fen)
+
+    # turn()
+    # Returns the side to move in the initial position.
+    def turn(self) :
+        return self.fen.split()[1] == 'w'
+
+    def __reduce__(self) :
+        codes, counts, rows = flatten_structure(self)
+        return (rebuild, (self.fen, self.meta, self.table,
+                          codes, counts, rows))
+
+# flatten_structure()
+# Returns arrays of the move codes, numbers of children and rows
+# of the nodes of a tree, in preorder. If a list is given as nodes,
+# the nodes are appended to it in the same order.
+def flatten_structure(root, nodes = None) :
+    codes = array.array('H')
+    counts = array.array('H')
+    rows = array.array('i')
+    stack = [root]
+    while (len(stack) != 0) :
+        node = stack.pop()
+        if (nodes != None) :
+            nodes.append(node)
+        codes.append(node.code)
+        counts.append(len(node.variations))
+        rows.append(node.row)
+        stack += reversed(node.variations)
+    return codes, counts, rows
+
+# rebuild()
+# Rebuilds a tree from the arrays produced by flatten_structure().
+# If rows is None, the solutions are identified by their depth (as
+# in is_raw_solution()) and given the rows of the table in preorder.
+# The cyclic garbage collector is paused while the nodes are
+# created; otherwise it repeatedly scans the growing tree.
+@instrument.timed("tree.rebuild")
+def rebuild(fen, meta, table, codes, counts, rows) :
+    enabled = gc.isenabled()
+    gc.disable()
+    try :
+        if (rows == None) :
+            return rebuild_by_depth(fen, meta, table, codes, counts)
+        return rebuild_nodes(fen, meta, table, codes, counts, rows)
+    finally :
+        if (enabled) :
+            gc.enable()
+
+# rebuild_nodes()
+# Performs the work of rebuild().
+def rebuild_nodes(fen, meta, table, codes, counts, rows) :
+    root = Root(fen, meta)
+    root.table = table
+    stack = [[root, counts[0], []]]
+    for index in range(1, len(codes)) :
+        while (stack[-1][1] == 0) :
+            finish(stack.pop())
+        entry = stack[-1]
+        entry[1] -= 1
+        node = Node(entry[0], codes[index])
+        node.row = rows[index]
+        entry[2].append(node)
+        stack.append([node, counts[index], []])
+    while (len(stack) != 0) :
+        finish(stack.pop())
+    return root
+
+# rebuild_by_depth()
+# Performs the work of rebuild() when rows is None. A node is a
+# solution if its depth (the length of the stack when it is created)
+# has the parity of the solutions.
+def rebuild_by_depth(fen, meta, table, codes, counts) :
+    root = Root(fen, meta)
+    root.table = table
+    parity = 0 if root.turn() != meta.colour else 1
+    row = 0
+    stack = [[root, counts[0], []]]
+    for index in range(1, len(codes)) :
+        while (stack[-1][1] == 0) :
+            finish(stack.pop())
+        entry = stack[-1]
+        entry[1] -= 1
+        node = Node(entry[0], codes[index])
+        if (len(stack) % 2 == parity) :
+            node.row = row
+            row += 1
+        entry[2].append(node)
+        stack.append([node, counts[index], []])
+    while (len(stack) != 0) :
+        finish(stack.pop())
+    return root
+
+# finish()
+# Attaches the collected children of a node during rebuild().
+def finish(entry) :
+    entry[0].variations = tuple(entry[2])
+
+# A tree flattened into parallel arrays, in preorder.
+# Index 0 is the root. parent, first_child and next_sibling hold
+# node indices (-1 where there is none), code the move codes,
+# solution a flag for each solution and row the training table rows.
+# nodes holds the corresponding Node objects, or is None if the
+# tree was flattened without building them (see load_flat()).
+# Because a parent always precedes its children, properties that
+# propagate down the tree can be computed in a single linear scan;
+# see reachable().
+class FlatTree :
+    __slots__ = ('fen', 'meta', 'table', 'parent', 'first_child',
+                 'next_sibling', 'code', 'solution', 'row', 'nodes')
+
+    def __init__(self, fen, meta, table, size) :
+        self.fen = fen
+        self.meta = meta
+        self.table = table
+        self.parent = array.array('i', [-1]) * size
+        self.first_child = array.array('i', [-1]) * size
+        self.next_sibling = array.array('i', [-1]) * size
+        self.code = array.array('H', [0]) * size
+        self.solution = bytearray(size)
+        self.row = array.array('i', [-1]) * size
+        self.nodes = None
+
+    def __len__(self) :
+        return len(self.code)
+
+# flatten()
+# Returns the FlatTree of a tree, including its nodes.
+@instrument.timed("tree.flatten")
+def flatten(root) :
+    nodes = []
+    codes, counts, rows = flatten_structure(root, nodes)
+    flat = flat_tree(root.fen, root.meta, root.table,
+                     codes, counts, rows)
+    flat.nodes = nodes
+    return flat
+
+# flat_tree()
+# Builds a FlatTree from the arrays produced by flatten_structure().
+def flat_tree(fen, meta, table, codes, counts, rows) :
+    size = len(codes)
+    flat = FlatTree(fen, meta, table, size)
+    flat.code = codes
+    flat.row = rows
+    parent = flat.parent
+    first_child = flat.first_child
+    next_sibling = flat.next_sibling
+    solution = flat.solution
+    # stack entries: index, children remaining, last child seen
+    stack = [[0, counts[0], -1]]
+    for index in range(1, size) :
+        while (stack[-1][1] == 0) :
+            stack.pop()
+        entry = stack[-1]
+        entry[1] -= 1
+        parent[index] = entry[0]
+        if (entry[2] < 0) :
+            first_child[entry[0]] = index
+        else :
+            next_sibling[entry[2]] = index
+        entry[2] = index
+        if (rows[index] >= 0) :
+            solution[index] = 1
+        stack.append([index, counts[index], -1])
+    return flat
+
+# reachable()
+# Returns a bytearray flagging the nodes of a FlatTree that are
+# reachable in training: from each node, only the main solution is
+# followed if the children are solutions, and all children are
+# followed otherwise.
+def reachable(flat) :
+    parent = flat.parent
+    first_child = flat.first_child
+    solution = flat.solution
+    mask = bytearray(len(flat))
+    mask[0] = 1
+    if (instrument.enabled) :
+        instrument.count("tree.reachable.nodes", len(mask))
+    for index in range(1, len(mask)) :
+        up = parent[index]
+        if (mask[up]) :
+            first = first_child[up]
+            if (first == index or not solution[first]) :
+                mask[index] = 1
+    return mask
+
 # is_root()
 # Returns true if the given node is the root of the tree, false
 # otherwise.
@@ -93,47 +483,254 @@ def is_raw_solution(node) :
 
 # is_raw_problem()
 # Returns true if the given node is a problem, false otherwise.
+# The side to move alternates with each ply from the root.
 def is_raw_problem(node) :
-    node_turn = copy.copy(node).board().turn
-    colour = node.game().meta.colour
-    return node_turn == colour
+    depth = 0
+    while (node.parent != None) :
+        depth += 1
+        node = node.parent
+    node_turn = node.turn() != (depth % 2 == 1)
+    return node_turn == node.meta.colour
 
 # is_solution()
 # Returns true if the given node is a solution, false otherwise.
 # Performs much faster than is_raw_solution()
 def is_solution(node) :
-    return node.training != None
+    return node.row >= 0
 
 # save()
 # Saves a tree.
+# The tree is written to a temporary file which then replaces the
+# old one, so that a file is never seen half written (see locks.py).
+# The tree is kept in the item cache, stamped with the new file.
+@instrument.timed("tree.save")
 def save(filepath, root) :
-    with open(filepath, "wb") as file :
-        pickle.dump(root,file)
+    write(filepath, dumps(filepath, root))
+    cache.items.store(filepath, root)
+
+# dumps()
+# Returns the data of a tree to be saved at filepath: the tree in the
+# fixed layout, or, in a collection with a subtree store, its pickled
+# Reference (see store.py); compressed, if compression is enabled.
+def dumps(filepath, root) :
+    data = None
+    if (store.has_store(filepath)) :
+        data = store.dumps(filepath, root)
+    if (data == None) :
+        data = mapped.dumps(root)
+    return compression.encode(data)
+
+# write()
+# Writes a pickled tree to filepath, as save() does, without touching
+# the item cache; i.e. this function may be called from any thread.
+@instrument.timed("tree.write")
+def write(filepath, data) :
+    dirpath, name = os.path.split(filepath)
+    temporary = os.path.join(dirpath, f".{name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as file :
+        file.write(data)
+    os.replace(temporary, filepath)
+
+# read()
+# Returns the data of the item file at filepath, decompressed if need
+# be.
+def read(filepath) :
+    with open(filepath, "rb") as file :
+        return compression.decode(file.read())
 
 # load()
 # Loads a tree, returning its root node.
 # Upon loading, statuses are metadata are updated if the tree
-# was not accessed today already.
+# was not accessed today already, unless the whole library has
+# been rolled over today.
+# A tree is only read if it is not in the item cache or its file has
+# changed since; the same root is returned until then.
+# The rolled over tree is only saved if no other process holds the
+# item's lock; otherwise that process saves it in due course.
+# Saves of the item pending in the background are written first.
+@instrument.timed("tree.load")
 def load(filepath) :
-    with open(filepath, "rb") as file :
-        root = pickle.load(file)
-    if (root.meta.latest_access < datetime.date.today()) :
-        update_meta(root)
-        update_statuses(root)
-        save(filepath, root)
+    writer.background.flush(filepath)
+    entry = cache.items.lookup(filepath)
+    if (entry == None) :
+        entry = cache.items.store(filepath, load_raw(filepath))
+    root = entry.root
+    if (not library_rolled_over(filepath) and needs_rollover(root)) :
+        rollover(root)
+        with locks.exclusive(filepath, 0) as acquired :
+            if (acquired) :
+                save(filepath, root)
+    return root
+
+# load_raw()
+# Loads a tree without rolling it over.
+# Trees saved as python chess games are converted, and those saved
+# in a subtree store are resolved.
+@instrument.timed("tree.load_raw")
+def load_raw(filepath) :
+    writer.background.flush(filepath)
+    with locks.shared(filepath) :
+        data = read(filepath)
+    if (mapped.is_mapped(data)) :
+        return mapped.loads(data, rebuild)
+    root = pickle.loads(data)
+    if (isinstance(root, store.Reference)) :
+        root = store.resolve(filepath, root)
+    elif (isinstance(root, chess.pgn.GameNode)) :
+        root = from_game(root, root.meta.colour)
     return root
 
+# load_flat()
+# Loads a tree as a FlatTree, without building its nodes.
+# If the tree needs rolling over, or is saved in a subtree store, it
+# is loaded in full first.
+# A tree in the item cache is flattened instead, once.
+@instrument.timed("tree.load_flat")
+def load_flat(filepath) :
+    writer.background.flush(filepath)
+    entry = cache.items.lookup(filepath)
+    if (entry != None and
+        (library_rolled_over(filepath) or not needs_rollover(entry.root))) :
+        if (entry.flat == None) :
+            entry.flat = flatten(entry.root)
+        return entry.flat
+    with locks.shared(filepath) :
+        data = read(filepath)
+    if (mapped.is_mapped(data)) :
+        flat = mapped.loads(data, flat_tree)
+    else :
+        flat = FlatUnpickler(io.BytesIO(data)).load()
+    if (not isinstance(flat, FlatTree) or
+        (not library_rolled_over(filepath) and needs_rollover(flat))) :
+        flat = flatten(load(filepath))
+    return flat
+
+# load_mapped()
+# Maps the item file at filepath into memory, returning a
+# mapped.MappedItem, which must be closed when done with; or None if
+# the file is not in the fixed layout (e.g. it is compressed), or the
+# tree needs rolling over. Saves of the item pending in the
+# background are written first.
+def load_mapped(filepath) :
+    writer.background.flush(filepath)
+    with locks.shared(filepath) :
+        item = mapped.open_item(filepath)
+    if (item != None and not library_rolled_over(filepath) and
+        needs_rollover(item)) :
+        item.close()
+        return None
+    return item
+
+# An unpickler that reads a saved tree as a FlatTree.
+class FlatUnpickler(pickle.Unpickler) :
+    def find_class(self, module, name) :
+        if (module == __name__ and name == "rebuild") :
+            return flat_tree
+        return pickle.Unpickler.find_class(self, module, name)
+
+# needs_rollover()
+# Returns true if the tree has not been accessed today.
+def needs_rollover(root) :
+    return root.meta.latest_access < datetime.date.today()
+
+# rollover()
+# Updates the metadata and statuses of a tree on its first access
+# of the day.
+@instrument.timed("tree.rollover")
+def rollover(root) :
+    update_meta(root)
+    update_statuses(root)
+
+# rollover_item()
+# Rolls over the tree saved at filepath, if necessary.
+# Returns true if the tree was rolled over, and None if it is locked
+# by another process.
+def rollover_item(filepath) :
+    with locks.exclusive(filepath, 0) as acquired :
+        if (not acquired) :
+            return None
+        root = load_raw(filepath)
+        if (not needs_rollover(root)) :
+            return False
+        rollover(root)
+        save(filepath, root)
+        return True
+
+# Name of the file recording the date of the last library rollover.
+ROLLOVER_STAMP = ".rollover"
+
+# Dates of the last rollover, cached by library path.
+rollover_dates = {}
+
+# record_rollover()
+# Records that every tree in the library was rolled over today.
+def record_rollover(library) :
+    today = datetime.date.today()
+    with open(library + '/' + ROLLOVER_STAMP, "w") as file :
+        file.write(today.isoformat() + "\n")
+    rollover_dates[library] = today
+
+# library_rolled_over()
+# Returns true if the library containing the tree at filepath
+# was rolled over today.
+def library_rolled_over(filepath) :
+    library = paths.library_path(filepath)
+    today = datetime.date.today()
+    if (rollover_dates.get(library) != today) :
+        stamp = library + '/' + ROLLOVER_STAMP
+        if (not os.path.exists(stamp)) :
+            return False
+        with open(stamp) as file :
+            date = datetime.date.fromisoformat(file.read().strip())
+        rollover_dates[library] = date
+    return rollover_dates[library] == today
+
 # create()
 # Creates a new tree.
 # Colour is the tree colour; the root node takes the initial
 # position specified by board.
 def create(filepath, board, colour) :
-    root = chess.pgn.Game()
-    root.setup(board)
-    root.meta = MetaData(colour)
-    root.training = None
+    root = Root(board.fen(), MetaData(colour))
     save(filepath, root)
 
+# from_game()
+# Returns the tree for a python chess game, to be trained by the
+# given colour. Training data and metadata attached to the game
+# (by earlier versions of Chessic) are kept; otherwise defaults
+# are used.
+def from_game(game, colour) :
+    root = Root(game.board().fen(), getattr(game, "meta", None))
+    if (root.meta == None) :
+        root.meta = MetaData(colour)
+    stack = [(game, root, root.turn())]
+    while (len(stack) != 0) :
+        game_node, node, turn = stack.pop()
+        children = []
+        for game_child in game_node.variations :
+            child = Node(node, encode_move(game_child.move))
+            if (turn == colour) :
+                data = getattr(game_child, "training", None)
+                if (data == None) :
+                    data = TrainingData()
+                child.row = root.table.append(data)
+            children.append(child)
+            stack.append((game_child, child, not turn))
+        node.variations = tuple(children)
+    return root
+
+# to_game()
+# Returns the python chess game for a tree, without training data.
+def to_game(root) :
+    game = chess.pgn.Game()
+    game.setup(root.board())
+    stack = [(root, game)]
+    while (len(stack) != 0) :
+        node, game_node = stack.pop()
+        for child in node.variations :
+            game_child = game_node.add_variation(child.move)
+            stack.append((child, game_child))
+    return game
+
 # update_statuses()
 # Updates the statuses of all solutions in the tree.
 # Any incomplete learning is ignored, and the first n INACTIVE nodes
@@ -141,6 +738,7 @@ def create(filepath, board, colour) :
 # today. The maximum number of learning actions is set by
 # MetaData.new_limit, and the number remaining by
 # MetaData.new_remaining
+@instrument.timed("tree.update_statuses")
 def update_statuses(root) :
     erase_incomplete_learning(root)
     reset_new_marked(root)        
@@ -151,9 +749,32 @@ def update_statuses(root) :
 def add_child(node, move) :
     child = node.add_variation(move)
     if (is_raw_solution(child)) :
-        child.training = TrainingData()
-    else :
-        child.training = None
+        child.row = node.game().table.append(TrainingData())
+
+# remove_child()
+# Removes a node, and the subtree below it, from the tree.
+# The training table is compacted to the remaining solutions.
+def remove_child(node, child) :
+    node.remove_variation(child)
+    compact(node.game())
+
+# compact()
+# Rebuilds the training table of a tree so that it holds exactly
+# the rows of the tree's solutions, in preorder.
+@instrument.timed("tree.compact")
+def compact(root) :
+    old = root.table
+    table = TrainingTable()
+    stack = [root]
+    while (len(stack) != 0) :
+        node = stack.pop()
+        if (is_solution(node)) :
+            table.status.append(old.status[node.row])
+            table.due.append(old.due[node.row])
+            table.previous_due.append(old.previous_due[node.row])
+            node.row = len(table) - 1
+        stack += reversed(node.variations)
+    root.table = table
 
 # reset_new_marked()
 # Sets Meta.new_marked to zero.
@@ -172,32 +793,40 @@ def update_meta(root) :
 # erase_incomplete_learning()
 # Sets all `learning' statuses (i.e. NEW, FIRST_STEP and SECOND_STEP)
 # to INACTIVE.
-def erase_incomplete_learning(node) :
-    if (is_solution(node) and node.training.status != Status.REVIEW):
-        node.training.status = Status.INACTIVE
+@instrument.visited("tree.erase_incomplete_learning.visits")
+def erase_incomplete_learning(node, status = None) :
+    if (status == None) :
+        status = node.game().table.status
+    if (is_solution(node) and
+        status[node.row] != Status.REVIEW.value) :
+        status[node.row] = Status.INACTIVE.value
     if (not node.is_end()) :
         if (is_solution(node.variations[0])) :
-            erase_incomplete_learning(node.variations[0])
+            erase_incomplete_learning(node.variations[0], status)
         else :
             for child in node.variations :
-                erase_incomplete_learning(child)                
+                erase_incomplete_learning(child, status)
 
 # seek_new()
 # As long as there are learning actions remaining for today,
 # finds inactive nodes and sets their status as NEW.
 # Assumes that there is no incomplete learning.
-def seek_new(node) :
-    remaining = node.game().meta.new_remaining
-    marked = node.game().meta.new_marked
+@instrument.visited("tree.seek_new.visits")
+def seek_new(node, root = None) :
+    if (root == None) :
+        root = node.game()
+    remaining = root.meta.new_remaining
+    marked = root.meta.new_marked
     if (remaining <= marked) :
         return
+    status = root.table.status
     if (is_solution(node) and
-        node.training.status == Status.INACTIVE) :
-        node.training.status = Status.NEW
-        node.game().meta.new_marked += 1
+        status[node.row] == Status.INACTIVE.value) :
+        status[node.row] = Status.NEW.value
+        root.meta.new_marked += 1
     if (not node.is_end()) :
         if (is_solution(node.variations[0])) :
-            seek_new(node.variations[0])
+            seek_new(node.variations[0], root)
         else :
             for child in node.variations :
-                seek_new(child)                
+                seek_new(child, root)
@@ -0,0 +1,138 @@
+"""
+Copyright Joshua Blinkhorn 2021
+
+This file is part of Chessic.
+
+Chessic is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Chessic is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Chessic.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Chessic v1.0
+# MODULE writer.py
+
+# SYNOPSIS
+# Provides background saving of items, so that the trainer and the
+# manager never wait for the disk between cards or edits.
+# Typically only the instance `background' will be used:
+#
+#     with writer.background.guard :
+#         ... modify the tree ...
+#     writer.background.save(filepath, root)
+#     writer.background.flush(filepath)
+
+# save() only records that the tree is to be saved; a single writer
+# thread pickles (see tree.dumps()) and writes it. Saves of the same
+# item are coalesced: a save that arrives while an earlier one is
+# still pending replaces it, and since the tree is pickled when it
+# is written, the latest state is always the one written. The tree
+# is kept in the item cache, as by tree.save(); once its file is
+# written, the cache entry is stamped with the new file.
+
+# The writer thread pickles a tree holding guard, so a tree that may
+# have a save pending must only be modified holding guard too; the
+# snapshot is then always consistent. Modifications are quick, so the
+# writer never waits long, and the caller only waits if it modifies a
+# tree while it is being pickled.
+
+# flush() waits until the pending saves of an item (or of all items)
+# are written. An item must be flushed before its lock is released,
+# and is flushed before it is loaded (see tree.load()), so that no
+# other reader ever sees an older state than the one last saved.
+# Every item is flushed at exit.
+
+import atexit
+import threading
+
+import tree
+import cache
+
+# The background writer.
+# pending maps the filepath of each item waiting to be written to its
+# root, in the order of their first saves; writing is the filepath
+# being written, if any; errors maps filepaths to errors raised by
+# their last writes.
+class Writer :
+    def __init__(self) :
+        self.pending = {}
+        self.writing = None
+        self.errors = {}
+        self.condition = threading.Condition()
+        self.guard = threading.Lock()
+        self.thread = None
+
+    # save()
+    # Saves a tree in the background.
+    def save(self, filepath, root) :
+        cache.items.store(filepath, root)
+        with self.condition :
+            self.pending[filepath] = root
+            if (self.thread == None) :
+                self.thread = threading.Thread(target = self.run,
+                                               daemon = True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    # flush()
+    # Waits until the pending saves of the item at filepath, or of all
+    # items if filepath is None, are written. An error raised by the
+    # last write of an item is raised here.
+    def flush(self, filepath = None) :
+        with self.condition :
+            while (self.busy(filepath)) :
+                self.condition.wait()
+            if (filepath == None) :
+                errors = list(self.errors.values())
+                self.errors.clear()
+            else :
+                errors = [self.errors.pop(filepath)] \
+                    if filepath in self.errors else []
+        if (len(errors) != 0) :
+            raise errors[0]
+
+    # busy()
+    # Returns true if the item at filepath, or any item if filepath is
+    # None, has a save pending or being written.
+    def busy(self, filepath) :
+        if (filepath == None) :
+            return len(self.pending) != 0 or self.writing != None
+        return filepath in self.pending or self.writing == filepath
+
+    # run()
+    # The writer thread: writes pending saves, oldest item first.
+    def run(self) :
+        while (True) :
+            with self.condition :
+                while (len(self.pending) == 0) :
+                    self.condition.wait()
+                filepath = next(iter(self.pending))
+                root = self.pending.pop(filepath)
+                self.writing = filepath
+            error = None
+            try :
+                with self.guard :
+                    data = tree.dumps(filepath, root)
+                tree.write(filepath, data)
+                cache.items.restamp(filepath, root)
+            except Exception as caught :
+                error = caught
+            with self.condition :
+                self.writing = None
+                if (error != None) :
+                    self.errors[filepath] = error
+                else :
+                    self.errors.pop(filepath, None)
+                self.condition.notify_all()
+
+# The writer of this process, flushed at exit.
+background = Writer()
+atexit.register(background.flush)